@@ -1,18 +1,26 @@
-from mbientlab.metawear import MetaWear, libmetawear, parse_value
+from mbientlab.metawear import MetaWear, libmetawear
 from mbientlab.metawear.cbindings import *
 from time import sleep
 from threading import Event
 import platform
 import sys
+import os
 import numpy as np
 from PyQt5 import QtWidgets
 from PyQt5.QtWidgets import QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, QWidget, QLabel, QPushButton
 from PyQt5.QtCore import QTimer
 import pyqtgraph as pg  # Importing pyqtgraph for plotting
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Streaming'))
+from fast_decoder import FastDecoder
+from live_plot import FrameTimer, LivePlot
+from ring_buffer import SampleRingBuffer, CARTESIAN_CHANNELS
+
+BUFFER_CAPACITY = 100 * 60 * 10  # 10 minutes of data at 100 Hz
+
 class SharedData:
     def __init__(self):
-        self.values = None
+        self.values = SampleRingBuffer(CARTESIAN_CHANNELS, BUFFER_CAPACITY)
 
 class State:
     def __init__(self, device, shared_data):
@@ -20,12 +28,11 @@ class State:
         self.samples = 0
         self.callback = FnVoid_VoidP_DataP(self.gyro_data_handler)
         self.shared_data = shared_data
+        self.decoder = FastDecoder(shared_data.values, DataTypeId.CARTESIAN_FLOAT)
 
     def gyro_data_handler(self, ctx, data):
-        values = parse_value(data)
-        self.shared_data.values = {'x': values.x, 'y': values.y, 'z': values.z}
+        self.decoder.decode(data)
         self.samples += 1
-        print(f"x: {values.x}, y: {values.y}, z: {values.z}")
 
 # Where MAC1 = MAC address of MetaSensor
 # MAC1 = 'ED:5A:87:F4:51:74'
@@ -77,16 +84,15 @@ class SensorsInterface(QMainWindow):  # Define a class that inherits from QMainW
         self.control_layout.addWidget(self.start_button)
         self.control_layout.addWidget(self.stop_button)
 
-        # Plot data arrays
-        self.x_data = np.array([])  # Initialize an empty array for X-axis data
-        self.y_data = np.array([])  # Initialize an empty array for Y-axis data
-        self.z_data = np.array([])  # Initialize an empty array for Z-axis data
-
         # Plot curves
         self.x_curve = self.plot_widget.plot(pen='r', name="X-axis")  # Create a curve for X-axis data with red color
         self.y_curve = self.plot_widget.plot(pen='g', name="Y-axis")  # Create a curve for Y-axis data with green color
         self.z_curve = self.plot_widget.plot(pen='b', name="Z-axis")  # Create a curve for Z-axis data with blue color
 
+        # Curves fed from the ring buffer of the sensor
+        self.plot = LivePlot(self.shared_data.values, {'x': self.x_curve, 'y': self.y_curve, 'z': self.z_curve})
+        self.frame_timer = FrameTimer('Plots')
+
         # Timer for updating data
         self.timer = QTimer()  # Create a QTimer object
         self.timer.timeout.connect(self.update_data)  # Connect the timer's timeout signal to the update_data method
@@ -126,21 +132,16 @@ class SensorsInterface(QMainWindow):  # Define a class that inherits from QMainW
         self.timer.stop()  # Stop the timer, stopping the data updates
 
     def update_data(self):
-        if self.shared_data.values is not None:
-            new_data = self.shared_data.values
-            self.x_data = np.append(self.x_data, new_data['x'])
-            self.y_data = np.append(self.y_data, new_data['y'])
-            self.z_data = np.append(self.z_data, new_data['z'])
-
-            # Update the plot curves to show only the last 50 data points
-            self.x_curve.setData(self.x_data[-50:])
-            self.y_curve.setData(self.y_data[-50:])
-            self.z_curve.setData(self.z_data[-50:])
+        self.frame_timer.start()
+        new = self.plot.update()  # Draws every sample received since the last frame
+        if new:
+            new_data = self.plot.latest()
 
             # Update the labels with the latest data
             self.x_label.setText(f"X-axis: {new_data['x']:.2f}")
             self.y_label.setText(f"Y-axis: {new_data['y']:.2f}")
             self.z_label.setText(f"Z-axis: {new_data['z']:.2f}")
+        self.frame_timer.stop(new)
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)  # Create a QApplication
@@ -1,4 +1,4 @@
-from mbientlab.metawear import MetaWear, libmetawear, parse_value
+from mbientlab.metawear import MetaWear, libmetawear
 from mbientlab.metawear.cbindings import *
 from time import sleep
 import sys
@@ -8,9 +8,17 @@ from PyQt5.QtWidgets import QApplication, QMainWindow, QVBoxLayout, QHBoxLayout,
 from PyQt5.QtCore import QTimer
 import pyqtgraph as pg  # Importing pyqtgraph for plotting
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Streaming'))
+from fast_decoder import FastDecoder
+from live_plot import FrameTimer, LivePlot
+from ring_buffer import SampleRingBuffer, CARTESIAN_CHANNELS
+
+BUFFER_CAPACITY = 100 * 60 * 10  # 10 minutes of data at 100 Hz
+
 class SharedData:
     def __init__(self):
-        self.values = {'accel': None, 'gyro': None, 'mag': None}
+        # One ring buffer per sensor, each one written by its own callback
+        self.values = {sensor: SampleRingBuffer(CARTESIAN_CHANNELS, BUFFER_CAPACITY) for sensor in ('accel', 'gyro', 'mag')}
 
 class State:
     def __init__(self, device, shared_data):
@@ -20,38 +28,19 @@ class State:
         self.gyro_callback = FnVoid_VoidP_DataP(self.gyro_data_handler)
         self.mag_callback = FnVoid_VoidP_DataP(self.mag_data_handler)
         self.shared_data = shared_data
+        self.accel_decoder = FastDecoder(shared_data.values['accel'], DataTypeId.CARTESIAN_FLOAT)
+        self.gyro_decoder = FastDecoder(shared_data.values['gyro'], DataTypeId.CARTESIAN_FLOAT)
+        self.mag_decoder = FastDecoder(shared_data.values['mag'], DataTypeId.CARTESIAN_FLOAT)
 
     def accel_data_handler(self, ctx, data):
-        values = parse_value(data)
-        self.shared_data.values['accel'] = {'x': values.x, 'y': values.y, 'z': values.z}
-        print(f"accel_x: {values.x}, accel_y: {values.y}, accel_z: {values.z}")
-        self.combine_sensor_data()
+        self.accel_decoder.decode(data)
+        self.samples += 1
 
     def gyro_data_handler(self, ctx, data):
-        values = parse_value(data)
-        self.shared_data.values['gyro'] = {'x': values.x, 'y': values.y, 'z': values.z}
-        print(f"gyro_x: {values.x}, gyro_y: {values.y}, gyro_z: {values.z}")
-        self.combine_sensor_data()
-    
+        self.gyro_decoder.decode(data)
+
     def mag_data_handler(self, ctx, data):
-        values = parse_value(data)
-        self.shared_data.values['mag'] = {'x': values.x, 'y': values.y, 'z': values.z}
-        print(f"mag_x: {values.x}, mag_y: {values.y}, mag_z: {values.z}")
-        self.combine_sensor_data()
-
-    def combine_sensor_data(self):
-        accel = self.shared_data.values['accel']
-        gyro = self.shared_data.values['gyro']
-        mag = self.shared_data.values['mag']
-        if accel and gyro and mag:
-            combined_values = {
-                'accel_x': accel['x'], 'accel_y': accel['y'], 'accel_z': accel['z'],
-                'gyro_x': gyro['x'], 'gyro_y': gyro['y'], 'gyro_z': gyro['z'],
-                'mag_x': mag['x'], 'mag_y': mag['y'], 'mag_z': mag['z']
-            }
-            self.shared_data.values = combined_values
-            self.samples += 1
-            # print(f"Combined values: {combined_values}")
+        self.mag_decoder.decode(data)
 
 # Redirigir stderr a /dev/null o a os.devnull
 # sys.stderr = open(os.devnull, 'w')
@@ -129,21 +118,6 @@ class SensorsInterface(QMainWindow):  # Define a class that inherits from QMainW
         self.control_layout.addWidget(self.start_button)
         self.control_layout.addWidget(self.stop_button)
 
-        # Plot accel data arrays
-        self.accel_x_data = np.array([])  # Initialize an empty array for Accel X-axis data
-        self.accel_y_data = np.array([])  # Initialize an empty array for Accel Y-axis data
-        self.accel_z_data = np.array([])  # Initialize an empty array for Accel Z-axis data
-
-        # Plot gyro data arrays
-        self.gyro_x_data = np.array([])  # Initialize an empty array for Gyro X-axis data
-        self.gyro_y_data = np.array([])  # Initialize an empty array for Gyro Y-axis data
-        self.gyro_z_data = np.array([])  # Initialize an empty array for Gyro Z-axis data
-
-        # Plot mag data arrays
-        self.mag_x_data = np.array([])  # Initialize an empty array for Mag X-axis data
-        self.mag_y_data = np.array([])  # Initialize an empty array for Mag Y-axis data
-        self.mag_z_data = np.array([])  # Initialize an empty array for Mag Z-axis data
-
         # Plot curves
         self.accel_x_curve = self.plot_widget.plot(pen=(255, 0, 0), name="Accel-X-axis")  # Create a curve for Accel X-axis data with red color
         self.accel_y_curve = self.plot_widget.plot(pen=(0, 255, 0), name="Accel-Y-axis")  # Create a curve for Accel Y-axis data with green color
@@ -157,6 +131,19 @@ class SensorsInterface(QMainWindow):  # Define a class that inherits from QMainW
         self.mag_y_curve = self.plot_widget.plot(pen=(0, 255, 255), name="Mag-Y-axis")  # Create a curve for Mag Y-axis data with cyan color
         self.mag_z_curve = self.plot_widget.plot(pen=(255, 255, 0), name="Mag-Z-axis")  # Create a curve for Mag Z-axis data with yellow color
 
+        # Curves fed from the ring buffer of each sensor
+        self.plots = {
+            'accel': LivePlot(self.shared_data.values['accel'], {'x': self.accel_x_curve, 'y': self.accel_y_curve, 'z': self.accel_z_curve}),
+            'gyro': LivePlot(self.shared_data.values['gyro'], {'x': self.gyro_x_curve, 'y': self.gyro_y_curve, 'z': self.gyro_z_curve}),
+            'mag': LivePlot(self.shared_data.values['mag'], {'x': self.mag_x_curve, 'y': self.mag_y_curve, 'z': self.mag_z_curve})
+        }
+        self.labels = {
+            'accel': dict(zip(CARTESIAN_CHANNELS, (self.accel_x_label, self.accel_y_label, self.accel_z_label))),
+            'gyro': dict(zip(CARTESIAN_CHANNELS, (self.gyro_x_label, self.gyro_y_label, self.gyro_z_label))),
+            'mag': dict(zip(CARTESIAN_CHANNELS, (self.mag_x_label, self.mag_y_label, self.mag_z_label)))
+        }
+        self.frame_timer = FrameTimer('Plots')
+
         # Connect buttons to their actions
         self.start_button.clicked.connect(self.start_data)  # Connect the start button to the start_data method
         self.stop_button.clicked.connect(self.stop_data)  # Connect the stop button to the stop_data method
@@ -166,45 +153,17 @@ class SensorsInterface(QMainWindow):  # Define a class that inherits from QMainW
         self.timer.timeout.connect(self.update_data)
 
     def update_data(self):
-        if self.shared_data.values and isinstance(self.shared_data.values, dict) and 'accel_x' in self.shared_data.values:
-            new_data = self.shared_data.values
-            self.accel_x_data = np.append(self.accel_x_data, new_data['accel_x'])
-            self.accel_y_data = np.append(self.accel_y_data, new_data['accel_y'])
-            self.accel_z_data = np.append(self.accel_z_data, new_data['accel_z'])
-
-            self.gyro_x_data = np.append(self.gyro_x_data, new_data['gyro_x'])
-            self.gyro_y_data = np.append(self.gyro_y_data, new_data['gyro_y'])
-            self.gyro_z_data = np.append(self.gyro_z_data, new_data['gyro_z'])
-
-            self.mag_x_data = np.append(self.mag_x_data, new_data['mag_x'])
-            self.mag_y_data = np.append(self.mag_y_data, new_data['mag_y'])
-            self.mag_z_data = np.append(self.mag_z_data, new_data['mag_z'])
-
-            # Update the plot curves to show only the last 50 data points
-            self.accel_x_curve.setData(self.accel_x_data[-50:])
-            self.accel_y_curve.setData(self.accel_y_data[-50:])
-            self.accel_z_curve.setData(self.accel_z_data[-50:])
-
-            self.gyro_x_curve.setData(self.gyro_x_data[-50:])
-            self.gyro_y_curve.setData(self.gyro_y_data[-50:])
-            self.gyro_z_curve.setData(self.gyro_z_data[-50:])
-
-            self.mag_x_curve.setData(self.mag_x_data[-50:])
-            self.mag_y_curve.setData(self.mag_y_data[-50:])
-            self.mag_z_curve.setData(self.mag_z_data[-50:])
-
-            # Update the labels with the latest data
-            self.x_label.setText(f"Accel-X: {new_data['accel_x']:.2f}")
-            self.y_label.setText(f"Accel-Y: {new_data['accel_y']:.2f}")
-            self.z_label.setText(f"Accel-Z: {new_data['accel_z']:.2f}")
-
-            self.gyro_x_label.setText(f"Gyro-X: {new_data['gyro_x']:.2f}")
-            self.gyro_y_label.setText(f"Gyro-Y: {new_data['gyro_y']:.2f}")
-            self.gyro_z_label.setText(f"Gyro-Z: {new_data['gyro_z']:.2f}")
-
-            self.mag_x_label.setText(f"Mag-X: {new_data['mag_x']:.2f}")
-            self.mag_y_label.setText(f"Mag-Y: {new_data['mag_y']:.2f}")
-            self.mag_z_label.setText(f"Mag-Z: {new_data['mag_z']:.2f}")
+        self.frame_timer.start()
+        drawn = 0
+        for sensor, plot in self.plots.items():
+            new = plot.update()  # Draws every sample received since the last frame
+            if new:
+                drawn += new
+                new_data = plot.latest()
+                # Update the labels with the latest data
+                for channel, label in self.labels[sensor].items():
+                    label.setText(f"{sensor.capitalize()}-{channel.upper()}: {new_data[channel]:.2f}")
+        self.frame_timer.stop(drawn)
 
     def start_data(self):
         print("Configuring device")
@@ -1,4 +1,4 @@
-from mbientlab.metawear import MetaWear, libmetawear, parse_value
+from mbientlab.metawear import MetaWear, libmetawear
 from mbientlab.metawear.cbindings import *
 from time import sleep
 from threading import Event
@@ -11,9 +11,16 @@ from PyQt5.QtWidgets import QApplication, QMainWindow, QVBoxLayout, QHBoxLayout,
 from PyQt5.QtCore import QTimer
 import pyqtgraph as pg  # Importing pyqtgraph for plotting
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Streaming'))
+from fast_decoder import FastDecoder
+from live_plot import FrameTimer, LivePlot
+from ring_buffer import SampleRingBuffer, EULER_CHANNELS
+
+BUFFER_CAPACITY = 100 * 60 * 10  # 10 minutes of data at 100 Hz
+
 class SharedData:
     def __init__(self):
-        self.values = None
+        self.values = SampleRingBuffer(EULER_CHANNELS, BUFFER_CAPACITY)
 
 class State:
     def __init__(self, device, shared_data):
@@ -21,12 +28,11 @@ class State:
         self.samples = 0
         self.callback = FnVoid_VoidP_DataP(self.data_handler)
         self.shared_data = shared_data
+        self.decoder = FastDecoder(shared_data.values, DataTypeId.EULER_ANGLE)
 
     def data_handler(self, ctx, data):
-        values = parse_value(data)
-        self.shared_data.values = {'heading': values.heading, 'pitch': values.pitch, 'roll': values.roll, 'yaw': values.yaw}
+        self.decoder.decode(data)
         self.samples += 1
-        # print(values)
 
 # Redirigir stderr a /dev/null o a os.devnull
 # sys.stderr = open(os.devnull, 'w')
@@ -81,18 +87,16 @@ class SensorsInterface(QMainWindow):  # Define a class that inherits from QMainW
         self.control_layout.addWidget(self.start_button)
         self.control_layout.addWidget(self.stop_button)
 
-        # Plot accel data arrays
-        self.heading_data = np.array([])  # Initialize an empty array for Accel X-axis data
-        self.pitch_data = np.array([])  # Initialize an empty array for Accel X-axis data
-        self.roll_data = np.array([])  # Initialize an empty array for Accel Y-axis data
-        self.yaw_data = np.array([])  # Initialize an empty array for Accel Z-axis data
-
         # Plot curves
         self.heading_curve = self.plot_widget.plot(pen=(255, 255, 255), name="heading-axis")  # Create a curve for Accel X-axis data with red color
         self.pitch_curve = self.plot_widget.plot(pen=(255, 0, 0), name="pitch-axis")  # Create a curve for Accel X-axis data with red color
         self.roll_curve = self.plot_widget.plot(pen=(0, 255, 0), name="roll-axis")  # Create a curve for Accel Y-axis data with green color
         self.yaw_curve = self.plot_widget.plot(pen=(0, 0, 255), name="yaw-axis")  # Create a curve for Accel Z-axis data with blue color
 
+        # Curves fed from the ring buffer of the sensor
+        self.plot = LivePlot(self.shared_data.values, {'heading': self.heading_curve, 'pitch': self.pitch_curve, 'roll': self.roll_curve, 'yaw': self.yaw_curve})
+        self.frame_timer = FrameTimer('Plots')
+
         # Timer for updating data
         self.timer = QTimer()  # Create a QTimer object
         self.timer.timeout.connect(self.update_data)  # Connect the timer's timeout signal to the update_data method
@@ -141,24 +145,17 @@ class SensorsInterface(QMainWindow):  # Define a class that inherits from QMainW
         self.timer.stop() # Stop the timer, stopping the data updates
 
     def update_data(self):
-        if self.shared_data.values is not None:
-            new_data = self.shared_data.values
-            self.heading_data = np.append(self.heading_data, new_data['heading'])
-            self.pitch_data = np.append(self.pitch_data, new_data['pitch'])
-            self.roll_data = np.append(self.roll_data, new_data['roll'])
-            self.yaw_data = np.append(self.yaw_data, new_data['yaw'])
-
-            # Update the plot curves to show only the last 50 data points
-            self.heading_curve.setData(self.heading_data[-50:])
-            self.pitch_curve.setData(self.pitch_data[-50:])
-            self.roll_curve.setData(self.roll_data[-50:])
-            self.yaw_curve.setData(self.yaw_data[-50:])
+        self.frame_timer.start()
+        new = self.plot.update()  # Draws every sample received since the last frame
+        if new:
+            new_data = self.plot.latest()
 
             # Update the labels with the latest data
             self.heading_label.setText(f"Heading: {new_data['heading']:.2f}")
             self.pitch_label.setText(f"Pitch: {new_data['pitch']:.2f}")
             self.roll_label.setText(f"Roll: {new_data['roll']:.2f}")
             self.yaw_label.setText(f"Yaw: {new_data['yaw']:.2f}")
+        self.frame_timer.stop(new)
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)  # Create a QApplication
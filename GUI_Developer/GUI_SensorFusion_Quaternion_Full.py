@@ -1,4 +1,4 @@
-from mbientlab.metawear import MetaWear, libmetawear, parse_value
+from mbientlab.metawear import MetaWear, libmetawear
 from mbientlab.metawear.cbindings import *
 from time import sleep
 from threading import Event
@@ -11,9 +11,16 @@ from PyQt5.QtWidgets import QApplication, QMainWindow, QVBoxLayout, QHBoxLayout,
 from PyQt5.QtCore import QTimer
 import pyqtgraph as pg  # Importing pyqtgraph for plotting
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Streaming'))
+from fast_decoder import FastDecoder
+from live_plot import FrameTimer, LivePlot
+from ring_buffer import SampleRingBuffer, QUATERNION_CHANNELS
+
+BUFFER_CAPACITY = 100 * 60 * 10  # 10 minutes of data at 100 Hz
+
 class SharedData:
     def __init__(self):
-        self.values = None
+        self.values = SampleRingBuffer(QUATERNION_CHANNELS, BUFFER_CAPACITY)
 
 class State:
     def __init__(self, device, shared_data):
@@ -21,12 +28,11 @@ class State:
         self.samples = 0
         self.callback = FnVoid_VoidP_DataP(self.data_handler)
         self.shared_data = shared_data
+        self.decoder = FastDecoder(shared_data.values, DataTypeId.QUATERNION)
 
     def data_handler(self, ctx, data):
-        values = parse_value(data)
-        self.shared_data.values = {'w': values.w, 'x': values.x, 'y': values.y, 'z': values.z}
+        self.decoder.decode(data)
         self.samples += 1
-        # print(values)
 
 # Redirigir stderr a /dev/null o a os.devnull
 # sys.stderr = open(os.devnull, 'w')
@@ -81,18 +87,16 @@ class SensorsInterface(QMainWindow):  # Define a class that inherits from QMainW
         self.control_layout.addWidget(self.start_button)
         self.control_layout.addWidget(self.stop_button)
 
-        # Plot accel data arrays
-        self.w_data = np.array([])  # Initialize an empty array for Accel X-axis data
-        self.x_data = np.array([])  # Initialize an empty array for Accel X-axis data
-        self.y_data = np.array([])  # Initialize an empty array for Accel Y-axis data
-        self.z_data = np.array([])  # Initialize an empty array for Accel Z-axis data
-
         # Plot curves
         self.w_curve = self.plot_widget.plot(pen=(255, 255, 255), name="W-axis")  # Create a curve for Accel X-axis data with red color
         self.x_curve = self.plot_widget.plot(pen=(255, 0, 0), name="X-axis")  # Create a curve for Accel X-axis data with red color
         self.y_curve = self.plot_widget.plot(pen=(0, 255, 0), name="Y-axis")  # Create a curve for Accel Y-axis data with green color
         self.z_curve = self.plot_widget.plot(pen=(0, 0, 255), name="Z-axis")  # Create a curve for Accel Z-axis data with blue color
 
+        # Curves fed from the ring buffer of the sensor
+        self.plot = LivePlot(self.shared_data.values, {'w': self.w_curve, 'x': self.x_curve, 'y': self.y_curve, 'z': self.z_curve})
+        self.frame_timer = FrameTimer('Plots')
+
         # Timer for updating data
         self.timer = QTimer()  # Create a QTimer object
         self.timer.timeout.connect(self.update_data)  # Connect the timer's timeout signal to the update_data method
@@ -141,24 +145,17 @@ class SensorsInterface(QMainWindow):  # Define a class that inherits from QMainW
         self.timer.stop()  # Stop the timer, stopping the data updates
 
     def update_data(self):
-        if self.shared_data.values is not None:
-            new_data = self.shared_data.values
-            self.w_data = np.append(self.w_data, new_data['w'])
-            self.x_data = np.append(self.x_data, new_data['x'])
-            self.y_data = np.append(self.y_data, new_data['y'])
-            self.z_data = np.append(self.z_data, new_data['z'])
-
-            # Update the plot curves to show only the last 50 data points
-            self.w_curve.setData(self.w_data[-50:])
-            self.x_curve.setData(self.x_data[-50:])
-            self.y_curve.setData(self.y_data[-50:])
-            self.z_curve.setData(self.z_data[-50:])
+        self.frame_timer.start()
+        new = self.plot.update()  # Draws every sample received since the last frame
+        if new:
+            new_data = self.plot.latest()
 
             # Update the labels with the latest data
             self.w_label.setText(f"W: {new_data['w']:.2f}")
             self.x_label.setText(f"X: {new_data['x']:.2f}")
             self.y_label.setText(f"Y: {new_data['y']:.2f}")
             self.z_label.setText(f"Z: {new_data['z']:.2f}")
+        self.frame_timer.stop(new)
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)  # Create a QApplication
@@ -2,9 +2,9 @@
 ## In this moment the code give us an excel with the information for the training data, preliminary we have the
 ## Implementation with two sensors for training a neural network for the arm
 
-from mbientlab.metawear import MetaWear, libmetawear, parse_value
+from mbientlab.metawear import MetaWear, libmetawear
 from mbientlab.metawear.cbindings import *
-from time import sleep, time
+from time import sleep
 from threading import Thread, Lock
 import platform
 import sys
@@ -15,7 +15,21 @@ from PyQt5.QtWidgets import QApplication, QMainWindow, QVBoxLayout, QHBoxLayout,
 from PyQt5.QtCore import QTimer
 import pyqtgraph as pg
 import pandas as pd
-from datetime import datetime
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Streaming'))
+from fast_decoder import FastDecoder
+from live_plot import LivePlot, RenderScheduler
+from ring_buffer import SampleRingBuffer, QUATERNION_CHANNELS
+from sensor_profiles import PROFILES, check
+from session_export import ExportQueue, SessionExport
+
+PROFILE = PROFILES['fusion_quaternion']  # see sensor_profiles.py
+FUSION_RATE = PROFILE.rate()  # Hz
+SESSION_MINUTES = 60  # Longest expected capture, the export only has what fits in the buffers
+BUFFER_CAPACITY = FUSION_RATE * 60 * SESSION_MINUTES  # ~17 MB of sensor fusion data per sensor at 100 Hz
+EXPORT_RATE = 10  # Hz, rate of the workbooks saved for training (DataCollection)
+SYNC_TOLERANCE_MS = 1000 / EXPORT_RATE / 2  # Max skew between the sensors of one exported row
+EXPORT_FILE = 'sensor_data.xlsx'  # .csv or a folder (.npy columns) for the other formats, see session_export.py
 
 class SharedData:
     def __init__(self):
@@ -28,27 +42,15 @@ class State:
         self.callback = FnVoid_VoidP_DataP(self.data_handler)
         self.shared_data = shared_data
         self.mac_address = mac_address
-        self.last_capture_time = time()  # Track the time of last capture
+        # The buffer is allocated once here, the callback only writes into it
+        if mac_address not in shared_data.values:
+            shared_data.values[mac_address] = SampleRingBuffer(QUATERNION_CHANNELS, BUFFER_CAPACITY)
+        self.buffer = shared_data.values[mac_address]
+        self.decoder = FastDecoder(self.buffer, DataTypeId.QUATERNION)
 
     def data_handler(self, ctx, data):
-        values = parse_value(data)
-        timestamp = datetime.now().strftime('%H:%M:%S.%f')
-        if self.mac_address not in self.shared_data.values:
-            self.shared_data.values[self.mac_address] = []
-        
-        # Ensure the time between captures is consistent
-        current_time = time()
-        if current_time - self.last_capture_time < 0.1:  # Adjust this value if needed
-            sleep(0.1 - (current_time - self.last_capture_time))
-        self.last_capture_time = time()
-
-        self.shared_data.values[self.mac_address].append({
-            'timestamp': timestamp,
-            'w': values.w, 
-            'x': values.x, 
-            'y': values.y, 
-            'z': values.z
-        })
+        # Runs on the libmetawear thread: only store the sample, the consumers decimate it at their own rate
+        self.decoder.decode(data)
         self.samples += 1
 
 def connect_sensor(mac_address):
@@ -60,19 +62,12 @@ def connect_sensor(mac_address):
 def capture_data(device, shared_data, lock, mac_address):
     state_instance = State(device, shared_data, mac_address)
     
-    libmetawear.mbl_mw_settings_set_connection_parameters(device.board, 7.5, 100, 0, 6000)
+    PROFILE.connection.apply(device)
     sleep(1.5)
 
-    libmetawear.mbl_mw_sensor_fusion_set_mode(device.board, SensorFusionMode.NDOF)
-    libmetawear.mbl_mw_sensor_fusion_set_acc_range(device.board, SensorFusionAccRange._8G)
-    libmetawear.mbl_mw_sensor_fusion_set_gyro_range(device.board, SensorFusionGyroRange._2000DPS)
-    libmetawear.mbl_mw_sensor_fusion_write_config(device.board)
-
-    signal = libmetawear.mbl_mw_sensor_fusion_get_data_signal(device.board, SensorFusionData.QUATERNION)
-    libmetawear.mbl_mw_datasignal_subscribe(signal, None, state_instance.callback)
-    
-    libmetawear.mbl_mw_sensor_fusion_enable_data(device.board, SensorFusionData.QUATERNION)
-    libmetawear.mbl_mw_sensor_fusion_start(device.board)
+    PROFILE.configure(device)
+    PROFILE.subscribe(device, state_instance.callback)
+    PROFILE.start(device)
 
     pattern = LedPattern(repeat_count=Const.LED_REPEAT_INDEFINITELY)
     libmetawear.mbl_mw_led_load_preset_pattern(byref(pattern), LedPreset.BLINK)
@@ -81,8 +76,7 @@ def capture_data(device, shared_data, lock, mac_address):
     while getattr(device, 'streaming', True):
         sleep(0.1)  # Sleep for a short duration to avoid busy-waiting
 
-    libmetawear.mbl_mw_sensor_fusion_stop(device.board)
-    libmetawear.mbl_mw_datasignal_unsubscribe(signal)
+    PROFILE.stop(device)
     libmetawear.mbl_mw_led_stop_and_clear(device.board)
     print(f"Detenido el sensor {mac_address}")
 
@@ -112,8 +106,8 @@ class SensorsInterface(QMainWindow):
         self.control_layout.addWidget(self.start_button)
         self.control_layout.addWidget(self.stop_button)
 
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.update_data)
+        # Redraws paced at MAX_FPS, frames without new samples draw nothing
+        self.scheduler = RenderScheduler(self.update_data)
 
         self.connect_button.clicked.connect(self.connect_sensors)
         self.start_button.clicked.connect(self.start_data)
@@ -129,14 +123,18 @@ class SensorsInterface(QMainWindow):
         self.stop_button.setEnabled(False)
 
         self.labels = {}
-        self.data = {}
         self.curves = {}
+        self.plots = {}
+        self.exports = ExportQueue()
 
     def connect_sensors(self):
         try:
+            print(check(PROFILE, len(self.sensor_addresses)))
             for mac in self.sensor_addresses:
                 device = connect_sensor(mac)
                 self.devices.append(device)
+                if mac in self.labels:
+                    continue  # Reconnected after a capture, the labels and curves are already there
 
                 self.labels[mac] = {
                     'w': QLabel(f"{mac} w: 0.0"),
@@ -147,12 +145,6 @@ class SensorsInterface(QMainWindow):
                 for label in self.labels[mac].values():
                     self.control_layout.addWidget(label)
 
-                self.data[mac] = {
-                    'w': np.array([]),
-                    'x': np.array([]),
-                    'y': np.array([]),
-                    'z': np.array([])
-                }
                 self.curves[mac] = {
                     'w': self.plot_widget.plot(pen=(255, 255, 255), name=f"{mac} w-axis"),
                     'x': self.plot_widget.plot(pen=(255, 0, 0), name=f"{mac} x-axis"),
@@ -176,7 +168,7 @@ class SensorsInterface(QMainWindow):
                 self.threads.append(thread)
                 thread.start()
 
-            self.timer.start(10)
+            self.scheduler.start()
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Error al iniciar la captura de datos: {str(e)}")
 
@@ -193,41 +185,52 @@ class SensorsInterface(QMainWindow):
                 device.disconnect()
                 print(f"Desconectado el sensor {device.address}")
 
-            self.timer.stop()
-
-            writer = pd.ExcelWriter('sensor_data.xlsx', engine='xlsxwriter')
-            # Synchronize data before saving
-            min_samples = min(len(self.shared_data.values[mac]) for mac in self.sensor_addresses)
-            for mac, data_list in self.shared_data.values.items():
-                if data_list:
-                    self.shared_data.values[mac] = data_list[:min_samples]  # Trim excess data
-                    # Replace invalid characters in the sheet name
-                    safe_mac = mac.replace(':', '_')
-                    df = pd.DataFrame(data_list)
-                    df.to_excel(writer, sheet_name=safe_mac, index=False)
-            writer.close()
-            print("Datos guardados en sensor_data.xlsx")
+            self.scheduler.stop()
+
+            self.devices = []
+            self.threads = []
+
+            # The buffers of this session go to the export job, the next capture starts with new ones
+            buffers = {mac: self.shared_data.values.pop(mac) for mac in self.sensor_addresses
+                       if mac in self.shared_data.values}
+            self.plots = {}
+            self.start_button.setEnabled(False)
+            self.stop_button.setEnabled(False)
+            export = SessionExport(buffers, EXPORT_FILE, EXPORT_RATE, SYNC_TOLERANCE_MS, parent=self)
+            export.progress.connect(self.show_export_progress)
+            export.done.connect(self.export_done)
+            export.failed.connect(lambda error: QMessageBox.critical(self, "Error", f"Error al guardar los datos: {error}"))
+            self.exports.submit(export)
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Error al detener la captura de datos: {str(e)}")
 
+    def show_export_progress(self, rows, total):
+        self.statusBar().showMessage(f"Guardando {EXPORT_FILE}: {rows}/{total} filas")
+
+    def export_done(self, paths, seconds, dropped):
+        self.statusBar().showMessage(f"Datos guardados en {', '.join(paths)} ({seconds:.1f} s)", 10000)
+        print(f"Datos guardados en {', '.join(paths)}")
+        if dropped:
+            lost = '\n'.join(f"{mac}: {count} muestras ({count / FUSION_RATE:.0f} s)" for mac, count in dropped.items())
+            QMessageBox.warning(self, "Datos incompletos", f"La sesión no cabía en el buffer ({SESSION_MINUTES} min), "
+                                f"{', '.join(paths)} no tiene el comienzo de la sesión:\n{lost}")
+
+    def closeEvent(self, event):
+        self.exports.wait()  # Let a running export finish before the window goes away
+        super().closeEvent(event)
+
     def update_data(self):
-        for mac, new_data in self.shared_data.values.items():
-            if new_data:
-                latest_data = new_data[-1]
-                self.data[mac]['w'] = np.append(self.data[mac]['w'], latest_data['w'])
-                self.data[mac]['x'] = np.append(self.data[mac]['x'], latest_data['x'])
-                self.data[mac]['y'] = np.append(self.data[mac]['y'], latest_data['y'])
-                self.data[mac]['z'] = np.append(self.data[mac]['z'], latest_data['z'])
-
-                self.curves[mac]['w'].setData(self.data[mac]['w'][-50:])
-                self.curves[mac]['x'].setData(self.data[mac]['x'][-50:])
-                self.curves[mac]['y'].setData(self.data[mac]['y'][-50:])
-                self.curves[mac]['z'].setData(self.data[mac]['z'][-50:])
-
-                self.labels[mac]['w'].setText(f"{mac} W: {latest_data['w']:.2f}")
-                self.labels[mac]['x'].setText(f"{mac} X: {latest_data['x']:.2f}")
-                self.labels[mac]['y'].setText(f"{mac} Y: {latest_data['y']:.2f}")
-                self.labels[mac]['z'].setText(f"{mac} Z: {latest_data['z']:.2f}")
+        drawn = 0
+        for mac, buffer in list(self.shared_data.values.items()):
+            if mac not in self.plots:
+                self.plots[mac] = LivePlot(buffer, self.curves[mac])
+            new = self.plots[mac].update()
+            if new:
+                drawn += new
+                latest_data = self.plots[mac].latest()
+                for channel, label in self.labels[mac].items():
+                    self.scheduler.set_text(label, f"{mac} {channel.capitalize()}: {latest_data[channel]:.2f}")
+        return drawn
 
 if __name__ == '__main__':
     shared_data = SharedData()
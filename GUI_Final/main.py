@@ -1,17 +1,35 @@
 import sys
+import os
 from PyQt5.QtWidgets import QApplication, QDialog, QMessageBox, QVBoxLayout, QWidget,QLabel
 from PyQt5.QtCore import QTimer
 from PyQt5.QtGui import QMovie
 import pyqtgraph as pg
 from threading import Thread, Lock
-from time import sleep, time
-from mbientlab.metawear import MetaWear, libmetawear, parse_value
+from time import sleep
+from mbientlab.metawear import MetaWear, libmetawear
 from mbientlab.metawear.cbindings import *
-from datetime import datetime
 import numpy as np
 import pandas as pd
 from GUI_Integration_Final import Ui_Dialog
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Streaming'))
+from device_registry import DeviceRegistry
+from fast_decoder import FastDecoder
+from live_plot import LivePlot, RenderScheduler
+from ring_buffer import SampleRingBuffer, QUATERNION_CHANNELS
+from sensor_profiles import PROFILES, check
+from session_bringup import bring_up, report
+from session_export import ExportQueue, SessionExport
+from supervisor import Supervisor
+
+PROFILE = PROFILES['fusion_quaternion']  # NDOF quaternions, see sensor_profiles.py
+FUSION_RATE = PROFILE.rate()  # Hz, quaternion output of NDOF sensor fusion
+SESSION_MINUTES = 60  # Longest expected capture, the export only has what fits in the buffers
+BUFFER_CAPACITY = FUSION_RATE * 60 * SESSION_MINUTES  # ~17 MB per sensor at 100 Hz
+EXPORT_RATE = 10  # Hz, rate of the workbooks saved for training (DataCollection)
+SYNC_TOLERANCE_MS = 1000 / EXPORT_RATE / 2  # Max skew between the sensors of one exported row
+EXPORT_FILE = None  # e.g. 'sensor_data.xlsx' to save every capture (.csv, a folder for .npy columns)
+
 
 class SharedData:
     def __init__(self):
@@ -24,61 +42,49 @@ class State:
         self.callback = FnVoid_VoidP_DataP(self.data_handler)
         self.shared_data = shared_data
         self.mac_address = mac_address
-        self.last_capture_time = time()  # Track the time of last capture
+        # The buffer is allocated once here, the callback only writes into it
+        if mac_address not in shared_data.values:
+            shared_data.values[mac_address] = SampleRingBuffer(QUATERNION_CHANNELS, BUFFER_CAPACITY)
+        self.buffer = shared_data.values[mac_address]
+        self.decoder = FastDecoder(self.buffer, DataTypeId.QUATERNION)
 
     def data_handler(self, ctx, data):
-        values = parse_value(data)
-        timestamp = datetime.now().strftime('%H:%M:%S.%f')
-        if self.mac_address not in self.shared_data.values:
-            self.shared_data.values[self.mac_address] = []
-        
-        # Ensure the time between captures is consistent
-        current_time = time()
-        if current_time - self.last_capture_time < 0.1:  # Adjust this value if needed
-            sleep(0.1 - (current_time - self.last_capture_time))
-        self.last_capture_time = time()
-
-        self.shared_data.values[self.mac_address].append({
-            'timestamp': timestamp,
-            'w': values.w, 
-            'x': values.x, 
-            'y': values.y, 
-            'z': values.z
-        })
+        # Runs on the libmetawear thread: only store the sample, the consumers decimate it at their own rate
+        self.decoder.decode(data)
         self.samples += 1
 
-def connect_sensor(mac_address):
-    device = MetaWear(mac_address)
-    device.connect()
-    print(f"Conectado al sensor {mac_address}")
-    return device
+def arm_fusion(device, state):
+    # Sensor fusion of the profile configured and started, its quaternions subscribed to the state of the board
+    PROFILE.configure(device)
+    PROFILE.subscribe(device, state.callback)
+    PROFILE.start(device)
+
+def disarm_fusion(device):
+    PROFILE.stop(device)
 
-def capture_data(device, shared_data, lock, mac_address):
+def capture_data(device, shared_data, lock, mac_address, registry=None):
     state_instance = State(device, shared_data, mac_address)
     
-    libmetawear.mbl_mw_settings_set_connection_parameters(device.board, 7.5, 100, 0, 6000)
+    PROFILE.connection.apply(device)
     sleep(1.5)
 
-    libmetawear.mbl_mw_sensor_fusion_set_mode(device.board, SensorFusionMode.NDOF)
-    libmetawear.mbl_mw_sensor_fusion_set_acc_range(device.board, SensorFusionAccRange._8G)
-    libmetawear.mbl_mw_sensor_fusion_set_gyro_range(device.board, SensorFusionGyroRange._2000DPS)
-    libmetawear.mbl_mw_sensor_fusion_write_config(device.board)
-
-    signal = libmetawear.mbl_mw_sensor_fusion_get_data_signal(device.board, SensorFusionData.QUATERNION)
-    libmetawear.mbl_mw_datasignal_subscribe(signal, None, state_instance.callback)
-    
-    libmetawear.mbl_mw_sensor_fusion_enable_data(device.board, SensorFusionData.QUATERNION)
-    libmetawear.mbl_mw_sensor_fusion_start(device.board)
+    arm_fusion(device, state_instance)
 
     pattern = LedPattern(repeat_count=Const.LED_REPEAT_INDEFINITELY)
     libmetawear.mbl_mw_led_load_preset_pattern(byref(pattern), LedPreset.BLINK)
     libmetawear.mbl_mw_led_write_pattern(device.board, byref(pattern), LedColor.GREEN)
 
-    while getattr(device, 'streaming', True):
-        sleep(0.1)  # Sleep for a short duration to avoid busy-waiting
+    def rearm():
+        disarm_fusion(device)
+        arm_fusion(device, state_instance)
+
+    # Until Stop: reconnects and re-arms the board when its stream stalls or the link drops, the gaps are
+    # marked in the buffer and logged with the samples lost and the time to recover (supervisor.py)
+    supervisor = Supervisor(device, state_instance.buffer, rearm, FUSION_RATE, registry)
+    supervisor.watch(lambda: getattr(device, 'streaming', True))
+    print(supervisor.report())
 
-    libmetawear.mbl_mw_sensor_fusion_stop(device.board)
-    libmetawear.mbl_mw_datasignal_unsubscribe(signal)
+    disarm_fusion(device)
     libmetawear.mbl_mw_led_stop_and_clear(device.board)
     print(f"Detenido el sensor {mac_address}")
 
@@ -90,6 +96,7 @@ class MyApp(QDialog):
         self.ui.setupUi(self)
 
         self.movie = QMovie("heartrate.gif")
+        self.movie.setCacheMode(QMovie.CacheAll)  # Decode the GIF frames once, not on every loop
         self.ui.LabelGifHeartRate.setMovie(self.movie)
         self.movie.start()
         
@@ -99,16 +106,18 @@ class MyApp(QDialog):
         self.ui.ButtonStop.clicked.connect(self.stop_streaming)
         self.ui.ButtonDisconnect.clicked.connect(self.disconnect_sensors)
 
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.update_data)
+        # Redraws paced at MAX_FPS, frames without new samples draw nothing
+        self.scheduler = RenderScheduler(self.update_data)
 
         #self.sensor_addresses = ['F1:1E:E2:6F:1D:E1']
         self.sensor_addresses = ['F1:1E:E2:6F:1D:E1', 'EE:1B:72:FA:BF:E8']
         self.devices = []
         self.threads = []
         self.lock = Lock()
+        self.registry = DeviceRegistry()
 
         self.init_graph()
+        self.exports = ExportQueue()
 
         # self.labels = {}
         # self.data = {}
@@ -122,19 +131,27 @@ class MyApp(QDialog):
         self.ui.graphicsView.setLayout(layout)
         
         self.graphWidget.setBackground('w')
-        self.data = {mac: {'w': np.array([]), 'x': np.array([]), 'y': np.array([]), 'z': np.array([])} for mac in self.sensor_addresses}
         self.curves = {mac: {'w': self.graphWidget.plot(pen='r'), 'x': self.graphWidget.plot(pen='g'), 'y': self.graphWidget.plot(pen='b'), 'z': self.graphWidget.plot(pen='y')} for mac in self.sensor_addresses}
+        self.plots = {}
 
     def connect_sensors(self):
         try:
-            for mac in self.sensor_addresses:
-                device = connect_sensor(mac)
-                self.devices.append(device)
-                self.ui.ButtonStart.setEnabled(True)
-                self.ui.ButtonStop.setEnabled(False)
-                self.ui.ButtonConnect.setText("Connected")
+            # Rejected before connecting if the adapter can not carry the streams of every sensor
+            print(check(PROFILE, len(self.sensor_addresses)))
+            # All the sensors at the same time, the bring-up takes as long as the slowest one
+            results, seconds = bring_up(self.sensor_addresses, registry=self.registry)
+            print(report(results, seconds))
+            self.devices = [result.device for result in results if result.ok]
+            failed = [result for result in results if not result.ok]
+            if failed:
+                raise ConnectionError(', '.join(f"{result.address}: {result.error}" for result in failed))
+            self.ui.ButtonStart.setEnabled(True)
+            self.ui.ButtonStop.setEnabled(False)
+            self.ui.ButtonConnect.setText("Connected")
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Error al conectar los sensores: {str(e)}")
+            for device in self.devices:
+                libmetawear.mbl_mw_debug_disconnect(device.board)
             self.devices = []
             self.ui.ButtonStart.setEnabled(False)
             self.ui.ButtonStop.setEnabled(False)
@@ -143,16 +160,17 @@ class MyApp(QDialog):
         try:
             for device in self.devices:
                 device.streaming = True
-                thread = Thread(target=capture_data, args=(device, self.shared_data, self.lock, device.address))
+                thread = Thread(target=capture_data, args=(device, self.shared_data, self.lock, device.address,
+                                                               self.registry))
                 self.threads.append(thread)
                 thread.start()
 
-            self.timer.start(10)
+            self.scheduler.start()
             self.ui.ButtonStop.setEnabled(True)
             self.ui.ButtonConnect.setEnabled(False)
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Error al iniciar la captura de datos: {str(e)}")
-        self.update_data("Algoritmo corriendo")
+        self.scheduler.set_text(self.ui.LabelClassification, "Algoritmo corriendo")
 
     def stop_streaming(self):
         try:
@@ -167,22 +185,33 @@ class MyApp(QDialog):
             #     device.disconnect()
             #     print(f"Desconectado el sensor {device.address}")
 
-            self.timer.stop()
-        #     writer = pd.ExcelWriter('sensor_data.xlsx', engine='xlsxwriter')
-        #     # Synchronize data before saving
-        #     min_samples = min(len(self.shared_data.values[mac]) for mac in self.sensor_addresses)
-        #     for mac, data_list in self.shared_data.values.items():
-        #         if data_list:
-        #             self.shared_data.values[mac] = data_list[:min_samples]  # Trim excess data
-        #             # Replace invalid characters in the sheet name
-        #             safe_mac = mac.replace(':', '_')
-        #             df = pd.DataFrame(data_list)
-        #             df.to_excel(writer, sheet_name=safe_mac, index=False)
-        #     writer.close()
-        #     print("Datos guardados en sensor_data.xlsx")
+            self.scheduler.stop()
+            self.threads = []
+            if EXPORT_FILE:
+                # Written in the background, the sensors stay connected and Start can be pressed again now
+                buffers = {mac: self.shared_data.values.pop(mac) for mac in self.sensor_addresses
+                           if mac in self.shared_data.values}
+                self.plots = {}
+                export = SessionExport(buffers, EXPORT_FILE, EXPORT_RATE, SYNC_TOLERANCE_MS, parent=self)
+                export.progress.connect(lambda rows, total: self.setWindowTitle(f"Guardando {EXPORT_FILE}: {rows}/{total} filas"))
+                export.done.connect(self.export_done)
+                export.failed.connect(lambda error: QMessageBox.critical(self, "Error", f"Error al guardar los datos: {error}"))
+                self.exports.submit(export)
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Error al detener la captura de datos: {str(e)}")
 
+    def export_done(self, paths, seconds, dropped):
+        self.setWindowTitle(f"Datos guardados en {', '.join(paths)} ({seconds:.1f} s)")
+        print(f"Datos guardados en {', '.join(paths)}")
+        if dropped:
+            lost = '\n'.join(f"{mac}: {count} muestras ({count / FUSION_RATE:.0f} s)" for mac, count in dropped.items())
+            QMessageBox.warning(self, "Datos incompletos", f"La sesión no cabía en el buffer ({SESSION_MINUTES} min), "
+                                f"{', '.join(paths)} no tiene el comienzo de la sesión:\n{lost}")
+
+    def closeEvent(self, event):
+        self.exports.wait()  # Let a running export finish before the window goes away
+        super().closeEvent(event)
+
     def disconnect_sensors(self):
         try:
             for device in self.devices:
@@ -197,25 +226,19 @@ class MyApp(QDialog):
 
     # def update_data(self, classification):
     def update_data(self):
-        for mac, new_data in self.shared_data.values.items():
-            if new_data:
-                latest_data = new_data[-1]
-                self.data[mac]['w'] = np.append(self.data[mac]['w'], latest_data['w'])
-                self.data[mac]['x'] = np.append(self.data[mac]['x'], latest_data['x'])
-                self.data[mac]['y'] = np.append(self.data[mac]['y'], latest_data['y'])
-                self.data[mac]['z'] = np.append(self.data[mac]['z'], latest_data['z'])
-
-                self.curves[mac]['w'].setData(self.data[mac]['w'][-50:])
-                self.curves[mac]['x'].setData(self.data[mac]['x'][-50:])
-                self.curves[mac]['y'].setData(self.data[mac]['y'][-50:])
-                self.curves[mac]['z'].setData(self.data[mac]['z'][-50:])
-
-                # self.labels[mac]['w'].setText(f"{mac} W: {latest_data['w']:.2f}")
-                # self.labels[mac]['x'].setText(f"{mac} X: {latest_data['x']:.2f}")
-                # self.labels[mac]['y'].setText(f"{mac} Y: {latest_data['y']:.2f}")
-                # self.labels[mac]['z'].setText(f"{mac} Z: {latest_data['z']:.2f}")
+        drawn = 0
+        for mac, buffer in list(self.shared_data.values.items()):
+            if mac not in self.plots:
+                self.plots[mac] = LivePlot(buffer, self.curves[mac])
+            drawn += self.plots[mac].update()
+            # latest_data = self.plots[mac].latest()
+            # self.labels[mac]['w'].setText(f"{mac} W: {latest_data['w']:.2f}")
+            # self.labels[mac]['x'].setText(f"{mac} X: {latest_data['x']:.2f}")
+            # self.labels[mac]['y'].setText(f"{mac} Y: {latest_data['y']:.2f}")
+            # self.labels[mac]['z'].setText(f"{mac} Z: {latest_data['z']:.2f}")
         # Aquí va el código para actualizar la etiqueta de clasificación
-        self.ui.LabelClassification.setText("classification")
+        self.scheduler.set_text(self.ui.LabelClassification, "classification")
+        return drawn
 
 if __name__ == '__main__':
     shared_data = SharedData()
@@ -1,70 +1,71 @@
 import sys
-from time import sleep
+import os
+from time import sleep, perf_counter
 from threading import Event
-from collections import deque
 from PyQt5.QtWidgets import QApplication, QWidget, QLabel, QVBoxLayout
-from PyQt5.QtCore import QTimer
-import torch
-import torch.nn as nn
-from mbientlab.metawear import MetaWear, libmetawear, parse_value
+from mbientlab.metawear import MetaWear, libmetawear
 from mbientlab.metawear.cbindings import *
 from mbientlab.warble import *
-
-class LSTMModel(nn.Module):
-    def __init__(self, input_size, hidden_size, output_size, num_layers):
-        super(LSTMModel, self).__init__()
-        self.num_layers = num_layers
-        self.hidden_size = hidden_size
-        self.lstm = nn.LSTM(input_size, hidden_size, num_layers, batch_first=True)
-        self.fc = nn.Linear(hidden_size, output_size)
-
-    def forward(self, x):
-        h_0 = torch.zeros(self.num_layers, x.size(0), self.hidden_size).to(x.device)
-        c_0 = torch.zeros(self.num_layers, x.size(0), self.hidden_size).to(x.device)
-        out, _ = self.lstm(x, (h_0, c_0))
-        out = self.fc(out[:, -1, :])
-        return out
+from inference_worker import InferenceWorker
+from lstm_model import LABELS
+from model_loader import ModelLoader
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Streaming'))
+from fast_decoder import FastDecoder
+from ring_buffer import SampleRingBuffer, QUATERNION_CHANNELS
+from sensor_profiles import PROFILES
+from synchronizer import EpochSynchronizer
+
+PREDICTION_STRIDE = 10  # Una predicción cada 10 muestras (100 ms a 100Hz), ventana de 100 muestras
+PREDICTION_INTERVAL_MS = 100  # Periodo con el que el worker lee las muestras nuevas
+BUFFER_CAPACITY = 100 * 10  # 10 segundos por sensor, el sincronizador los lee cada PREDICTION_INTERVAL_MS
+SYNC_TOLERANCE_MS = 5  # Max skew between the two quaternions of one LSTM input row
+MODEL_NAME = 'lstm'  # Modelo de model_registry.json
+MODEL_RUNTIME = None  # None: el del registro, o 'eager', 'torchscript', 'int8', 'onnx' (ver runtimes.py)
+MODEL_THREADS = 1  # Hilos de inferencia, uno por sujeto en los PCs de las estaciones
+PROFILE = PROFILES['fusion_quaternion']  # Cuaterniones NDOF a 100Hz, la entrada del LSTM
 
 class SensorState:
     def __init__(self, device):
         self.device = device
-        self.quaternion = None
         self.callback = FnVoid_VoidP_DataP(self.data_handler)
-        self.buffer = deque(maxlen=100)  # Buffer para almacenar las ultimas 100 muestras (1 segundo de datos a 100Hz)
+        self.buffer = SampleRingBuffer(QUATERNION_CHANNELS, BUFFER_CAPACITY)
+        self.decoder = FastDecoder(self.buffer, DataTypeId.QUATERNION)
 
     def data_handler(self, ctx, data):
-        self.quaternion = parse_value(data)
-        self.buffer.append([self.quaternion.w, self.quaternion.x, self.quaternion.y, self.quaternion.z])
+        self.decoder.decode(data)
 
     def start_stream(self):
         print("Configuring device")
-        libmetawear.mbl_mw_settings_set_connection_parameters(self.device.board, 7.5, 7.5, 0, 6000)
+        PROFILE.connection.apply(self.device)
         sleep(1.5)
-        libmetawear.mbl_mw_sensor_fusion_set_mode(self.device.board, SensorFusionMode.NDOF)
-        libmetawear.mbl_mw_sensor_fusion_set_acc_range(self.device.board, SensorFusionAccRange._8G)
-        libmetawear.mbl_mw_sensor_fusion_set_gyro_range(self.device.board, SensorFusionGyroRange._2000DPS)
-        libmetawear.mbl_mw_sensor_fusion_write_config(self.device.board)
-        signal = libmetawear.mbl_mw_sensor_fusion_get_data_signal(self.device.board, SensorFusionData.QUATERNION)
-        libmetawear.mbl_mw_datasignal_subscribe(signal, None, self.callback)
-        libmetawear.mbl_mw_sensor_fusion_enable_data(self.device.board, SensorFusionData.QUATERNION)
-        libmetawear.mbl_mw_sensor_fusion_start(self.device.board)
+        PROFILE.configure(self.device)
+        PROFILE.subscribe(self.device, self.callback)
+        PROFILE.start(self.device)
 
     def stop_stream(self):
-        signal = libmetawear.mbl_mw_sensor_fusion_get_data_signal(self.device.board, SensorFusionData.QUATERNION)
-        libmetawear.mbl_mw_datasignal_unsubscribe(signal)
-        libmetawear.mbl_mw_sensor_fusion_stop(self.device.board)
+        PROFILE.stop(self.device)
 
     def disconnect(self):
         libmetawear.mbl_mw_debug_disconnect(self.device.board)
         print("Disconnected")
 
 class App(QWidget):
-    def __init__(self, model, sensor1, sensor2):
+    def __init__(self, model, sensor1, sensor2, features='raw'):
         super().__init__()
         self.model = model
         self.sensor1 = sensor1
         self.sensor2 = sensor2
+        # Frames of both sensors joined on the board epoch, [w1 x1 y1 z1 w2 x2 y2 z2] per row
+        self.synchronizer = EpochSynchronizer({'sensor1': sensor1.buffer, 'sensor2': sensor2.buffer},
+                                              tolerance_ms=SYNC_TOLERANCE_MS)
+        # Inference runs in its own thread, the predictions arrive with the `prediction` signal
+        self.worker = InferenceWorker(model, self.synchronizer, stride=PREDICTION_STRIDE, interval_ms=PREDICTION_INTERVAL_MS,
+                                     features=features)
+        self.worker.prediction.connect(self.show_prediction)
+        self.first_prediction = True
         self.initUI()
+        self.worker.start()
 
     def initUI(self):
         self.label = QLabel('Prediction: ', self)
@@ -73,47 +74,26 @@ class App(QWidget):
         self.setLayout(layout)
         self.setWindowTitle('Real-Time Arm Position Detection')
         self.setGeometry(100, 100, 400, 200)
-        
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.update_prediction)
-        self.timer.start(1000)  # Actualizar cada segundo
 
         self.show()
 
-    def preprocess_data(self, buffer1, buffer2):
-        data = []
-        for q1, q2 in zip(buffer1, buffer2):
-            data.append(q1 + q2)  # Concatenar los datos quaterniones de los dos sensores
-        data = torch.tensor(data, dtype=torch.float32)
-        data = data.unsqueeze(0)  # Añadir dimensión batch
-        return data
-
-    def update_prediction(self):
-        if len(self.sensor1.buffer) == 100 and len(self.sensor2.buffer) == 100:
-            data = self.preprocess_data(list(self.sensor1.buffer), list(self.sensor2.buffer))
-            with torch.no_grad():
-                output = self.model(data)
-                probabilities = torch.softmax(output, dim=1)
-                prediction = torch.argmax(probabilities, dim=1).item()
-                self.label.setText(f'Prediction: {"Arm Up" if prediction == 1 else "Arm Down"}')
-                print(f'True: Sensor 1 Buffer: {list(self.sensor1.buffer)}, Sensor 2 Buffer: {list(self.sensor2.buffer)} | Prediction: {"Arm Up" if prediction == 1 else "Arm Down"}')
+    def show_prediction(self, samples, prediction, probability, latency):
+        self.label.setText(f'Prediction: {LABELS[prediction]} ({probability:.2f}), latency {latency:.0f} ms')
+        if self.first_prediction:
+            self.first_prediction = False
+            print(f"First prediction {perf_counter() - STARTED:.2f} s after start, latency {latency:.0f} ms")
 
 if __name__ == '__main__':
+    STARTED = perf_counter()
     # Verificar argumentos de la línea de comandos
     if len(sys.argv) < 3:
         print("Usage: python3 script.py [MAC1] [MAC2]")
         sys.exit(1)
 
-    # Definir los mismos parámetros que se usaron en el entrenamiento
-    input_size = 8
-    hidden_size = 128
-    output_size = 2
-    num_layers = 2
-
-    # Cargar el modelo entrenado
-    model = LSTMModel(input_size=input_size, hidden_size=hidden_size, output_size=output_size, num_layers=num_layers)
-    model.load_state_dict(torch.load('../GUI_CAWT/NNModel/lstm_model.pth'))
-    model.eval()
+    # Cargar el modelo entrenado del registro (mismos parámetros que en el entrenamiento, ver lstm_model.py),
+    # el warm-up corre en segundo plano mientras se conectan los sensores
+    loader = ModelLoader()
+    model = loader.load(MODEL_NAME, MODEL_RUNTIME, threads=MODEL_THREADS, stride=PREDICTION_STRIDE)
 
     # Crear y conectar los sensores
     sensor1_device = MetaWear('EE:1B:72:FA:BF:E8')
@@ -129,7 +109,8 @@ if __name__ == '__main__':
 
     # Crear y ejecutar la aplicación
     app = QApplication(sys.argv)
-    ex = App(model, sensor1, sensor2)
+    ex = App(model, sensor1, sensor2, loader.features)
+    app.aboutToQuit.connect(ex.worker.stop)
     sys.exit(app.exec_())
 
     # Detener los streams y desconectar los sensores
@@ -0,0 +1,83 @@
+# Compares the inference runtimes (runtimes.py) on the recorded sessions of DataCollection
+#   latency      one windowed prediction (100 samples from a zero state), median and p99
+#   throughput   the sessions streamed as the GUI does (StreamingLSTM 'window', a prediction every
+#                `stride` samples), samples/s and the number of subjects one core keeps up with at
+#                SAMPLE_RATE Hz per subject
+#   accuracy     agreement of the predicted class with the float32 model at every prediction, and the max
+#                abs difference of the logits
+# Runtimes without their artifact (run export_model.py) or their package are skipped.
+#
+#   python benchmark_runtimes.py [--runtimes eager torchscript int8 onnx] [--threads 1] [--stride 10]
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import torch
+from lstm_model import WINDOW_SIZE
+from runtimes import HERE, RUNTIMES, artifact_path, load_runtime
+from verify_streaming import load_sessions, streaming
+
+SAMPLE_RATE = 100  # Hz per sensor in the GUI
+
+@torch.no_grad()
+def latency(model, sessions, repeats):
+    windows = [torch.from_numpy(samples[:WINDOW_SIZE]).unsqueeze(0) for samples in sessions.values()]
+    times = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        model.step(windows[i % len(windows)], model.zero_state(1))
+        times.append(time.perf_counter() - start)
+    return np.median(times) * 1000, np.percentile(times, 99) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency, throughput and accuracy of the LSTM runtimes")
+    parser.add_argument('--data', default=os.path.join(HERE, '..', 'DataCollection', 'Quaternion'))
+    parser.add_argument('--folder', default=HERE, help="Folder of the model artifacts")
+    parser.add_argument('--runtimes', nargs='+', choices=RUNTIMES, default=list(RUNTIMES))
+    parser.add_argument('--threads', type=int, default=1, help="Intra-op threads per runtime")
+    parser.add_argument('--stride', type=int, default=10, help="Samples between predictions")
+    parser.add_argument('--chunk', type=int, default=10, help="Samples pushed per call")
+    parser.add_argument('--repeats', type=int, default=200, help="Windowed predictions timed")
+    args = parser.parse_args()
+
+    sessions = {n: s for n, s in load_sessions(args.data).items() if len(s) >= WINDOW_SIZE}
+    if not sessions:
+        sys.exit(f"No chest/left arm session pairs in {args.data}")
+    total = sum(len(samples) for samples in sessions.values())
+    print(f"{len(sessions)} sessions, {total} samples, {args.threads} thread(s)")
+
+    reference = {}
+    reference_model = load_runtime('eager', args.folder, args.threads)
+    for number, samples in sessions.items():
+        reference[number] = streaming(reference_model, samples, 'window', args.stride, args.chunk)[1]
+
+    print(f"{'runtime':>12}{'size KB':>9}{'median ms':>11}{'p99 ms':>9}{'samples/s':>11}{'subjects':>10}"
+          f"{'same class':>12}{'max |diff|':>12}")
+    for runtime in args.runtimes:
+        try:
+            model = load_runtime(runtime, args.folder, args.threads)
+        except (FileNotFoundError, ImportError) as e:
+            print(f"{runtime:>12}  skipped: {e}")
+            continue
+        latency(model, sessions, 10)  # Warm-up
+        median, p99 = latency(model, sessions, args.repeats)
+
+        agree, predictions, diff = 0, 0, 0.0
+        elapsed = 0.0
+        for number, samples in sessions.items():
+            start = time.perf_counter()
+            logits = streaming(model, samples, 'window', args.stride, args.chunk)[1]
+            elapsed += time.perf_counter() - start
+            expected = reference[number]
+            agree += (logits.argmax(1) == expected.argmax(1)).sum().item()
+            predictions += len(expected)
+            diff = max(diff, (logits - expected).abs().max().item())
+
+        size = os.path.getsize(artifact_path(runtime, args.folder)) / 1024
+        rate = total / elapsed
+        print(f"{runtime:>12}{size:>9.0f}{median:>11.3f}{p99:>9.3f}{rate:>11.0f}{rate / SAMPLE_RATE:>10.1f}"
+              f"{agree / predictions:>12.1%}{diff:>12.2e}")
+
+if __name__ == '__main__':
+    main()
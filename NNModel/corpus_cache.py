@@ -0,0 +1,159 @@
+# Columnar cache of the DataCollection workbooks
+# Every sheet of every workbook (one sheet per sensor, named after its MAC) is converted once to .npy files
+# that are opened memory-mapped instead of parsing the xlsx again:
+#   <cache>/<dataset>/<site>/<session>.timestamp.npy   float64, seconds since midnight (time of day column)
+#   <cache>/<dataset>/<site>/<session>.values.npy      float32 (samples, channels), row-major so that a
+#                                                      window of samples is one contiguous slice
+# (a workbook with several sheets gets one pair of files per sheet, <session>_<sheet>). manifest.csv has
+# one row per converted sheet: dataset, site, session, label, samples, channels, source workbook, its
+# sha256 and the size/mtime it had when converted.
+#
+# The workbooks are parsed in parallel processes and only the ones whose content changed are converted
+# again: same size and mtime as in the manifest is taken as unchanged, otherwise the sha256 decides.
+# The label comes from the session name: ..._up / ..._down (test_down1 too) are LABELS 1 / 0, -1 if unknown.
+#
+#   python corpus_cache.py [--data ../DataCollection] [--cache ../DataCollection/cache] [--jobs 4]
+import argparse
+import glob
+import hashlib
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DATA = os.path.join(HERE, '..', 'DataCollection')
+CACHE = os.path.join(DATA, 'cache')
+MANIFEST_COLUMNS = ['dataset', 'site', 'session', 'label', 'samples', 'channels', 'sheet', 'path', 'source',
+                    'sha256', 'size', 'mtime_ns']
+LABEL_NAMES = {'down': 0, 'up': 1}  # Indices of lstm_model.LABELS
+
+def sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def describe(source, data):
+    # dataset, site and session of DataCollection/<dataset>/<Site>/sensor_data_<site>_<session>.xlsx
+    dataset, site_folder, name = os.path.relpath(source, data).split(os.sep)[-3:]
+    site = site_folder.lower()
+    session = re.sub(rf'^sensor_data_{site}_', '', os.path.splitext(name)[0])
+    label = re.search(r'(up|down)\d*$', session)
+    return dataset, site, session, LABEL_NAMES[label.group(1)] if label else -1
+
+def seconds(column):
+    # Time of day 'HH:MM:SS.ffffff' as written by the GUIs (numbers are kept as they are), the day
+    # rollover of sessions recorded across midnight is unwrapped
+    if pd.api.types.is_numeric_dtype(column):
+        return column.to_numpy(np.float64)
+    t = pd.to_timedelta(column.astype(str)).dt.total_seconds().to_numpy(np.float64, copy=True)
+    t[1:] += 86400 * np.cumsum(np.diff(t) < -43200)
+    return t
+
+def convert(source, data, cache):
+    # Runs in a worker process, returns the manifest rows of the workbook
+    dataset, site, session, label = describe(source, data)
+    sheets = pd.read_excel(source, sheet_name=None)
+    rows = []
+    for sheet, df in sheets.items():
+        name = session if len(sheets) == 1 else f"{session}_{sheet}"
+        path = os.path.join(dataset, site, name)
+        # Sample channels only, notes typed into the sheet by hand (text columns) are left out
+        channels = [column for column in df.select_dtypes('number').columns if column != 'timestamp']
+        os.makedirs(os.path.join(cache, dataset, site), exist_ok=True)
+        np.save(os.path.join(cache, path + '.timestamp.npy'), seconds(df['timestamp']))
+        np.save(os.path.join(cache, path + '.values.npy'), np.ascontiguousarray(df[channels].to_numpy(np.float32)))
+        rows.append({'dataset': dataset, 'site': site, 'session': name, 'label': label, 'samples': len(df),
+                     'channels': ' '.join(channels), 'sheet': sheet, 'path': path})
+    return rows
+
+def load_manifest(cache=CACHE):
+    path = os.path.join(cache, 'manifest.csv')
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=MANIFEST_COLUMNS)
+    return pd.read_csv(path, dtype={'session': str, 'sheet': str}, keep_default_na=False)
+
+def save_manifest(manifest, cache=CACHE):
+    # Written to a temporary file and renamed, a crash never leaves a manifest half written
+    path = os.path.join(cache, 'manifest.csv')
+    manifest.to_csv(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+
+def is_fresh(entry, data=DATA):
+    # The workbook of a manifest row has not been touched since it was converted (size and mtime)
+    source = os.path.join(data, entry['source'])
+    if not os.path.exists(source):
+        return False
+    stat = os.stat(source)
+    return stat.st_size == int(entry['size']) and stat.st_mtime_ns == int(entry['mtime_ns'])
+
+def load_session(entry, cache=CACHE, mmap=True):
+    # (timestamp, values) of a manifest row, memory-mapped read-only by default
+    mode = 'r' if mmap else None
+    return (np.load(os.path.join(cache, entry['path'] + '.timestamp.npy'), mmap_mode=mode),
+            np.load(os.path.join(cache, entry['path'] + '.values.npy'), mmap_mode=mode))
+
+def read_channels(source, channels, data=DATA, cache=CACHE):
+    # (samples, channels) float32 of the first sheet of a workbook, from the cache when it is up to date
+    # and parsing the xlsx otherwise
+    manifest = load_manifest(cache)
+    rows = manifest[manifest['source'] == os.path.relpath(source, data)]
+    if len(rows) and is_fresh(rows.iloc[0], data):
+        columns = rows.iloc[0]['channels'].split()
+        return np.ascontiguousarray(load_session(rows.iloc[0], cache)[1][:, [columns.index(c) for c in channels]])
+    return pd.read_excel(source)[channels].to_numpy(np.float32)
+
+def update(data=DATA, cache=CACHE, jobs=None):
+    # Converts the new and changed workbooks, returns (manifest, converted, unchanged)
+    os.makedirs(cache, exist_ok=True)
+    manifest = load_manifest(cache)
+    known = {source: group for source, group in manifest.groupby('source')}
+    keep, pending = [], {}
+    for source in sorted(glob.glob(os.path.join(data, '*', '*', '*.xlsx'))):
+        relative = os.path.relpath(source, data)
+        stat = os.stat(source)
+        group = known.get(relative)
+        if group is not None and is_fresh(group.iloc[0], data):
+            keep.append(group)
+            continue
+        digest = sha256(source)
+        if group is not None and group.iloc[0]['sha256'] == digest:
+            # Touched but same content: only the size/mtime of the manifest are refreshed
+            keep.append(group.assign(size=stat.st_size, mtime_ns=stat.st_mtime_ns))
+            continue
+        pending[relative] = {'source': relative, 'sha256': digest, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    rows = []
+    if pending:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {relative: pool.submit(convert, os.path.join(data, relative), data, cache)
+                       for relative in pending}
+            for relative, future in futures.items():
+                rows += [{**row, **pending[relative]} for row in future.result()]
+    # Workbooks that were deleted drop out of the manifest (their .npy files are left in place)
+    manifest = pd.concat(keep + [pd.DataFrame(rows, columns=MANIFEST_COLUMNS)], ignore_index=True)
+    manifest = manifest[MANIFEST_COLUMNS].sort_values(['dataset', 'site', 'session'], ignore_index=True)
+    save_manifest(manifest, cache)
+    return manifest, len(pending), sum(len(group['source'].unique()) for group in keep)
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the DataCollection workbooks to a .npy cache")
+    parser.add_argument('--data', default=DATA)
+    parser.add_argument('--cache', default=CACHE)
+    parser.add_argument('--jobs', type=int, default=None, help="Worker processes (default: one per core)")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.data):
+        sys.exit(f"No data folder {args.data}")
+    start = time.perf_counter()
+    manifest, converted, unchanged = update(args.data, args.cache, args.jobs)
+    print(f"{converted} workbooks converted, {unchanged} unchanged, {len(manifest)} sessions "
+          f"({manifest['samples'].sum()} samples) in {time.perf_counter() - start:.2f} s -> {args.cache}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+# Exports lstm_model.pth to the artifacts of the runtimes (see runtimes.py)
+# The exported graph is the step of the LSTM, step(x, h, c) -> (logits per sample, h, c), with dynamic
+# batch and number of samples, so the same artifact runs the windowed mode (1, 100, 8) and the streaming
+# lanes of StreamingLSTM (window / stride, samples, 8). Every artifact is exported under a .part name and
+# checked against the float32 model before it takes the place of the previous one:
+#   - max abs difference of the logits and of the state on the shapes StreamingLSTM uses
+#   - agreement of the predicted class with the float32 model on the DataCollection sessions, streamed as
+#     the GUI does (a prediction every 10 samples)
+# An artifact outside the TOLERANCES of its runtime is not written (the previous one, if any, is kept) and
+# the script exits with 1.
+#
+#   python export_model.py [--weights lstm_model.pth] [--out .] [--runtimes torchscript int8 onnx]
+#                          [--data ../DataCollection/Quaternion]
+import argparse
+import os
+import sys
+import warnings
+import torch
+import torch.nn as nn
+from lstm_model import INPUT_SIZE, WINDOW_SIZE, build_model
+from runtimes import HERE, artifact_path, load_runtime
+from verify_streaming import load_sessions, streaming
+
+# Per runtime: max abs difference of the logits (None: not checked) and min class agreement with float32
+TOLERANCES = {'torchscript': (1e-4, 1.0), 'onnx': (1e-4, 1.0), 'int8': (0.1, 0.999)}
+STRIDE = 10  # Samples between the predictions of the agreement check, as in the GUI
+
+class LSTMStep(nn.Module):
+    # LSTMModel.step() with plain tensor arguments, the graph that gets exported
+    def __init__(self, model):
+        super().__init__()
+        self.lstm = model.lstm
+        self.fc = model.fc
+
+    def forward(self, x, h, c):
+        out, (h, c) = self.lstm(x, (h, c))
+        return self.fc(out), h, c
+
+def example_inputs(model, batch=WINDOW_SIZE // 10, samples=10):
+    # Random unit quaternions of both sensors, the range of the real inputs
+    x = torch.randn(batch, samples, INPUT_SIZE // 4, 4)
+    h, c = model.zero_state(batch)
+    return (x / x.norm(dim=-1, keepdim=True)).reshape(batch, samples, INPUT_SIZE), h, c
+
+def export_torchscript(model, path):
+    traced = torch.jit.trace(LSTMStep(model), example_inputs(model))
+    torch.jit.freeze(traced.eval()).save(path)
+
+def export_int8(model, path):
+    # Dynamic quantization of the linear head: int8 weights, the activations are quantized at run time
+    # (nothing to calibrate). The LSTM stays float32: quantized, its error builds up along the samples of
+    # the state (max logit diff 0.41, 99.65% of the classes of the float model on the sessions) while the
+    # head alone stays at 0.05 and 100%
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        quantized = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+        torch.jit.trace(LSTMStep(quantized), example_inputs(model)).save(path)
+
+def export_onnx(model, path):
+    # TorchScript based exporter, the dynamo one needs onnxscript
+    axes = {0: 'batch', 1: 'samples'}
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        torch.onnx.export(LSTMStep(model), example_inputs(model), path, dynamo=False, opset_version=17,
+                          input_names=['x', 'h', 'c'], output_names=['logits', 'h_out', 'c_out'],
+                          dynamic_axes={'x': axes, 'logits': axes, 'h': {1: 'batch'}, 'c': {1: 'batch'},
+                                        'h_out': {1: 'batch'}, 'c_out': {1: 'batch'}})
+    import onnx
+    onnx.checker.check_model(onnx.load(path))
+
+EXPORTERS = {'torchscript': export_torchscript, 'int8': export_int8, 'onnx': export_onnx}
+
+@torch.no_grad()
+def check(model, runtime, path, sessions, reference):
+    # (max abs difference of the logits against the float32 model on the shapes StreamingLSTM uses,
+    #  fraction of the predictions of the sessions with the same class)
+    exported = load_runtime(runtime, path=path)
+    diff = 0.0
+    for batch, samples in ((1, WINDOW_SIZE), (WINDOW_SIZE // 10, 10), (WINDOW_SIZE // 10, 1)):
+        x, h, c = example_inputs(model, batch, samples)
+        expected, (h_ref, c_ref) = model.step(x, (h, c))
+        logits, (h_out, c_out) = exported.step(x, (h, c))
+        diff = max(diff, (logits - expected).abs().max().item(), (h_out - h_ref).abs().max().item())
+    same = total = 0
+    for number, samples in sessions.items():
+        predicted = streaming(exported, samples, 'window', STRIDE, STRIDE)[1].argmax(1)
+        same += (predicted == reference[number]).sum().item()
+        total += len(predicted)
+    return diff, same / max(total, 1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the LSTM to TorchScript, int8 and ONNX")
+    parser.add_argument('--weights', default=artifact_path('eager'))
+    parser.add_argument('--out', default=HERE, help="Folder of the artifacts")
+    parser.add_argument('--runtimes', nargs='+', choices=list(EXPORTERS), default=list(EXPORTERS))
+    parser.add_argument('--data', default=os.path.join(HERE, '..', 'DataCollection', 'Quaternion'),
+                        help="Sessions of the class agreement check")
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    model = build_model()
+    model.load_state_dict(torch.load(args.weights, map_location='cpu'))
+    model.eval()
+    os.makedirs(args.out, exist_ok=True)
+
+    sessions = {n: s for n, s in load_sessions(args.data).items() if len(s) >= WINDOW_SIZE}
+    if not sessions:
+        sys.exit(f"No chest/left arm session pairs in {args.data} to check the artifacts against (--data)")
+    with torch.no_grad():
+        reference = {number: streaming(model, samples, 'window', STRIDE, STRIDE)[1].argmax(1)
+                     for number, samples in sessions.items()}
+
+    failed = False
+    for runtime in args.runtimes:
+        path = artifact_path(runtime, args.out)
+        part = path + '.part'
+        try:
+            EXPORTERS[runtime](model, part)
+            diff, agreement = check(model, runtime, part, sessions, reference)
+        except Exception as e:
+            # An artifact that can not be checked (onnxruntime missing...) is not accepted either
+            print(f"{runtime:>12}: {'not checked' if os.path.exists(part) else 'export failed'}: {e}")
+            failed = True
+            if os.path.exists(part):
+                os.remove(part)
+            continue
+        max_diff, min_agreement = TOLERANCES[runtime]
+        result = f"max |diff| {diff:.2e}, same class {agreement:.2%}"
+        if (max_diff is not None and diff > max_diff) or agreement < min_agreement:
+            limits = (f"max |diff| {max_diff:.0e}, " if max_diff is not None else "") + f"same class {min_agreement:.1%}"
+            print(f"{runtime:>12}: REJECTED, {result} (tolerance {limits}), {path} not written")
+            os.remove(part)
+            failed = True
+            continue
+        os.replace(part, path)
+        print(f"{runtime:>12}: {path} ({os.path.getsize(path) / 1024:.0f} KB), {result}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
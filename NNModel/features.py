@@ -0,0 +1,46 @@
+# Input features of the LSTM from the quaternions of the chest and left arm sensors
+# Frames are rows [w1 x1 y1 z1 w2 x2 y2 z2] (chest, then arm) as the synchronizer and the .npy cache give
+# them, (T, 8) for a session or a stream, (N, T, 8) for N sessions; every kind keeps 8 channels, so the
+# same LSTMModel takes any of them, and is computed in one vectorized pass (quaternions.py).
+#   'raw'       the frames as they are, what lstm_model.pth was trained with
+#   'relative'  the chest orientation and the arm in the frame of the chest (chest^-1 arm), both sign
+#               continuous: the arm pose no longer depends on where the subject faces, and the q / -q jumps
+#               of the NDOF output are gone
+# Sign continuity depends on the samples before, so a session is converted as a whole (WindowDataset)
+# and a stream keeps the last converted sample between chunks (FeatureStream); both start with w >= 0.
+import os
+import sys
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Streaming'))
+from quaternions import continuous, normalize, relative
+
+FEATURES = ('raw', 'relative')
+
+def features(frames, kind='raw', previous=None):
+    # previous: last converted frame (..., 8) of the same stream, None at its start
+    if kind not in FEATURES:
+        raise ValueError(f"Unknown features: {kind} ({', '.join(FEATURES)})")
+    if kind == 'raw':
+        return frames
+    chest, arm = normalize(frames[..., :4].astype(np.float64)), normalize(frames[..., 4:].astype(np.float64))
+    chest = continuous(chest, None if previous is None else previous[..., :4])
+    arm = continuous(relative(chest, arm), None if previous is None else previous[..., 4:])
+    return np.concatenate([chest, arm], axis=-1).astype(np.float32)
+
+class FeatureStream:
+    # Features of a stream converted chunk by chunk, the same as converting it at once
+    def __init__(self, kind='raw'):
+        if kind not in FEATURES:
+            raise ValueError(f"Unknown features: {kind} ({', '.join(FEATURES)})")
+        self.kind = kind
+        self.last = None
+
+    def push(self, frames):
+        out = features(frames, self.kind, self.last)
+        if len(out):
+            self.last = out[-1]
+        return out
+
+    def reset(self):
+        self.last = None
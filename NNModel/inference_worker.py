@@ -0,0 +1,64 @@
+# LSTM inference off the Qt thread
+# Every `interval_ms` the worker takes the frames aligned by the synchronizer since its last job, copies
+# them into a preallocated input tensor (pinned when the model runs on CUDA, so the copy to the device does
+# not block) and steps the streaming LSTM with them; a prediction is due every `stride` samples. The frames
+# are converted to the input features of the model first (features.py, one pass per job). The last
+# prediction of each job is posted with the `prediction` signal, Qt delivers it in the thread of the
+# receiver (queued connection), so the UI only updates a label and never waits for torch.
+#
+# The synchronizer (and the ring buffers behind it) must only be read by the worker once it is started.
+import threading
+import time
+import torch
+from PyQt5.QtCore import QThread, pyqtSignal
+from features import FeatureStream
+from lstm_model import StreamingLSTM
+
+MAX_JOB_FRAMES = 1000  # Frames per copy into the input tensor, longer jobs are split
+
+class InferenceWorker(QThread):
+    # samples since the start, predicted class, its probability, ms from the last frame to the prediction
+    prediction = pyqtSignal(int, int, float, float)
+
+    def __init__(self, model, synchronizer, policy='window', stride=10, interval_ms=100, max_frames=MAX_JOB_FRAMES,
+                 features='raw'):
+        super().__init__()
+        self.synchronizer = synchronizer
+        self.streamer = StreamingLSTM(model, policy=policy, stride=stride)
+        self.features = FeatureStream(features)
+        self.interval = interval_ms / 1000.0
+        self.device = model.device
+        self.input = torch.empty((max_frames, len(synchronizer.columns)), dtype=torch.float32,
+                                 pin_memory=self.device.type == 'cuda')
+        self.jobs = 0
+        self.busy = 0.0  # Seconds spent in the jobs
+        self._stop = threading.Event()
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            self.process()
+
+    def stop(self):
+        self._stop.set()
+        self.wait()
+
+    def process(self):
+        start = time.perf_counter()
+        epochs, frames = self.synchronizer.read()
+        frames = self.features.push(frames)
+        last = None
+        for offset in range(0, len(frames), len(self.input)):
+            n = min(len(self.input), len(frames) - offset)
+            self.input[:n].copy_(torch.from_numpy(frames[offset:offset + n]))
+            first_position = self.streamer.position
+            positions, output = self.streamer.push(self.input[:n].to(self.device, non_blocking=True))
+            if len(output):
+                last = (int(positions[-1]), output[-1], epochs[offset + int(positions[-1]) - first_position - 1])
+        if last is not None:
+            samples, output, epoch = last
+            probabilities = torch.softmax(output, dim=0)
+            prediction = int(torch.argmax(probabilities))
+            latency = time.time() * 1000 - epoch  # The board epoch is in ms of the host clock
+            self.prediction.emit(samples, prediction, float(probabilities[prediction]), latency)
+        self.jobs += 1
+        self.busy += time.perf_counter() - start
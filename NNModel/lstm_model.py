@@ -0,0 +1,140 @@
+# LSTM arm position classifier and its streaming inference
+# LSTMModel is the model the weights in lstm_model.pth were trained with: (batch, 100, 8) windows of the
+# quaternions of both sensors [w1 x1 y1 z1 w2 x2 y2 z2], starting from a zero state, class 1 = Arm Up.
+#
+# StreamingLSTM steps the LSTM one sample at a time keeping (h, c) between calls instead of rerunning the
+# whole window for every prediction. Policies:
+#   'window'      exact equivalent of the windowed mode: window / stride staggered states are stepped as
+#                 one batch, each one starts from zero at a different offset and gives the prediction of
+#                 the window it completes, so a prediction every `stride` samples costs window / stride
+#                 LSTM steps (batched) per sample instead of a full window per prediction.
+#   'continuous'  one state carried over the whole session (the cheapest, a prediction per sample). The
+#                 state is reset with reset() (gaps, new subject) or every `reset_every` samples, and no
+#                 prediction is given during the first `warmup` samples after a reset.
+# StreamingLSTM only uses step(), zero_state(), input_size and output_size of the model, so it runs the
+# exported runtimes of runtimes.py (TorchScript, int8, ONNX) the same way as LSTMModel.
+import torch
+import torch.nn as nn
+
+INPUT_SIZE = 8
+HIDDEN_SIZE = 128
+OUTPUT_SIZE = 2
+NUM_LAYERS = 2
+WINDOW_SIZE = 100
+LABELS = ('Arm Down', 'Arm Up')
+
+class LSTMModel(nn.Module):
+    def __init__(self, input_size, hidden_size, output_size, num_layers):
+        super(LSTMModel, self).__init__()
+        self.input_size = input_size
+        self.output_size = output_size
+        self.num_layers = num_layers
+        self.hidden_size = hidden_size
+        self.lstm = nn.LSTM(input_size, hidden_size, num_layers, batch_first=True)
+        self.fc = nn.Linear(hidden_size, output_size)
+
+    def forward(self, x):
+        h_0 = torch.zeros(self.num_layers, x.size(0), self.hidden_size).to(x.device)
+        c_0 = torch.zeros(self.num_layers, x.size(0), self.hidden_size).to(x.device)
+        out, _ = self.lstm(x, (h_0, c_0))
+        out = self.fc(out[:, -1, :])
+        return out
+
+    def step(self, x, state):
+        # x: (batch, samples, input_size) continuing from `state` = (h, c), returns (logits per sample, state)
+        out, state = self.lstm(x, state)
+        return self.fc(out), state
+
+    @property
+    def device(self):
+        return self.fc.weight.device
+
+    def zero_state(self, batch=1):
+        weight = self.fc.weight
+        shape = (self.num_layers, batch, self.hidden_size)
+        return (torch.zeros(shape, dtype=weight.dtype, device=weight.device),
+                torch.zeros(shape, dtype=weight.dtype, device=weight.device))
+
+def build_model():
+    return LSTMModel(input_size=INPUT_SIZE, hidden_size=HIDDEN_SIZE, output_size=OUTPUT_SIZE, num_layers=NUM_LAYERS)
+
+class StreamingLSTM:
+    def __init__(self, model, policy='window', window=WINDOW_SIZE, stride=1, warmup=WINDOW_SIZE, reset_every=None):
+        if policy not in ('window', 'continuous'):
+            raise ValueError(f"Unknown streaming policy: {policy}")
+        if policy == 'window' and window % stride:
+            raise ValueError(f"The stride ({stride}) must divide the window ({window})")
+        self.model = model
+        self.policy = policy
+        self.window = window
+        self.stride = stride if policy == 'window' else 1
+        self.warmup = warmup
+        self.reset_every = reset_every
+        self.reset()
+
+    def reset(self):
+        # Start of a session (or after a gap): forget everything seen so far
+        lanes = self.window // self.stride if self.policy == 'window' else 1
+        self.state = self.model.zero_state(lanes)
+        self.position = 0     # Samples consumed since the reset
+        self.since_reset = 0  # Samples since the last periodic reset ('continuous')
+
+    @torch.no_grad()
+    def push(self, samples):
+        # samples: (n, input_size) array/tensor of the new frames, in order
+        # Returns (positions, logits): number of samples since reset() at the sample each prediction ends
+        # at, and the (predictions, output_size) logits, both empty if no prediction is due
+        samples = torch.as_tensor(samples, dtype=torch.float32).reshape(-1, self.model.input_size)
+        if self.policy == 'continuous':
+            return self._push_continuous(samples)
+        return self._push_window(samples)
+
+    def _push_continuous(self, samples):
+        positions, logits = [], []
+        start = 0
+        while start < len(samples):
+            # Segments end where a periodic reset falls
+            end = len(samples)
+            if self.reset_every:
+                end = min(end, start + self.reset_every - self.since_reset)
+            out, self.state = self.model.step(samples[start:end].unsqueeze(0), self.state)
+            ready = max(0, self.warmup - self.since_reset)  # Outputs still inside the warm-up
+            if ready < end - start:
+                positions.append(torch.arange(self.position + ready, self.position + end - start) + 1)
+                logits.append(out[0, ready:])
+            self.position += end - start
+            self.since_reset += end - start
+            if self.since_reset == self.reset_every:
+                self.state = self.model.zero_state(1)
+                self.since_reset = 0
+            start = end
+        return self._result(positions, logits)
+
+    def _push_window(self, samples):
+        positions, logits = [], []
+        h, c = self.state
+        lanes = h.size(1)
+        start = 0
+        while start < len(samples):
+            # Every lane steps the same samples up to the next multiple of the stride
+            end = min(len(samples), start + self.stride - self.position % self.stride)
+            chunk = samples[start:end].unsqueeze(0).expand(lanes, -1, -1)
+            out, (h, c) = self.model.step(chunk, (h, c))
+            self.position += end - start
+            start = end
+            if self.position % self.stride == 0:
+                # The lane that started `window` samples ago completed its window, it gives the prediction
+                # and starts the next one from zero
+                lane = (self.position % self.window) // self.stride
+                if self.position >= self.window:
+                    positions.append(torch.tensor([self.position]))
+                    logits.append(out[lane, -1:])
+                h[:, lane] = 0
+                c[:, lane] = 0
+        self.state = (h, c)
+        return self._result(positions, logits)
+
+    def _result(self, positions, logits):
+        if not logits:
+            return torch.zeros(0, dtype=torch.long), torch.zeros(0, self.model.output_size)
+        return torch.cat(positions), torch.cat(logits)
@@ -0,0 +1,89 @@
+# Model loading for the GUIs: registry, memory-mapped weights and warm-up
+# model_registry.json lists the models by name with the artifact of every runtime (paths relative to the
+# registry) and the runtime used by default, so the GUIs load a model by name whatever their working
+# directory is. A model also names the input features it was trained with ("features", 'raw' if not given,
+# see features.py), load() leaves them in `features` for the inference. register() adds a trained model (its
+# eager weights and features) to the registry, train_lstm.py --register does it at the end of training.
+#
+# The first inferences of a freshly loaded model are slow (allocator, kernel selection, lazy pages of the
+# mmapped weights). ModelLoader.load() returns the model at once and runs `warmup` pushes of a stride of
+# samples, with the shapes the streaming inference uses, in a background thread, so that cost is paid
+# while the sensors connect instead of on the first real prediction. The report (load time, first
+# inference, warm-up) is printed when the warm-up ends and kept in `report`.
+import json
+import os
+import threading
+import time
+import torch
+from lstm_model import StreamingLSTM
+from runtimes import HERE, load_runtime
+
+REGISTRY = os.path.join(HERE, 'model_registry.json')
+WARMUP_PUSHES = 20  # Two windows of 100 samples at a prediction every 10 samples
+
+def register(name, weights, features, description='', registry=REGISTRY):
+    # Adds or replaces the entry of `name` with the eager weights, the other entries are kept
+    with open(registry) as f:
+        entries = json.load(f)
+    folder = os.path.dirname(os.path.abspath(registry))
+    entries['models'][name] = {'description': description, 'runtime': 'eager', 'features': features,
+                               'artifacts': {'eager': os.path.relpath(os.path.abspath(weights), folder)}}
+    with open(registry + '.part', 'w') as f:
+        json.dump(entries, f, indent=2)
+        f.write('\n')
+    os.replace(registry + '.part', registry)
+
+class ModelLoader:
+    def __init__(self, registry=REGISTRY):
+        with open(registry) as f:
+            self.registry = json.load(f)
+        self.folder = os.path.dirname(os.path.abspath(registry))
+        self.ready = threading.Event()  # Set when the warm-up is done
+        self.report = ''
+        self.features = 'raw'
+        self.load_ms = 0.0
+        self.first_ms = 0.0   # First inference (one push) of the warm-up
+        self.warmup_ms = 0.0  # Whole warm-up
+
+    def resolve(self, name=None, runtime=None):
+        # Returns (name, runtime, path of the artifact)
+        name = name or self.registry['default']
+        if name not in self.registry['models']:
+            raise KeyError(f"Model {name} is not in the registry ({', '.join(self.registry['models'])})")
+        entry = self.registry['models'][name]
+        runtime = runtime or entry['runtime']
+        if runtime not in entry['artifacts']:
+            raise KeyError(f"Model {name} has no {runtime} artifact ({', '.join(entry['artifacts'])})")
+        return name, runtime, os.path.join(self.folder, entry['artifacts'][runtime])
+
+    def load(self, name=None, runtime=None, threads=None, warmup=WARMUP_PUSHES, policy='window', stride=10):
+        name, runtime, path = self.resolve(name, runtime)
+        self.features = self.registry['models'][name].get('features', 'raw')
+        start = time.perf_counter()
+        model = load_runtime(runtime, threads=threads, path=path)
+        self.load_ms = (time.perf_counter() - start) * 1000
+        label = f"{name} ({runtime}, {os.path.basename(path)})"
+        if warmup:
+            threading.Thread(target=self._warmup, args=(model, label, warmup, policy, stride), daemon=True).start()
+        else:
+            self._done(label, "no warm-up")
+        return model
+
+    def _warmup(self, model, label, pushes, policy, stride):
+        # Identity quaternions, the values do not matter, the shapes do
+        samples = torch.zeros(stride, model.input_size)
+        samples[:, ::4] = 1
+        streamer = StreamingLSTM(model, policy=policy, stride=stride)
+        start = time.perf_counter()
+        for i in range(pushes):
+            streamer.push(samples)
+            if i == 0:
+                self.first_ms = (time.perf_counter() - start) * 1000
+        self.warmup_ms = (time.perf_counter() - start) * 1000
+        self._done(label, f"first inference {self.first_ms:.1f} ms, warm-up {self.warmup_ms:.1f} ms "
+                          f"({pushes} x {stride} samples)")
+
+    def _done(self, label, detail):
+        self.report = f"Model {label}: loaded in {self.load_ms:.1f} ms, {detail}"
+        print(self.report)
+        self.ready.set()
@@ -0,0 +1,79 @@
+# Inference runtimes of the LSTM
+# Every runtime gives what StreamingLSTM needs: step(x, state) -> (logits per sample, state) with x of
+# shape (batch, samples, 8) and state = (h, c), zero_state(batch), input_size, output_size and device.
+#   'eager'        LSTMModel with the float32 weights of lstm_model.pth (what the GUI always ran)
+#   'torchscript'  frozen TorchScript of the step, float32, no Python in the loop (lstm_model.ts)
+#   'int8'         TorchScript of the step with dynamic int8 quantization of the linear layer, the LSTM
+#                  stays float32: int8 weights, activations quantized on the fly (lstm_model_int8.ts)
+#   'onnx'         ONNX graph of the step run with onnxruntime (lstm_model.onnx), `pip install onnxruntime`
+# The artifacts are written next to the weights by export_model.py.
+import os
+import torch
+from lstm_model import INPUT_SIZE, HIDDEN_SIZE, OUTPUT_SIZE, NUM_LAYERS, build_model
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ARTIFACTS = {
+    'eager': 'lstm_model.pth',
+    'torchscript': 'lstm_model.ts',
+    'int8': 'lstm_model_int8.ts',
+    'onnx': 'lstm_model.onnx',
+}
+RUNTIMES = tuple(ARTIFACTS)
+
+class ExportedLSTM:
+    # Common part of the exported runtimes, CPU float32 state
+    input_size = INPUT_SIZE
+    output_size = OUTPUT_SIZE
+    device = torch.device('cpu')
+
+    def zero_state(self, batch=1):
+        shape = (NUM_LAYERS, batch, HIDDEN_SIZE)
+        return torch.zeros(shape), torch.zeros(shape)
+
+class ScriptedLSTM(ExportedLSTM):
+    def __init__(self, path):
+        self.module = torch.jit.load(path, map_location='cpu')
+
+    def step(self, x, state):
+        logits, h, c = self.module(x, state[0], state[1])
+        return logits, (h, c)
+
+class OnnxLSTM(ExportedLSTM):
+    def __init__(self, path, threads=None):
+        import onnxruntime  # Only needed by this runtime
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+
+    def step(self, x, state):
+        logits, h, c = self.session.run(None, {'x': x.contiguous().numpy(), 'h': state[0].contiguous().numpy(),
+                                               'c': state[1].contiguous().numpy()})
+        return torch.from_numpy(logits), (torch.from_numpy(h), torch.from_numpy(c))
+
+def artifact_path(runtime, folder=HERE):
+    if runtime not in ARTIFACTS:
+        raise ValueError(f"Unknown runtime: {runtime} (one of {', '.join(RUNTIMES)})")
+    return os.path.join(folder, ARTIFACTS[runtime])
+
+def load_runtime(runtime='eager', folder=HERE, threads=None, path=None):
+    # threads: intra-op threads of the runtime, 1 to run several subjects per core (for the torch runtimes
+    # the setting is process-wide); path: artifact to load instead of the one of `folder`
+    default = artifact_path(runtime, folder)  # Also checks the runtime name
+    path = path or default
+    if not os.path.exists(path):
+        hint = "" if runtime == 'eager' else ", run export_model.py first"
+        raise FileNotFoundError(f"No {runtime} model at {path}{hint}")
+    if threads and runtime != 'onnx':
+        torch.set_num_threads(threads)
+    if runtime == 'eager':
+        # The weights are memory-mapped and assigned to a model built on the meta device: no random
+        # initialization and no copy of the tensors, the pages are read when they are first used
+        with torch.device('meta'):
+            model = build_model()
+        model.load_state_dict(torch.load(path, map_location='cpu', mmap=True, weights_only=True), assign=True)
+        return model.eval()
+    if runtime == 'onnx':
+        return OnnxLSTM(path, threads)
+    return ScriptedLSTM(path)
@@ -0,0 +1,213 @@
+# Trains LSTMModel on the DataCollection sessions and writes a state_dict that NeuralNetworkLSTMGUI.py
+# loads as it is (same LSTMModel, same input layout, see lstm_model.py)
+# The sessions come from the .npy cache (run corpus_cache.py first) through WindowDataset. Labels:
+#   --labels labels.csv   sample ranges of the sessions: columns session, start, end (excluded), label
+#                         (0 Arm Down, 1 Arm Up), samples of the paired chest/left arm session
+#   --teacher model.pth   windows without a label are labelled with the predictions of an existing model
+#                         (e.g. to retrain the shipped model for a new sample rate or placement)
+#   --features relative   input features of the model (features.py); the GUI has to compute the same ones,
+#                         so a model that is not 'raw' needs --register
+#   --register NAME       adds the best model to model_registry.json with its features (MODEL_NAME of
+#                         NeuralNetworkLSTMGUI.py picks it)
+# plus the labels of the manifest; windows still without a label are left out. Sessions are split between
+# training and validation, never their windows.
+#
+# Reproducible with --seed (Python, NumPy and torch generators, the sampler and every DataLoader worker)
+# and --deterministic (deterministic torch kernels). A checkpoint with the model, the optimizer and the
+# generator states is written after every epoch, --resume continues from it.
+#
+#   python train_lstm.py [--epochs 20] [--workers 2] [--threads 4] [--seed 0] [--out lstm_model_trained.pth]
+import argparse
+import os
+import random
+import sys
+import time
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader
+from corpus_cache import CACHE, load_manifest
+from features import FEATURES
+from lstm_model import WINDOW_SIZE, build_model
+from model_loader import REGISTRY, register
+from verify_streaming import streaming
+from window_dataset import SITES, WindowDataset
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def seed_everything(seed, deterministic):
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    if deterministic:
+        torch.use_deterministic_algorithms(True)
+        torch.backends.cudnn.benchmark = False
+
+def seed_worker(worker_id):
+    # Every worker gets its own seed derived from the seed of the loader
+    seed = torch.initial_seed() % 2 ** 32
+    np.random.seed(seed)
+    random.seed(seed)
+
+def sample_labels(dataset, args):
+    # {session: label of every sample}, -1 where unknown
+    manifest = load_manifest(args.cache)
+    manifest = manifest[(manifest['dataset'] == args.dataset) & manifest['site'].isin(SITES)]
+    lengths = manifest.groupby('session')['samples'].min()
+    session_labels = manifest.groupby('session')['label'].max()
+    labels = {session: np.full(int(n), int(session_labels[session]), dtype=np.int64) for session, n in lengths.items()}
+    if args.teacher:
+        teacher = build_model()
+        teacher.load_state_dict(torch.load(args.teacher, map_location='cpu'))
+        teacher.eval()
+        for session, paths, _ in dataset.sessions:
+            n = len(labels[session])
+            samples = np.hstack([np.load(os.path.join(args.cache, path + '.values.npy'), mmap_mode='r')[:n] for path in paths])
+            # A prediction for every sample with a full window behind it, the label of its last sample
+            positions, logits = streaming(teacher, samples, 'window', 1, 100)
+            unknown = labels[session][positions.astype(np.int64) - 1] < 0
+            labels[session][positions[unknown].astype(np.int64) - 1] = logits.argmax(1).numpy()[unknown]
+    if args.labels:
+        for row in pd.read_csv(args.labels, dtype={'session': str}).itertuples():
+            labels[row.session][row.start:row.end] = row.label
+    return labels
+
+class WindowBatches:
+    # Batches of window indices for the DataLoader (the dataset gathers a whole batch at once from its
+    # memory maps), shuffled every epoch with its own generator so the order is reproducible and resumable
+    def __init__(self, indices, batch_size, shuffle, seed):
+        self.indices = indices
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.generator = torch.Generator()
+        self.generator.manual_seed(seed)
+
+    def __iter__(self):
+        order = self.indices
+        if self.shuffle:
+            order = order[torch.randperm(len(order), generator=self.generator).numpy()]
+        for start in range(0, len(order), self.batch_size):
+            yield order[start:start + self.batch_size]
+
+    def __len__(self):
+        return (len(self.indices) + self.batch_size - 1) // self.batch_size
+
+def make_loader(dataset, batches, args):
+    generator = torch.Generator()
+    generator.manual_seed(args.seed)
+    return DataLoader(dataset, batch_size=None, sampler=batches, num_workers=args.workers,
+                      worker_init_fn=seed_worker, generator=generator, persistent_workers=args.workers > 0)
+
+def run_epoch(model, loader, criterion, optimizer=None):
+    # One pass over the loader, trains if an optimizer is given; returns (loss, accuracy, windows, seconds)
+    model.train(optimizer is not None)
+    total_loss, correct, windows = 0.0, 0, 0
+    start = time.perf_counter()
+    with torch.set_grad_enabled(optimizer is not None):
+        for x, y in loader:
+            output = model(x)
+            loss = criterion(output, y)
+            if optimizer is not None:
+                optimizer.zero_grad()
+                loss.backward()
+                optimizer.step()
+            total_loss += loss.item() * len(y)
+            correct += (output.argmax(1) == y).sum().item()
+            windows += len(y)
+    return total_loss / max(windows, 1), correct / max(windows, 1), windows, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the LSTM arm position classifier")
+    parser.add_argument('--dataset', default='Quaternion', help="Dataset of the cache (DataCollection folder)")
+    parser.add_argument('--cache', default=CACHE)
+    parser.add_argument('--labels', help="CSV of labelled sample ranges: session, start, end, label")
+    parser.add_argument('--teacher', help="Model that labels the windows without a label")
+    parser.add_argument('--features', default='raw', choices=FEATURES, help="Input features of the model (features.py)")
+    parser.add_argument('--register', metavar='NAME', help="Add the model to model_registry.json with its features")
+    parser.add_argument('--stride', type=int, default=1, help="Samples between training windows")
+    parser.add_argument('--val-fraction', type=float, default=0.2, help="Fraction of the sessions for validation")
+    parser.add_argument('--epochs', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--lr', type=float, default=1e-3)
+    parser.add_argument('--workers', type=int, default=2, help="DataLoader worker processes")
+    parser.add_argument('--threads', type=int, default=max(1, (os.cpu_count() or 1) // 2), help="torch intra-op threads")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--deterministic', action='store_true', help="Deterministic torch kernels")
+    parser.add_argument('--checkpoint', default=os.path.join(HERE, 'train_checkpoint.pt'))
+    parser.add_argument('--resume', action='store_true', help="Continue from the checkpoint")
+    parser.add_argument('--out', default=os.path.join(HERE, 'lstm_model_trained.pth'))
+    args = parser.parse_args()
+    if args.features != 'raw' and not args.register:
+        # Loaded as 'raw' otherwise, the GUI would feed it the wrong inputs without any error
+        parser.error(f"--features {args.features} needs --register NAME (the GUI must know the features)")
+    if args.epochs < 1:
+        parser.error("--epochs must be at least 1")
+
+    seed_everything(args.seed, args.deterministic)
+    torch.set_num_threads(args.threads)
+
+    dataset = WindowDataset.from_cache(args.dataset, cache=args.cache, stride=args.stride, features=args.features)
+    if not len(dataset):
+        sys.exit(f"No {args.dataset} sessions recorded at {' and '.join(SITES)} in {args.cache} (run corpus_cache.py)")
+    labels = sample_labels(dataset, args)
+    sessions = [(name, paths, labels[name]) for name, paths, _ in dataset.sessions]
+
+    # Validation sessions drawn with the seed, at least one if there is more than one session
+    order = np.random.default_rng(args.seed).permutation(len(sessions))
+    n_val = min(len(sessions) - 1, max(1 if args.val_fraction > 0 else 0, round(len(sessions) * args.val_fraction)))
+    splits = {'train': sorted(order[n_val:]), 'val': sorted(order[:n_val])}
+    datasets, loaders = {}, {}
+    for split, chosen in splits.items():
+        datasets[split] = WindowDataset([sessions[i] for i in chosen], stride=args.stride, cache=args.cache,
+                                        features=args.features)
+        labelled = np.flatnonzero(datasets[split].window_labels() >= 0) if len(datasets[split]) else np.zeros(0, np.int64)
+        batches = WindowBatches(labelled, args.batch_size, shuffle=split == 'train', seed=args.seed)
+        loaders[split] = make_loader(datasets[split], batches, args) if len(labelled) else None
+        print(f"{split}: sessions {', '.join(datasets[split].names) or '-'}, {len(labelled)} labelled windows "
+              f"of {len(datasets[split])}")
+    if loaders['train'] is None:
+        sys.exit("No labelled windows to train on (--labels, --teacher)")
+
+    model = build_model()
+    optimizer = torch.optim.Adam(model.parameters(), lr=args.lr)
+    criterion = nn.CrossEntropyLoss()
+    first_epoch, best = 0, None
+    if args.resume and os.path.exists(args.checkpoint):
+        checkpoint = torch.load(args.checkpoint, map_location='cpu', weights_only=False)
+        model.load_state_dict(checkpoint['model'])
+        optimizer.load_state_dict(checkpoint['optimizer'])
+        loaders['train'].sampler.generator.set_state(checkpoint['sampler'])
+        torch.set_rng_state(checkpoint['torch'])
+        first_epoch = checkpoint['epoch'] + 1
+        best = checkpoint['best']
+        print(f"Resumed from {args.checkpoint} at epoch {first_epoch + 1}")
+
+    for epoch in range(first_epoch, args.epochs):
+        loss, accuracy, windows, seconds = run_epoch(model, loaders['train'], criterion, optimizer)
+        report = (f"epoch {epoch + 1}/{args.epochs} loss {loss:.4f} acc {accuracy:.1%} "
+                  f"{windows / seconds:.0f} windows/s ({windows * WINDOW_SIZE / seconds:.0f} samples/s)")
+        val_loss = loss
+        if loaders['val'] is not None:
+            val_loss, val_accuracy, _, _ = run_epoch(model, loaders['val'], criterion)
+            report += f" | val loss {val_loss:.4f} acc {val_accuracy:.1%}"
+        print(report)
+        if best is None or val_loss < best:
+            # Plain state_dict of LSTMModel, what the GUI loads
+            best = val_loss
+            torch.save(model.state_dict(), args.out)
+        torch.save({'epoch': epoch, 'best': best, 'model': model.state_dict(), 'optimizer': optimizer.state_dict(),
+                    'sampler': loaders['train'].sampler.generator.get_state(), 'torch': torch.get_rng_state(),
+                    'args': vars(args)}, args.checkpoint)
+    if best is None or not os.path.exists(args.out):
+        # Resumed at or after --epochs into another --out: nothing trained here to report or register
+        sys.exit(f"No model in {args.out}: the checkpoint already has {first_epoch} epochs of --epochs {args.epochs}")
+    print(f"Best model (val loss {best:.4f}) in {args.out}, features '{args.features}'")
+    if args.register:
+        register(args.register, args.out, args.features,
+                 f"Arm Down / Arm Up, '{args.features}' features of the chest and left arm quaternions, "
+                 f"{WINDOW_SIZE} sample window")
+        print(f"Registered as '{args.register}' in {REGISTRY}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+# Checks the streaming inference (lstm_model.StreamingLSTM) against the windowed mode of the GUI
+# (LSTMModel.forward over the last 100 samples for every prediction) on the recorded sessions of
+# DataCollection: session i is the chest workbook i joined row by row with the left arm workbook i.
+# The 'window' policy must give the same logits; the 'continuous' policy is only reported (agreement of
+# the predicted class), its state is not reset at every window so small differences are expected.
+#
+#   python verify_streaming.py [--stride 10] [--chunk 10] [--data ../DataCollection/Quaternion]
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+import numpy as np
+import torch
+from corpus_cache import read_channels
+from lstm_model import WINDOW_SIZE, StreamingLSTM, build_model
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CHANNELS = ['w', 'x', 'y', 'z']
+
+def load_sessions(folder):
+    # {session number: (samples, 8) float32}, chest quaternion followed by the left arm one, read from the
+    # .npy cache of corpus_cache.py when it is up to date
+    sessions = {}
+    for chest_path in glob.glob(os.path.join(folder, 'Chest', 'sensor_data_chest_*.xlsx')):
+        number = re.search(r'_(\d+)\.xlsx$', chest_path)
+        arm_path = os.path.join(folder, 'Left_Arm', f"sensor_data_left_arm_{number.group(1)}.xlsx") if number else None
+        if not arm_path or not os.path.exists(arm_path):
+            continue
+        chest = read_channels(chest_path, CHANNELS)
+        arm = read_channels(arm_path, CHANNELS)
+        samples = min(len(chest), len(arm))
+        sessions[int(number.group(1))] = np.hstack([chest[:samples], arm[:samples]])
+    return dict(sorted(sessions.items()))
+
+@torch.no_grad()
+def windowed(model, samples, stride):
+    # What the GUI did: one forward of the whole window for every prediction
+    positions = np.arange(WINDOW_SIZE, len(samples) + 1, stride)
+    logits = [model(torch.from_numpy(samples[p - WINDOW_SIZE:p]).unsqueeze(0)) for p in positions]
+    return positions, torch.cat(logits)
+
+def streaming(model, samples, policy, stride, chunk):
+    # Samples delivered `chunk` at a time, as the synchronizer hands them to the GUI
+    streamer = StreamingLSTM(model, policy=policy, stride=stride)
+    positions, logits = [], []
+    for start in range(0, len(samples), chunk):
+        p, l = streamer.push(samples[start:start + chunk])
+        positions.append(p)
+        logits.append(l)
+    return torch.cat(positions).numpy(), torch.cat(logits)
+
+def main():
+    parser = argparse.ArgumentParser(description="Streaming LSTM inference against the windowed mode")
+    parser.add_argument('--data', default=os.path.join(HERE, '..', 'DataCollection', 'Quaternion'))
+    parser.add_argument('--weights', default=os.path.join(HERE, 'lstm_model.pth'))
+    parser.add_argument('--stride', type=int, default=10, help="Samples between predictions")
+    parser.add_argument('--chunk', type=int, default=10, help="Samples pushed per call")
+    parser.add_argument('--tolerance', type=float, default=1e-4, help="Max abs difference of the logits")
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+    model = build_model()
+    model.load_state_dict(torch.load(args.weights))
+    model.eval()
+
+    sessions = load_sessions(args.data)
+    if not sessions:
+        sys.exit(f"No chest/left arm session pairs in {args.data}")
+
+    failed = False
+    totals = {'windowed': 0.0, 'window': 0.0, 'continuous': 0.0}
+    print(f"{'session':>8}{'samples':>9}{'preds':>7}{'max |diff|':>12}{'same class':>12}{'continuous':>12}")
+    for number, samples in sessions.items():
+        if len(samples) < WINDOW_SIZE:
+            continue
+        start = time.perf_counter()
+        ref_positions, ref_logits = windowed(model, samples, args.stride)
+        totals['windowed'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        positions, logits = streaming(model, samples, 'window', args.stride, args.chunk)
+        totals['window'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        cont_positions, cont_logits = streaming(model, samples, 'continuous', 1, args.chunk)
+        totals['continuous'] += time.perf_counter() - start
+
+        same_positions = np.array_equal(positions, ref_positions)
+        diff = (logits - ref_logits).abs().max().item() if same_positions else float('inf')
+        same_class = (logits.argmax(1) == ref_logits.argmax(1)).float().mean().item() if same_positions else 0.0
+        # Continuous predictions at the positions of the windowed ones
+        cont = cont_logits[np.searchsorted(cont_positions, ref_positions)].argmax(1)
+        cont_agreement = (cont == ref_logits.argmax(1)).float().mean().item()
+        failed |= not diff <= args.tolerance
+        print(f"{number:>8}{len(samples):>9}{len(ref_positions):>7}{diff:>12.2e}{same_class:>12.1%}{cont_agreement:>12.1%}")
+
+    print(f"time windowed {totals['windowed']:.3f} s | streaming window {totals['window']:.3f} s "
+          f"({totals['windowed'] / totals['window']:.1f}x) | streaming continuous {totals['continuous']:.3f} s "
+          f"(prediction every sample)")
+    print("FAILED" if failed else "OK: streaming 'window' policy matches the windowed mode")
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
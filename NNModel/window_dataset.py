@@ -0,0 +1,124 @@
+# Sliding windows of the recorded sessions for training the LSTM, without copying them
+# A session is the chest and left arm recordings of the same session number in the .npy cache of
+# corpus_cache.py, joined on the channels (the LSTM input [w1 x1 y1 z1 w2 x2 y2 z2]). Its windows are
+# strided views (sliding_window_view) of the memory-mapped arrays, so the dataset only holds an index of
+# the sessions: memory stays at the size of the corpus (paged in by the OS) instead of window times it.
+# Only a batch is ever copied, when it is gathered into one (batch, window, channels) array. With
+# `features` other than 'raw' (features.py) every session is converted once, as a whole, when it is
+# opened: those arrays are held in memory instead of the memory maps.
+#
+# Labels are one per session (the manifest) or one per sample (`labels` of from_cache); with per sample
+# labels `align` picks the sample of the window that labels it: 'last' (the sample the streaming inference
+# predicts at), 'center', 'first' or an offset in the window.
+#
+# Index with an int for one (window, label) or with a sequence of indices for a batch, e.g.
+#   DataLoader(dataset, batch_size=None, sampler=BatchSampler(RandomSampler(dataset), 64, drop_last=False))
+import os
+import numpy as np
+import torch
+from numpy.lib.stride_tricks import sliding_window_view
+from torch.utils.data import Dataset
+from corpus_cache import CACHE, load_manifest
+from features import features as convert
+from lstm_model import WINDOW_SIZE
+
+SITES = ('chest', 'left_arm')  # Order of the sensors in the LSTM input
+
+class WindowDataset(Dataset):
+    def __init__(self, sessions, window=WINDOW_SIZE, stride=1, align='last', cache=CACHE, features='raw'):
+        # sessions: [(name, [paths in the cache of the parts joined on the channels], label)], label is an
+        # int or an array with the label of every sample
+        offsets = {'first': 0, 'center': window // 2, 'last': window - 1}
+        self.offset = offsets[align] if isinstance(align, str) else int(align)
+        if not 0 <= self.offset < window:
+            raise ValueError(f"The label offset ({align}) must be inside the window ({window})")
+        self.sessions = sessions
+        self.window = window
+        self.stride = stride
+        self.cache = cache
+        self.features = features
+        self._views = None
+        lengths = [min(len(part) for part in parts) for parts in self._open()]
+        self.names = [name for name, _, _ in sessions]
+        self.counts = np.array([max(0, (n - window) // stride + 1) for n in lengths], dtype=np.int64)
+        self.starts = np.concatenate([[0], np.cumsum(self.counts)])  # First index of every session
+        self.channels = sum(part.shape[1] for part in self._open()[0]) if sessions else 0
+
+    @classmethod
+    def from_cache(cls, dataset='Quaternion', sites=SITES, labels=None, cache=CACHE, **kwargs):
+        # Sessions recorded at every site; labels: {session: int or array}, the manifest label otherwise
+        manifest = load_manifest(cache)
+        manifest = manifest[manifest['dataset'] == dataset]
+        by_site = [manifest[manifest['site'] == site].set_index('session') for site in sites]
+        sessions = []
+        for session in sorted(set.intersection(*(set(rows.index) for rows in by_site)), key=_session_key):
+            label = labels[session] if labels is not None and session in labels else int(by_site[-1].loc[session, 'label'])
+            sessions.append((session, [rows.loc[session, 'path'] for rows in by_site], label))
+        return cls(sessions, cache=cache, **kwargs)
+
+    def _open(self):
+        # Memory-mapped on first use in every process (the DataLoader workers open their own maps)
+        if self._views is None:
+            self._views = [[np.load(os.path.join(self.cache, path + '.values.npy'), mmap_mode='r') for path in paths]
+                           for _, paths, _ in self.sessions]
+            if self.features != 'raw':
+                lengths = [min(len(part) for part in parts) for parts in self._views]
+                self._views = [[convert(np.hstack([part[:n] for part in parts]), self.features)]
+                               for parts, n in zip(self._views, lengths)]
+        return self._views
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_views'] = None  # A pickled memmap would carry its whole array
+        return state
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    def locate(self, index):
+        # (session number in self.sessions, first sample of the window) of dataset indices
+        index = np.asarray(index, dtype=np.int64)
+        if np.any((index < 0) | (index >= len(self))):
+            raise IndexError(f"Window index out of range (0 to {len(self) - 1})")
+        session = np.searchsorted(self.starts, index, side='right') - 1
+        return session, (index - self.starts[session]) * self.stride
+
+    def windows(self, session):
+        # Zero-copy (windows, window, channels) views of every part of a session, one window per sample
+        return [sliding_window_view(part[:self.window + (self.counts[session] - 1) * self.stride], self.window,
+                                    axis=0).transpose(0, 2, 1) for part in self._open()[session]]
+
+    def label(self, session, start):
+        label = self.sessions[session][2]
+        if np.ndim(label) == 0:
+            return np.full(np.shape(start), label, dtype=np.int64)
+        return np.asarray(label, dtype=np.int64)[start + self.offset]
+
+    def window_labels(self):
+        # Label of every window, without reading the samples
+        sessions, starts = self.locate(np.arange(len(self)))
+        labels = np.empty(len(self), dtype=np.int64)
+        for session in range(len(self.sessions)):
+            rows = sessions == session
+            labels[rows] = self.label(session, starts[rows])
+        return labels
+
+    def __getitem__(self, index):
+        batched = np.ndim(index) > 0
+        sessions, starts = self.locate(np.atleast_1d(index))
+        x = np.empty((len(starts), self.window, self.channels), dtype=np.float32)
+        y = np.empty(len(starts), dtype=np.int64)
+        for session in np.unique(sessions):
+            rows = sessions == session
+            column = 0
+            for view in self.windows(session):
+                x[rows, :, column:column + view.shape[2]] = view[starts[rows]]
+                column += view.shape[2]
+            y[rows] = self.label(session, starts[rows])
+        if batched:
+            return torch.from_numpy(x), torch.from_numpy(y)
+        return torch.from_numpy(x[0]), int(y[0])
+
+def _session_key(session):
+    # Numbered sessions in numeric order, named ones (test_up) after them
+    return (0, int(session), '') if session.isdigit() else (1, 0, session)
@@ -0,0 +1,137 @@
+# Blocking, batched consumer of a sample queue, the writer stage of the recording scripts
+# The data handlers only call put(). The writer thread sleeps in queue.get() until there is something to
+# write (no polling), drains up to `max_batch` items at once and hands them to the sink as one list. The
+# sink is flushed when `flush_rows` items were written since the last flush or `flush_interval` seconds
+# passed, and once more when the writer stops after writing everything still queued.
+#
+# Sinks: CsvSink (csv.writerows, flush() of the file) and RecorderSink (binary records of recorder.py,
+# one write and one fsync per flush). Stats: queue depth (current and max) and lag, the time an item
+# waited in the queue before it was written (mean and max), printed every `report_period` seconds.
+import csv
+import queue
+import threading
+import time
+import numpy as np
+
+MAX_BATCH = 1000
+FLUSH_ROWS = 5000
+FLUSH_INTERVAL = 1.0  # s
+_STOP = object()
+
+class BatchWriter(threading.Thread):
+    def __init__(self, sink, max_batch=MAX_BATCH, flush_rows=FLUSH_ROWS, flush_interval=FLUSH_INTERVAL,
+                 report_period=5.0, name='Writer'):
+        super().__init__(name=name, daemon=True)
+        self.sink = sink
+        self.queue = queue.Queue()
+        self.max_batch = max_batch
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.report_period = report_period
+        self.items = 0
+        self.batches = 0
+        self.flushes = 0
+        self.max_depth = 0
+        self._lag_total = 0.0
+        self.max_lag = 0.0
+        self.report = ''
+
+    def put(self, item):
+        # Called by the producers (data handlers), never blocks
+        self.queue.put((time.perf_counter(), item))
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def stop(self):
+        # Writes everything queued before the call, flushes and waits for the thread
+        self.queue.put(_STOP)
+        self.join()
+
+    def run(self):
+        unflushed = 0
+        last_flush = last_report = time.perf_counter()
+        stopping = False
+        while not stopping:
+            timeout = max(0.0, last_flush + self.flush_interval - time.perf_counter())
+            batch = []
+            try:
+                item = self.queue.get(timeout=timeout if unflushed else None)
+                # Whatever else is already queued goes in the same batch
+                while item is not _STOP:
+                    batch.append(item)
+                    if len(batch) == self.max_batch:
+                        break
+                    item = self.queue.get_nowait()
+                stopping = item is _STOP
+            except queue.Empty:
+                pass
+            if batch:
+                self.max_depth = max(self.max_depth, self.queue.qsize() + len(batch))
+                self.sink.write([item for _, item in batch])
+                now = time.perf_counter()
+                lags = [now - stamp for stamp, _ in (batch[0], batch[-1])]  # Oldest and newest of the batch
+                self._lag_total += (lags[0] + lags[1]) / 2 * len(batch)
+                self.max_lag = max(self.max_lag, lags[0])
+                self.items += len(batch)
+                self.batches += 1
+                unflushed += len(batch)
+            now = time.perf_counter()
+            if unflushed and (stopping or unflushed >= self.flush_rows or now - last_flush >= self.flush_interval):
+                self.sink.flush()
+                self.flushes += 1
+                unflushed = 0
+                last_flush = now
+            if self.report_period and now - last_report >= self.report_period:
+                self._report()
+                last_report = now
+        self._report()
+
+    def _report(self):
+        mean_lag = self._lag_total / self.items if self.items else 0.0
+        self.report = (f"{self.name}: {self.items} rows in {self.batches} batches, {self.flushes} flushes, "
+                       f"queue depth {self.depth()} (max {self.max_depth}), lag mean {mean_lag * 1000:.1f} ms "
+                       f"max {self.max_lag * 1000:.1f} ms")
+        print(self.report)
+
+class CsvSink:
+    def __init__(self, path, fieldnames):
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(fieldnames)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class RecorderSink:
+    # Rows as lists/tuples: the sensor index, the epoch and the channel values at the given columns
+    def __init__(self, recorder, sensor_column, epoch_column, value_columns):
+        self.recorder = recorder
+        self.sensor_column = sensor_column
+        self.epoch_column = epoch_column
+        self.value_columns = list(value_columns)
+        self.pending = []
+
+    def write(self, rows):
+        table = np.array(rows, dtype=np.float64)
+        records = np.empty(len(rows), dtype=self.recorder.dtype)
+        records['sensor'] = table[:, self.sensor_column]
+        records['epoch'] = table[:, self.epoch_column]
+        for channel, column in zip(self.recorder.channels, self.value_columns):
+            records[channel] = table[:, column]
+        self.pending.append(records)
+
+    def flush(self):
+        if self.pending:
+            self.recorder.write(np.concatenate(self.pending))
+            self.pending = []
+
+    def close(self):
+        self.flush()
+        self.recorder.close()
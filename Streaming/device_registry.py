@@ -0,0 +1,167 @@
+# Registry of the known boards over the state the SDK serializes in .metawear/<MAC>.json
+# MetaWear(mac) reads and writes that file in the .metawear folder of the working directory, so every
+# folder of the repository ended up with its own copy. The registry keeps one folder (the .metawear of
+# the repository root) for every script and handles it deliberately:
+#   - a board with a saved state is opened with it (deserialize): libmetawear skips the service discovery
+#     and the connection only costs the BLE link (warm connect), without it the modules are discovered
+#     and the new state is saved (cold connect)
+#   - the firmware of the board is checked after connecting; if it changed since the state was saved
+#     (libmetawear discovers the modules again in that case) the saved state is replaced by the new one
+#   - reattach() re-makes the link of a board that dropped mid-session with the same MetaWear object,
+#     which still holds its state in memory
+#   - model, firmware, serial, first/last seen and the last HISTORY connection times (cold, warm or
+#     reattach, in ms) of every board are kept in registry.json next to the state files
+#
+#   python device_registry.py                     known boards, firmware and connection times
+#   python device_registry.py --import ../GUI_Developer/.metawear   adopt the states of another folder
+#   python device_registry.py --forget MAC        drop the saved state of a board
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+import numpy as np
+from mbientlab.metawear import MetaWear
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CACHE = os.path.join(HERE, '..', '.metawear')
+INDEX = 'registry.json'
+HISTORY = 20  # Connection times kept per board
+
+def _mac(name):
+    # 'F11EE26F1DE1.json' -> 'F1:1E:E2:6F:1D:E1'
+    stem = os.path.splitext(name)[0].upper()
+    return ':'.join(stem[i:i + 2] for i in range(0, len(stem), 2))
+
+class DeviceRegistry:
+    def __init__(self, folder=CACHE):
+        self.folder = os.path.abspath(folder)
+        self._lock = threading.Lock()
+        self.boards = self._load()
+
+    def state_path(self, mac):
+        return os.path.join(self.folder, '%s.json' % mac.upper().replace(':', ''))
+
+    def _load(self):
+        boards = {}
+        path = os.path.join(self.folder, INDEX)
+        if os.path.exists(path):
+            with open(path) as f:
+                boards = json.load(f)
+        # States saved by the SDK before the registry knew the board
+        for name in sorted(os.listdir(self.folder)) if os.path.isdir(self.folder) else []:
+            if name.endswith('.json') and name != INDEX and _mac(name) not in boards:
+                with open(os.path.join(self.folder, name)) as f:
+                    boards[_mac(name)] = {'info': json.load(f).get('info', {}), 'connects': []}
+        return boards
+
+    def _save(self):
+        # Temporary file and rename, the bring-up threads of several boards save at the same time
+        os.makedirs(self.folder, exist_ok=True)
+        path = os.path.join(self.folder, INDEX)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.boards, f, indent=2)
+        os.replace(path + '.tmp', path)
+
+    def has_state(self, mac):
+        return os.path.exists(self.state_path(mac))
+
+    def device(self, mac):
+        # MetaWear object of the board with the saved state restored, if there is one
+        return MetaWear(mac, cache_path=self.folder, deserialize=self.has_state(mac))
+
+    def connect(self, mac):
+        # Connected MetaWear of the board, warm when possible; the state is saved after a cold connect
+        warm = self.has_state(mac)
+        device = self.device(mac)
+        start = time.perf_counter()
+        device.connect(serialize=False)
+        known = self.boards.get(device.address, {}).get('info', {}).get('firmware')
+        firmware = device.info.get('firmware')
+        if warm and known and firmware != known:
+            # libmetawear found another firmware revision than the one of the state and discovered the
+            # modules again, the saved state is replaced by the new one
+            print(f"{device.address}: firmware {known} -> {firmware}, saved state replaced")
+            warm = False
+        ms = (time.perf_counter() - start) * 1000
+        if not warm:
+            os.makedirs(self.folder, exist_ok=True)
+            device.serialize()
+        self._record(device, 'warm' if warm else 'cold', ms)
+        return device
+
+    def reattach(self, device):
+        # Link of a board that dropped, its state is still in memory: no discovery. Returns the ms it took
+        start = time.perf_counter()
+        device.connect(serialize=False)
+        ms = (time.perf_counter() - start) * 1000
+        self._record(device, 'reattach', ms)
+        return ms
+
+    def _record(self, device, kind, ms):
+        now = datetime.now().isoformat(timespec='seconds')
+        with self._lock:
+            entry = self.boards.setdefault(device.address, {'info': {}, 'connects': []})
+            entry['info'] = dict(device.info)
+            entry.setdefault('first_seen', now)
+            entry['last_seen'] = now
+            entry['connects'] = (entry['connects'] + [{'when': now, 'kind': kind, 'ms': round(ms, 1)}])[-HISTORY:]
+            self._save()
+
+    def last_connect(self, mac):
+        connects = self.boards.get(mac.upper(), {}).get('connects', [])
+        return connects[-1] if connects else None
+
+    def latency(self, mac, kind):
+        # Median ms of the kept connections of one kind, None if there is none
+        times = [c['ms'] for c in self.boards.get(mac.upper(), {}).get('connects', []) if c['kind'] == kind]
+        return float(np.median(times)) if times else None
+
+    def forget(self, mac):
+        if self.has_state(mac):
+            os.remove(self.state_path(mac))
+
+    def adopt(self, folder):
+        # Copies the states of another .metawear folder that are newer than the ones of the registry
+        adopted = []
+        for name in sorted(os.listdir(folder)):
+            source = os.path.join(folder, name)
+            if not name.endswith('.json') or name == INDEX:
+                continue
+            target = self.state_path(_mac(name))
+            if not os.path.exists(target) or os.path.getmtime(source) > os.path.getmtime(target):
+                os.makedirs(self.folder, exist_ok=True)
+                shutil.copy2(source, target)
+                with open(source) as f:
+                    self.boards.setdefault(_mac(name), {'connects': []})['info'] = json.load(f).get('info', {})
+                adopted.append(_mac(name))
+        with self._lock:
+            self._save()
+        return adopted
+
+def main():
+    parser = argparse.ArgumentParser(description="Known MetaWear boards and their saved state")
+    parser.add_argument('--folder', default=CACHE)
+    parser.add_argument('--import', dest='imports', action='append', default=[], metavar='FOLDER',
+                        help="Adopt the states of another .metawear folder")
+    parser.add_argument('--forget', action='append', default=[], metavar='MAC')
+    args = parser.parse_args()
+
+    registry = DeviceRegistry(args.folder)
+    for folder in args.imports:
+        print(f"{folder}: {', '.join(registry.adopt(folder)) or 'nothing newer'}")
+    for mac in args.forget:
+        registry.forget(mac)
+        print(f"{mac}: saved state removed")
+    for mac, entry in sorted(registry.boards.items()):
+        info = entry.get('info', {})
+        times = ', '.join(f"{kind} {registry.latency(mac, kind):.0f} ms" for kind in ('cold', 'warm', 'reattach')
+                          if registry.latency(mac, kind) is not None)
+        print(f"{mac}: model {info.get('model', '?')} firmware {info.get('firmware', '?')} serial "
+              f"{info.get('serial', '?')}, {'state saved' if registry.has_state(mac) else 'no state'}"
+              + (f", last seen {entry['last_seen']}" if 'last_seen' in entry else '') + (f", {times}" if times else ''))
+
+if __name__ == '__main__':
+    main()
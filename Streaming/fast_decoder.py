@@ -0,0 +1,132 @@
+# Fast-path decoder for the libmetawear data callbacks
+# parse_value() builds a new ctypes structure per sample (plus the lists/dicts/timestamps the handlers
+# made with it), and the callback cost is what limits the number of sensors per host. This decoder views
+# the storage of a SampleRingBuffer as an array of ctypes records and copies the raw payload of the
+# callback straight into the next slot: the board epoch stays an int64 and no per-sample structure,
+# list or string is built. Structure assignments are copied in C, no foreign function call is made.
+#
+# The record of the ring buffer must have the layout of the payload: QUATERNION (w, x, y, z),
+# EULER_ANGLE (heading, pitch, roll, yaw) and CARTESIAN_FLOAT (x, y, z), the latter is what the
+# acc/gyro/mag and the packed acc/gyro signals deliver.
+#
+# Microbenchmark against parse_value (uses the simulator when the MetaWear SDK is not installed):
+#   python fast_decoder.py [--samples 200000]
+from ctypes import Structure, c_longlong, c_void_p, cast, pointer, sizeof
+import argparse
+import time
+
+try:
+    from mbientlab.metawear.cbindings import CartesianFloat, Data, DataTypeId, EulerAngles, Quaternion
+except ImportError:
+    import metawear_sim
+    metawear_sim.install()
+    from mbientlab.metawear.cbindings import CartesianFloat, Data, DataTypeId, EulerAngles, Quaternion
+
+PAYLOAD_TYPES = {
+    DataTypeId.QUATERNION: Quaternion,
+    DataTypeId.EULER_ANGLE: EulerAngles,
+    DataTypeId.CARTESIAN_FLOAT: CartesianFloat,
+}
+
+def _record_type(payload_type):
+    # Same layout as the NumPy dtype of the ring buffer: int64 epoch followed by the packed payload
+    class Record(Structure):
+        _pack_ = 1
+        _fields_ = [("epoch", c_longlong), ("payload", payload_type)]
+    return Record
+
+_RECORD_TYPES = {type_id: _record_type(payload_type) for type_id, payload_type in PAYLOAD_TYPES.items()}
+
+class FastDecoder:
+    def __init__(self, buffer, type_id):
+        if type_id not in PAYLOAD_TYPES:
+            raise ValueError(f"Unsupported data type id: {type_id}")
+        record_type = _RECORD_TYPES[type_id]
+        if buffer.dtype.itemsize != sizeof(record_type):
+            raise ValueError(f"Channels {buffer.channels} do not match the payload of data type id {type_id}")
+        self.buffer = buffer
+        self.type_id = type_id
+        self.payload_type = PAYLOAD_TYPES[type_id]
+        # ctypes view of the 2 * capacity slots of the ring buffer (the buffer keeps the memory alive)
+        self.records = (record_type * (2 * buffer.capacity)).from_address(buffer.address)
+        self.rejected = 0  # Samples with another data type id (wrong signal subscribed)
+
+    def decode(self, data):
+        # `data` is the POINTER(Data) received by the FnVoid_VoidP_DataP callback
+        contents = data.contents
+        if contents.type_id != self.type_id:
+            self.rejected += 1
+            return False
+        buffer = self.buffer
+        i = buffer.count % buffer.capacity
+        record = self.records[i]
+        record.epoch = contents.epoch
+        record.payload = self.payload_type.from_address(contents.value)
+        self.records[i + buffer.capacity] = record
+        buffer.count += 1  # Publish the sample to the readers once it is complete
+        return True
+
+# ---------------------------------------------------------------------------------------------------------
+# Microbenchmark
+# ---------------------------------------------------------------------------------------------------------
+def _benchmark(samples):
+    from datetime import datetime
+    from mbientlab.metawear import parse_value
+    from mbientlab.metawear.cbindings import FnVoid_VoidP_DataP, Quaternion
+    from ring_buffer import SampleRingBuffer, QUATERNION_CHANNELS
+
+    # One quaternion sample laid out as libmetawear hands it to the callbacks
+    value = Quaternion(w=1.0, x=0.1, y=0.2, z=0.3)
+    data = Data(epoch=int(time.time() * 1000), extra=None, value=cast(pointer(value), c_void_p),
+                type_id=DataTypeId.QUATERNION, length=sizeof(value))
+    data_pointer = pointer(data)
+
+    values = []
+    def legacy_handler(ctx, data):
+        # Handler of GUI_Final before the ring buffer (without the sleep throttle)
+        parsed = parse_value(data)
+        timestamp = datetime.now().strftime('%H:%M:%S.%f')
+        values.append({'timestamp': timestamp, 'w': parsed.w, 'x': parsed.x, 'y': parsed.y, 'z': parsed.z})
+
+    parse_buffer = SampleRingBuffer(QUATERNION_CHANNELS, 100000)
+    def parse_value_handler(ctx, data):
+        parsed = parse_value(data)
+        parse_buffer.append(data.contents.epoch, parsed.w, parsed.x, parsed.y, parsed.z)
+
+    decoder = FastDecoder(SampleRingBuffer(QUATERNION_CHANNELS, 100000), DataTypeId.QUATERNION)
+    def fast_handler(ctx, data):
+        decoder.decode(data)
+
+    def empty_handler(ctx, data):
+        pass
+
+    results = []
+    for name, handler in (('parse_value + dict + strftime', legacy_handler),
+                          ('parse_value + ring buffer', parse_value_handler),
+                          ('FastDecoder', fast_handler),
+                          ('empty handler (ctypes overhead)', empty_handler)):
+        # Called through the ctypes callback wrapper, as libmetawear does (calling it from python adds the
+        # python -> C transition, the empty handler row measures that fixed cost)
+        callback = FnVoid_VoidP_DataP(handler)
+        for _ in range(1000):
+            callback(None, data_pointer)
+        start = time.perf_counter()
+        for _ in range(samples):
+            callback(None, data_pointer)
+        elapsed = time.perf_counter() - start
+        results.append((name, elapsed / samples))
+
+    baseline = results[0][1]
+    overhead = results[-1][1]
+    print(f"{'handler':<34}{'us/sample':>10}{'samples/s':>12}{'speedup':>9}{'body us':>9}{'body speedup':>14}")
+    for name, per_sample in results:
+        body = per_sample - overhead
+        body_speedup = f"{(baseline - overhead) / body:.1f}x" if body > 0 else '-'
+        print(f"{name:<34}{per_sample * 1e6:>10.2f}{1.0 / per_sample:>12.0f}{baseline / per_sample:>8.1f}x"
+              f"{body * 1e6:>9.2f}{body_speedup:>14}")
+    assert decoder.buffer.latest()['w'] == 1.0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Callback cost of parse_value against FastDecoder")
+    parser.add_argument('--samples', type=int, default=200000)
+    _benchmark(parser.parse_args().samples)
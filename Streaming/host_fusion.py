@@ -0,0 +1,261 @@
+# Sensor fusion on the host from the raw acc/gyro/mag of the boards, in place of the onboard NDOF
+# The orientation of N sensors is one (N, 4) array of quaternions [w x y z] and every sample time is one
+# vectorized step over the N sensors (Madgwick gradient descent or Mahony complementary filter, after the
+# reference implementations of x-io Technologies). A batch of T samples per sensor, e.g. the rows joined
+# by StreamJoiner in one read, is a (T, N, 3) array per sensor and takes T steps, whatever N is. The
+# quaternion algebra (product, normalization, matrix conversion) is the one of quaternions.py.
+# Rows of a sensor that has fewer samples than the others in a batch are padding (valid False): their
+# dt is 0 and the step leaves the orientation as it is.
+#
+# Units as the boards give them: acc in g, gyro in deg/s, mag in uT (only the directions of acc and mag
+# are used). dt comes from the board epochs of every sensor, a gap longer than MAX_DT is integrated as
+# MAX_DT. The first sample of a sensor sets its orientation from gravity and magnetic north (or gravity
+# and the x axis of the board if there is no magnetometer sample) instead of converging from identity.
+# Earth frame: x magnetic north, z up. Without magnetometer (all zeros or NaN) the filters run on acc/gyro.
+#
+# Offline reprocessing of a capture of stream_data_and_save.py (.csv or .mmrec) to quaternions, written
+# like a live session (session_export: .xlsx, .csv, folder of .npy columns, or a Recorder .mmrec):
+#   python host_fusion.py sensor_data.csv [--filter madgwick] [--beta 0.1] [--kp 1.0] [--ki 0.0]
+#                         [--output fused.xlsx] [--rate 25]
+#   python host_fusion.py --benchmark [--sensors 10] [--samples 10000]      steps/s and samples/s
+import argparse
+import time
+import numpy as np
+from recorder import Recorder, Recording
+from ring_buffer import SampleRingBuffer, QUATERNION_CHANNELS
+from quaternions import from_matrix, multiply, normalize
+from session_export import export_session, session_sheets
+
+MAX_DT = 0.1  # s, longest interval integrated in one step
+IMU_COLUMNS = {'gyro': ('gyro_x', 'gyro_y', 'gyro_z'), 'acc': ('accel_x', 'accel_y', 'accel_z'),
+               'mag': ('mag_x', 'mag_y', 'mag_z')}  # Columns of stream_data_and_save.py
+
+def _norm(v):
+    # Unit vectors along the last axis and a mask of the ones that had a direction (zero without one)
+    n = np.linalg.norm(v, axis=-1, keepdims=True)
+    ok = (n[..., 0] > 0) & np.isfinite(n[..., 0])
+    return np.where(ok[..., None], v / np.where(ok[..., None], n, 1.0), 0.0), ok
+
+def initial_orientation(acc, mag):
+    # Orientation of N sensors at rest: z up from gravity, x towards the horizontal part of the field
+    up, has_acc = _norm(np.nan_to_num(acc))
+    up[~has_acc] = (0.0, 0.0, 1.0)
+    m, has_mag = _norm(np.nan_to_num(mag))
+    reference = np.where(has_mag[:, None], m, (1.0, 0.0, 0.0))
+    north, ok = _norm(reference - np.sum(reference * up, axis=1, keepdims=True) * up)
+    north[~ok], _ = _norm(np.cross(up[~ok], (0.0, 1.0, 0.0)))  # Field (or x axis) along gravity
+    west = np.cross(up, north)
+    return from_matrix(np.stack([north, west, up], axis=1))
+
+class HostFusion:
+    def __init__(self, sensors):
+        self.sensors = sensors
+        self.q = np.tile([1.0, 0.0, 0.0, 0.0], (sensors, 1))
+        self.last_epoch = np.zeros(sensors, dtype=np.int64)
+        self.started = np.zeros(sensors, dtype=bool)
+        self.steps = 0
+
+    def step(self, acc, gyro, mag, dt):
+        # One sample of every sensor: acc, gyro, mag (N, 3), dt (N,) in s; returns the (N, 4) orientation
+        a, has_acc = _norm(np.nan_to_num(acc))
+        m, has_mag = _norm(np.nan_to_num(mag))
+        omega = np.radians(np.nan_to_num(gyro))
+        qdot = self._rate(a, has_acc, m, has_mag & has_acc, omega, dt)
+        self.q = normalize(self.q + qdot * dt[:, None])
+        self.steps += 1
+        return self.q
+
+    def update(self, epochs, acc, gyro, mag, valid=None):
+        # T samples of every sensor: epochs (T, N) in ms, acc, gyro, mag (T, N, 3); valid (T, N) marks the
+        # padding of the sensors with fewer samples. Returns the (T, N, 4) orientation after each sample.
+        epochs = np.asarray(epochs, dtype=np.int64)
+        valid = np.ones(epochs.shape, dtype=bool) if valid is None else valid
+        out = np.empty(epochs.shape + (4,))
+        for t in range(len(epochs)):
+            first = valid[t] & ~self.started
+            if first.any():
+                self.q[first] = initial_orientation(acc[t][first], mag[t][first])
+                self.last_epoch[first] = epochs[t][first]
+                self.started |= first
+            dt = np.where(valid[t], np.clip((epochs[t] - self.last_epoch) / 1000.0, 0.0, MAX_DT), 0.0)
+            self.last_epoch = np.where(valid[t], epochs[t], self.last_epoch)
+            out[t] = self.step(acc[t], gyro[t], mag[t], dt)
+        return out
+
+class Madgwick(HostFusion):
+    def __init__(self, sensors, beta=0.1):
+        super().__init__(sensors)
+        self.beta = beta
+
+    def _rate(self, a, has_acc, m, has_mag, omega, dt):
+        q0, q1, q2, q3 = self.q.T
+        ax, ay, az = a.T
+        mx, my, mz = m.T
+        qdot = 0.5 * multiply(self.q, np.c_[np.zeros(len(omega)), omega])
+        q0q0, q0q1, q0q2, q0q3 = q0 * q0, q0 * q1, q0 * q2, q0 * q3
+        q1q1, q1q2, q1q3, q2q2, q2q3, q3q3 = q1 * q1, q1 * q2, q1 * q3, q2 * q2, q2 * q3, q3 * q3
+
+        # Objective: gravity and the earth field (bx, 0, bz) seen from the sensor minus the measurements
+        hx = (mx * q0q0 - 2 * q0 * my * q3 + 2 * q0 * mz * q2 + mx * q1q1 + 2 * q1 * my * q2 + 2 * q1 * mz * q3
+              - mx * q2q2 - mx * q3q3)
+        hy = (2 * q0 * mx * q3 + my * q0q0 - 2 * q0 * mz * q1 + 2 * q1 * mx * q2 - my * q1q1 + my * q2q2
+              + 2 * q2 * mz * q3 - my * q3q3)
+        bx = np.sqrt(hx * hx + hy * hy)
+        bz = 2 * (-q0 * mx * q2 + q0 * my * q1 + 0.5 * mz * q0q0 + q1 * mx * q3 - 0.5 * mz * q1q1
+                  + q2 * my * q3 - 0.5 * mz * q2q2 + 0.5 * mz * q3q3)
+        fx = 2 * (q1q3 - q0q2) - ax
+        fy = 2 * (q0q1 + q2q3) - ay
+        fz = 2 * (0.5 - q1q1 - q2q2) - az
+        hx = bx * (0.5 - q2q2 - q3q3) + bz * (q1q3 - q0q2) - mx
+        hy = bx * (q1q2 - q0q3) + bz * (q0q1 + q2q3) - my
+        hz = bx * (q0q2 + q1q3) + bz * (0.5 - q1q1 - q2q2) - mz
+        marg = np.stack([-2 * q2 * fx + 2 * q1 * fy - bz * q2 * hx + (-bx * q3 + bz * q1) * hy + bx * q2 * hz,
+                         2 * q3 * fx + 2 * q0 * fy - 4 * q1 * fz + bz * q3 * hx + (bx * q2 + bz * q0) * hy
+                         + (bx * q3 - 2 * bz * q1) * hz,
+                         -2 * q0 * fx + 2 * q3 * fy - 4 * q2 * fz + (-2 * bx * q2 - bz * q0) * hx
+                         + (bx * q1 + bz * q3) * hy + (bx * q0 - 2 * bz * q2) * hz,
+                         2 * q1 * fx + 2 * q2 * fy + (-2 * bx * q3 + bz * q1) * hx + (-bx * q0 + bz * q2) * hy
+                         + bx * q1 * hz], axis=-1)
+        imu = np.stack([-2 * q2 * fx + 2 * q1 * fy,
+                        2 * q3 * fx + 2 * q0 * fy - 4 * q1 * fz,
+                        -2 * q0 * fx + 2 * q3 * fy - 4 * q2 * fz,
+                        2 * q1 * fx + 2 * q2 * fy], axis=-1)
+        gradient, _ = _norm(np.where(has_mag[:, None], marg, imu))
+        return qdot - self.beta * gradient * has_acc[:, None]
+
+class Mahony(HostFusion):
+    def __init__(self, sensors, kp=1.0, ki=0.0):
+        super().__init__(sensors)
+        self.kp = kp
+        self.ki = ki
+        self.integral = np.zeros((sensors, 3))  # Integral feedback, the gyro bias estimate
+
+    def _rate(self, a, has_acc, m, has_mag, omega, dt):
+        q0, q1, q2, q3 = self.q.T
+        q0q0, q0q1, q0q2, q0q3 = q0 * q0, q0 * q1, q0 * q2, q0 * q3
+        q1q1, q1q2, q1q3, q2q2, q2q3, q3q3 = q1 * q1, q1 * q2, q1 * q3, q2 * q2, q2 * q3, q3 * q3
+        mx, my, mz = m.T
+
+        # Field in the earth frame, its horizontal part all along x, and back to the sensor frame
+        hx = 2 * (mx * (0.5 - q2q2 - q3q3) + my * (q1q2 - q0q3) + mz * (q1q3 + q0q2))
+        hy = 2 * (mx * (q1q2 + q0q3) + my * (0.5 - q1q1 - q3q3) + mz * (q2q3 - q0q1))
+        bx = np.sqrt(hx * hx + hy * hy)
+        bz = 2 * (mx * (q1q3 - q0q2) + my * (q2q3 + q0q1) + mz * (0.5 - q1q1 - q2q2))
+        gravity = np.stack([q1q3 - q0q2, q0q1 + q2q3, q0q0 - 0.5 + q3q3], axis=-1)
+        field = np.stack([bx * (0.5 - q2q2 - q3q3) + bz * (q1q3 - q0q2),
+                          bx * (q1q2 - q0q3) + bz * (q0q1 + q2q3),
+                          bx * (q0q2 + q1q3) + bz * (0.5 - q1q1 - q2q2)], axis=-1)
+        error = (np.cross(a, gravity) + np.cross(m, field) * has_mag[:, None]) * has_acc[:, None]
+
+        if self.ki > 0:
+            self.integral += self.ki * error * dt[:, None]
+        omega = omega + self.integral + self.kp * error
+        return 0.5 * multiply(self.q, np.c_[np.zeros(len(omega)), omega])
+
+FILTERS = {'madgwick': Madgwick, 'mahony': Mahony}
+
+def stack(batches, width):
+    # [(epochs, rows)] of N sensors -> epochs (T, N), rows (T, N, width), valid (T, N); T the longest batch
+    length = max((len(epochs) for epochs, _ in batches), default=0)
+    epochs = np.zeros((length, len(batches)), dtype=np.int64)
+    rows = np.zeros((length, len(batches), width))
+    valid = np.zeros((length, len(batches)), dtype=bool)
+    for k, (e, r) in enumerate(batches):
+        epochs[:len(e), k] = e
+        rows[:len(e), k] = r
+        valid[:len(e), k] = True
+    return epochs, rows, valid
+
+def fuse_batches(fusion, batches, columns):
+    # Joined rows of every sensor ([(epochs, rows)], channels in `columns`) -> [(epochs, (T, 4) quaternions)]
+    epochs, rows, valid = stack(batches, len(columns))
+    pick = {name: [columns.index(column) for column in IMU_COLUMNS[name]] for name in IMU_COLUMNS}
+    q = fusion.update(epochs, rows[..., pick['acc']], rows[..., pick['gyro']], rows[..., pick['mag']], valid)
+    return [(e, q[:len(e), k]) for k, (e, _) in enumerate(batches)]
+
+def load_capture(path):
+    # {sensor: (epochs, rows)} of a capture of stream_data_and_save.py and the columns of the rows
+    if path.endswith('.mmrec'):
+        recording = Recording(path)
+        columns = list(recording.channels)
+        records = {mac: recording.sensor(index) for index, mac in enumerate(recording.sensors)}
+    else:
+        table = np.genfromtxt(path, delimiter=',', names=True)
+        columns = [name for name in table.dtype.names if name not in ('sample_count', 'sensor_index', 'epoch')]
+        records = {f"sensor_{int(index)}": table[table['sensor_index'] == index]
+                   for index in np.unique(table['sensor_index'])}
+    return {sensor: (r['epoch'].astype(np.int64), np.stack([r[c] for c in columns], axis=-1).astype(np.float64))
+            for sensor, r in records.items() if len(r)}, columns
+
+def fuse_capture(path, fusion_class, **gains):
+    captures, columns = load_capture(path)
+    fusion = fusion_class(len(captures), **gains)
+    start = time.perf_counter()
+    fused = fuse_batches(fusion, list(captures.values()), columns)
+    seconds = time.perf_counter() - start
+    buffers = {}
+    for sensor, (epochs, q) in zip(captures, fused):
+        records = np.empty(len(epochs), dtype=[('epoch', np.int64)] + [(c, np.float32) for c in QUATERNION_CHANNELS])
+        records['epoch'] = epochs
+        for i, channel in enumerate(QUATERNION_CHANNELS):
+            records[channel] = q[:, i]
+        buffers[sensor] = SampleRingBuffer(QUATERNION_CHANNELS, len(records))
+        buffers[sensor].extend(records)
+    return buffers, fusion.steps, seconds
+
+def write_session(path, buffers, rate, tolerance_ms):
+    if path.endswith('.mmrec'):
+        with Recorder(path, list(buffers), QUATERNION_CHANNELS, metadata={'script': 'host_fusion'}) as recorder:
+            for sensor, buffer in enumerate(buffers.values()):
+                recorder.extend(sensor, buffer.window())
+        return [path]
+    sheets, _ = session_sheets(buffers, rate, tolerance_ms)  # The buffers hold the whole capture, nothing dropped
+    return export_session(path, sheets)
+
+def benchmark(fusion_class, sensors, samples):
+    rng = np.random.default_rng(0)
+    epochs = np.repeat(np.arange(samples)[:, None] * 10, sensors, axis=1)
+    acc = rng.normal((0.0, 0.0, 1.0), 0.05, (samples, sensors, 3))
+    gyro = rng.normal(0.0, 5.0, (samples, sensors, 3))
+    mag = rng.normal((20.0, 0.0, -40.0), 1.0, (samples, sensors, 3))
+    fusion = fusion_class(sensors)
+    start = time.perf_counter()
+    fusion.update(epochs, acc, gyro, mag)
+    seconds = time.perf_counter() - start
+    print(f"{fusion_class.__name__}, {sensors} sensors: {samples / seconds:,.0f} steps/s, "
+          f"{samples * sensors / seconds:,.0f} samples/s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Host side sensor fusion of raw acc/gyro/mag captures")
+    parser.add_argument('path', nargs='?', help="Capture of stream_data_and_save.py (.csv or .mmrec)")
+    parser.add_argument('--filter', default='madgwick', choices=sorted(FILTERS))
+    parser.add_argument('--beta', type=float, default=0.1, help="Madgwick gain")
+    parser.add_argument('--kp', type=float, default=1.0, help="Mahony proportional gain")
+    parser.add_argument('--ki', type=float, default=0.0, help="Mahony integral gain")
+    parser.add_argument('--output', default='fused.xlsx', help=".xlsx, .csv, .mmrec or a folder (.npy columns)")
+    parser.add_argument('--rate', type=float, default=None, help="Hz of the exported sheets (default: the capture rate)")
+    parser.add_argument('--benchmark', action='store_true')
+    parser.add_argument('--sensors', type=int, default=10)
+    parser.add_argument('--samples', type=int, default=10000)
+    args = parser.parse_args()
+
+    fusion_class = FILTERS[args.filter]
+    if args.benchmark:
+        for sensors in sorted({1, args.sensors}):
+            benchmark(fusion_class, sensors, args.samples)
+        return
+    if not args.path:
+        parser.error("a capture or --benchmark is required")
+    gains = {'beta': args.beta} if fusion_class is Madgwick else {'kp': args.kp, 'ki': args.ki}
+    buffers, steps, seconds = fuse_capture(args.path, fusion_class, **gains)
+    if not buffers:
+        raise SystemExit(f"{args.path}: no samples")
+    samples = sum(len(buffer) for buffer in buffers.values())
+    print(f"{fusion_class.__name__}: {len(buffers)} sensors, {samples} samples in {steps} steps, {seconds:.2f} s "
+          f"({samples / max(seconds, 1e-9):,.0f} samples/s)")
+    rate = args.rate or 1000.0 / np.median(np.concatenate([np.diff(b.window()['epoch']) for b in buffers.values()]))
+    written = write_session(args.output, buffers, rate, 1000.0 / rate / 2)
+    print(f"Datos guardados en {', '.join(written)}")
+
+if __name__ == '__main__':
+    main()
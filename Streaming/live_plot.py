@@ -0,0 +1,145 @@
+# Plot data path of the GUIs
+# Every frame the curves are redrawn from a view of the last `window` samples of the ring buffer, so every
+# sample that arrived since the previous frame is drawn (not only the latest one) and the cost of a frame
+# only depends on the window: memory and CPU stay flat however long the session runs.
+#
+# When the window has more samples than the plot has pixel columns, each column is drawn with the min and
+# the max of its samples (peak decimation): the curve looks the same and short peaks are not lost.
+#
+# RenderScheduler paces the redraws of a dashboard: frames are capped at `fps`, a frame with no new
+# samples draws nothing, and label texts are applied at most `label_rate` times per second and only when
+# they changed. FrameTimer measures the frames and prints a report every few seconds.
+import time
+import numpy as np
+from PyQt5.QtCore import Qt, QTimer
+
+PLOT_WINDOW = 500  # Samples drawn per curve, 5 seconds at 100 Hz
+MAX_FPS = 30
+LABEL_RATE = 4  # Label updates per second, faster than that the numbers can not be read anyway
+
+def peak_decimate(x, y, pixels):
+    # Min and max of every group of samples that falls in one pixel column, the newest samples are kept
+    step = len(y) // pixels if pixels > 0 else 0
+    if step < 2:
+        return x, y
+    start = len(y) % step
+    groups = y[start:].reshape(-1, step)
+    peaks = np.empty(2 * len(groups), dtype=y.dtype)
+    peaks[0::2] = groups.min(axis=1)
+    peaks[1::2] = groups.max(axis=1)
+    return np.repeat(x[start::step], 2), peaks
+
+class LivePlot:
+    def __init__(self, buffer, curves, window=PLOT_WINDOW):
+        # curves: {channel: PlotDataItem}
+        self.buffer = buffer
+        self.curves = curves
+        self.window = window
+        self.x = np.arange(window, dtype=np.float64)  # Shared x axis, no new array per frame
+        self.cursor = 0  # `count` of the buffer at the last frame drawn
+
+    def update(self):
+        # Redraws the curves if new samples arrived, returns the number of new samples
+        end = self.buffer.count
+        new = end - self.cursor
+        if new == 0:
+            return 0
+        self.cursor = end
+        records = self.buffer.window(self.window, end)
+        x = self.x[:len(records)]
+        pixels = self._pixels()
+        for channel, curve in self.curves.items():
+            curve.setData(*peak_decimate(x, records[channel], pixels))
+        return new
+
+    def _pixels(self):
+        # Width in pixels of the plot the curves are drawn in (0 before the widget is shown)
+        view = next(iter(self.curves.values())).getViewBox()
+        return int(view.width()) if view is not None else 0
+
+    def latest(self):
+        # Last sample drawn, for the labels
+        return self.buffer.window(1, self.cursor)[0] if self.cursor else None
+
+    def reset(self):
+        self.cursor = 0
+        for curve in self.curves.values():
+            curve.setData([], [])
+
+class RenderScheduler:
+    def __init__(self, frame, fps=MAX_FPS, label_rate=LABEL_RATE, name='Plots'):
+        # frame: callable that updates the plots and returns the number of new samples drawn
+        self.frame = frame
+        self.interval = int(1000 / fps)
+        self.label_period = 1.0 / label_rate
+        self.labels = {}  # QLabel: text pending
+        self.shown = {}   # QLabel: text on screen
+        self.last_labels = 0.0
+        self.skipped = 0  # Frames without new samples
+        self.frame_timer = FrameTimer(name)
+        self.timer = QTimer()
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(self.render)
+
+    def start(self):
+        self.timer.start(self.interval)
+
+    def stop(self):
+        self.timer.stop()
+        self.flush_labels()
+
+    def set_text(self, label, text):
+        # Coalesced QLabel.setText, only the last text of the label period is applied
+        self.labels[label] = text
+
+    def flush_labels(self):
+        for label, text in self.labels.items():
+            if self.shown.get(label) != text:
+                label.setText(text)
+                self.shown[label] = text
+        self.labels.clear()
+        self.last_labels = time.perf_counter()
+
+    def render(self):
+        self.frame_timer.start()
+        drawn = self.frame()
+        if time.perf_counter() - self.last_labels >= self.label_period:
+            self.flush_labels()
+        if drawn:
+            self.frame_timer.stop(drawn)
+        else:
+            self.skipped += 1
+
+class FrameTimer:
+    def __init__(self, name, period=5.0):
+        self.name = name
+        self.period = period  # Seconds between reports
+        self.report = ''      # Last report, for a status label
+        self._reset(time.perf_counter())
+
+    def _reset(self, now):
+        self.frames = 0
+        self.samples = 0
+        self.total = 0.0
+        self.worst = 0.0
+        self.since = now
+
+    def start(self):
+        self._start = time.perf_counter()
+        if self.frames == 0:
+            self.since = self._start  # The report covers the time the plots were running only
+
+    def stop(self, samples=0):
+        now = time.perf_counter()
+        elapsed = now - self._start
+        self.frames += 1
+        self.samples += samples
+        self.total += elapsed
+        self.worst = max(self.worst, elapsed)
+        if now - self.since >= self.period:
+            span = now - self.since
+            self.report = (f"{self.name}: {self.frames / span:.1f} frames/s, frame time mean "
+                           f"{self.total / self.frames * 1000:.2f} ms max {self.worst * 1000:.2f} ms, "
+                           f"{self.samples / span:.0f} samples/s drawn")
+            print(self.report)
+            self._reset(now)
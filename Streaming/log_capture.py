@@ -0,0 +1,256 @@
+# Capture on the flash of the boards (MetaWear logger) instead of the live BLE stream
+# The streams of the profile (sensor_profiles.py) are logged on every board and downloaded in bulk after
+# the session, or every `every` seconds during it. The link only carries the download, so the number of
+# boards and their rate are not limited by the live bandwidth of the adapter: with `detach` every board is
+# disconnected as soon as it logs and only connected again to download (at most MAX_LINKS at a time).
+#
+# The downloaded samples keep the epochs the board gave them when it sampled them. They go through the
+# same FastDecoder and SampleRingBuffer path as the live callbacks, so the session ends up in the format
+# of a live one: one buffer per board (the IMU streams of a board joined on the epoch by StreamJoiner) that
+# is written with session_export (xlsx, csv, .npy columns, one sheet per board) or as a Recorder .mmrec.
+# A periodic download is merged after the previous ones, samples the board sent again are left out.
+# Every download is timed: log entries, samples, entries/s and kB/s per board and for the whole session.
+#
+#   python log_capture.py MAC1 MAC2 ... [--profile fusion_quaternion] [--seconds 60] [--every 0] [--detach]
+#                         [--output sensor_data.xlsx] [--rate 10]
+# Without boards: python metawear_sim.py [--download-rate 1000] log_capture.py A1:00:00:00:00:01 ...
+import argparse
+import sys
+import threading
+import time
+from mbientlab.metawear import libmetawear, create_voidp
+from mbientlab.metawear.cbindings import *
+from device_registry import DeviceRegistry
+from fast_decoder import FastDecoder
+from recorder import Recorder
+from ring_buffer import SampleRingBuffer, QUATERNION_CHANNELS, EULER_CHANNELS, CARTESIAN_CHANNELS
+from sensor_profiles import PROFILES, MAX_LINKS, SensorProfile
+from session_bringup import bring_up, report
+from session_export import export_session, session_sheets
+from stream_joiner import StreamJoiner
+
+ENTRY_BYTES = 4  # Data bytes of one log entry
+STREAM_DATA = {'quaternion': (DataTypeId.QUATERNION, QUATERNION_CHANNELS),
+               'euler_angle': (DataTypeId.EULER_ANGLE, EULER_CHANNELS),
+               'acc': (DataTypeId.CARTESIAN_FLOAT, CARTESIAN_CHANNELS),
+               'gyro': (DataTypeId.CARTESIAN_FLOAT, CARTESIAN_CHANNELS),
+               'mag': (DataTypeId.CARTESIAN_FLOAT, CARTESIAN_CHANNELS)}
+DOWNLOAD_TIMEOUT = 600.0  # s without progress before a download is given up
+SETTLE_S = 1.5            # s after the connection parameters, as in the live scripts
+
+def logging_profile(profile):
+    # The packed signals are a streaming format, the logger records the plain ones
+    return SensorProfile(profile.name, profile.fusion, profile.acc, profile.gyro, profile.mag, (),
+                         profile.connection, profile.imu)
+
+class Download:
+    # Timing of one download of one board
+    def __init__(self, address):
+        self.address = address
+        self.entries = 0
+        self.samples = 0
+        self.merged = 0
+        self.seconds = 0.0
+
+    def __str__(self):
+        rate = self.entries / self.seconds if self.seconds else 0.0
+        return (f"{self.address}: {self.entries} entries, {self.samples} samples ({self.merged} new) in "
+                f"{self.seconds:.2f} s, {rate:.0f} entries/s, {rate * ENTRY_BYTES / 1000:.1f} kB/s")
+
+class BoardLog:
+    def __init__(self, device, profile, capacity):
+        self.device = device
+        self.profile = logging_profile(profile)
+        self.streams = [stream for stream, _, _ in self.profile.streams()]
+        # Session buffers (what a live capture would have) and staging buffers the download writes into
+        self.buffers = {stream: SampleRingBuffer(STREAM_DATA[stream][1], capacity) for stream in self.streams}
+        self.staging = {stream: SampleRingBuffer(STREAM_DATA[stream][1], capacity) for stream in self.streams}
+        self.decoders = {stream: FastDecoder(self.staging[stream], STREAM_DATA[stream][0]) for stream in self.streams}
+        self.callbacks = {stream: FnVoid_VoidP_DataP(lambda ctx, data, stream=stream: self.decoders[stream].decode(data))
+                          for stream in self.streams}
+        self.loggers = {}
+        self.downloads = []
+        self.attached = True
+
+    def arm(self):
+        # Sensors configured and one logger per stream, the downloaded samples go to the decoders
+        self.profile.connection.apply(self.device)
+        time.sleep(SETTLE_S)
+        self.profile.configure(self.device)
+        for stream in self.streams:
+            signal = self.profile.signal(self.device, stream)
+            self.loggers[stream] = create_voidp(lambda fn: libmetawear.mbl_mw_datasignal_log(signal, None, fn),
+                                                resource=f"{stream} logger")
+            libmetawear.mbl_mw_logger_subscribe(self.loggers[stream], None, self.callbacks[stream])
+
+    def start(self):
+        libmetawear.mbl_mw_logging_start(self.device.board, 0)
+        self.profile.start(self.device)
+
+    def stop(self):
+        self.profile.stop(self.device)
+        libmetawear.mbl_mw_logging_stop(self.device.board)
+        libmetawear.mbl_mw_logging_flush_page(self.device.board)
+
+    def detach(self, registry):
+        libmetawear.mbl_mw_debug_disconnect(self.device.board)
+        self.attached = False
+
+    def attach(self, registry):
+        if not self.attached:
+            registry.reattach(self.device)
+            self.profile.connection.apply(self.device)
+            self.attached = True
+
+    def download(self):
+        # Downloads the log and merges it into the session buffers, returns the Download
+        stats = Download(self.device.address)
+        done = threading.Event()
+        progress = {'time': time.perf_counter()}
+
+        def progress_update(ctx, entries_left, total_entries):
+            stats.entries = total_entries
+            progress['time'] = time.perf_counter()
+            if entries_left == 0:
+                done.set()
+
+        handler = LogDownloadHandler(context=None, received_progress_update=FnVoid_VoidP_UInt_UInt(progress_update),
+                                     received_unknown_entry=cast(None, FnVoid_VoidP_UByte_Long_UByteP_UByte),
+                                     received_unhandled_entry=cast(None, FnVoid_VoidP_DataP))
+        for staging in self.staging.values():
+            staging.clear()
+        start = time.perf_counter()
+        libmetawear.mbl_mw_logging_download(self.device.board, 100, byref(handler))
+        while not done.wait(1.0):
+            if time.perf_counter() - progress['time'] > DOWNLOAD_TIMEOUT:
+                raise TimeoutError(f"{self.device.address}: no download progress in {DOWNLOAD_TIMEOUT:.0f} s")
+        stats.seconds = time.perf_counter() - start
+        for stream in self.streams:
+            new = self.staging[stream].window()
+            stats.samples += len(new)
+            latest = self.buffers[stream].latest()
+            if latest is not None:
+                new = new[new['epoch'] > latest['epoch']]  # Entries downloaded before
+            self.buffers[stream].extend(new)
+            stats.merged += len(new)
+        self.downloads.append(stats)
+        return stats
+
+    def remove(self):
+        for logger in self.loggers.values():
+            libmetawear.mbl_mw_logger_remove(logger)
+        libmetawear.mbl_mw_logging_clear_entries(self.device.board)
+        self.loggers = {}
+
+    def session(self):
+        # The buffer of the board in the session format: the stream itself, or the IMU streams joined
+        if len(self.streams) == 1:
+            return self.buffers[self.streams[0]]
+        names = {'acc': 'accel'}
+        joiner = StreamJoiner({names.get(stream, stream): self.buffers[stream] for stream in self.streams},
+                              capacity=max(len(buffer) for buffer in self.buffers.values()) or 1)
+        joiner.flush()
+        print(f"{self.device.address}: {joiner.report()}")
+        return joiner.output
+
+def download_all(logs, registry, final=False):
+    # Downloads every board, at most MAX_LINKS connected at a time; returns (Downloads, wall time)
+    # The final download stops the logging first and leaves the boards disconnected with their log cleared
+    start = time.perf_counter()
+    results = []
+    for first in range(0, len(logs), MAX_LINKS):
+        wave = logs[first:first + MAX_LINKS]
+        threads = []
+        for log in wave:
+            def run(log=log):
+                detached = not log.attached
+                try:
+                    log.attach(registry)
+                    if final:
+                        log.stop()
+                    results.append(log.download())
+                    if final:
+                        log.remove()
+                        log.detach(registry)
+                    elif detached:
+                        log.detach(registry)
+                except Exception as e:
+                    print(f"{log.device.address}: download failed: {e}")
+            threads.append(threading.Thread(target=run, name=f"download-{log.device.address}", daemon=True))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return results, time.perf_counter() - start
+
+def download_report(results, seconds):
+    lines = [str(stats) for stats in results]
+    entries = sum(stats.entries for stats in results)
+    samples = sum(stats.samples for stats in results)
+    if seconds:
+        lines.append(f"{len(results)} boards: {entries} entries, {samples} samples in {seconds:.2f} s, "
+                     f"{entries / seconds:.0f} entries/s, {entries * ENTRY_BYTES / 1000 / seconds:.1f} kB/s, "
+                     f"{samples / seconds:.0f} samples/s")
+    return '\n'.join(lines)
+
+def write_session(path, logs, rate, tolerance_ms):
+    buffers = {log.device.address: log.session() for log in logs}
+    if path.endswith('.mmrec'):
+        channels = next(iter(buffers.values())).channels
+        with Recorder(path, list(buffers), channels, metadata={'script': 'log_capture'}) as recorder:
+            for sensor, buffer in enumerate(buffers.values()):
+                recorder.extend(sensor, buffer.window())
+        return [path]
+    sheets, dropped = session_sheets(buffers, rate, tolerance_ms)
+    for mac, count in dropped.items():
+        print(f"{mac}: the {count} oldest samples did not fit in the buffer, {path} starts after them")
+    return export_session(path, sheets)
+
+def main():
+    parser = argparse.ArgumentParser(description="Capture on the flash of the boards and download it in bulk")
+    parser.add_argument('addresses', nargs='+', metavar='MAC')
+    parser.add_argument('--profile', default='fusion_quaternion', choices=sorted(PROFILES))
+    parser.add_argument('--seconds', type=float, default=60.0, help="length of the capture")
+    parser.add_argument('--every', type=float, default=0.0, help="download every N s during the capture (0: at the end)")
+    parser.add_argument('--detach', action='store_true', help="disconnect the boards while they log")
+    parser.add_argument('--output', default='sensor_data.xlsx', help=".xlsx, .csv, .mmrec or a folder (.npy columns)")
+    parser.add_argument('--rate', type=float, default=None, help="Hz of the exported sheets (default: the rate of the profile)")
+    args = parser.parse_args()
+
+    profile = PROFILES[args.profile]
+    if len(args.addresses) > MAX_LINKS and not args.detach:
+        sys.exit(f"{len(args.addresses)} boards need --detach, an adapter keeps at most {MAX_LINKS} connections")
+    rate = args.rate or profile.rate()
+    capacity = int(args.seconds * max(hz for _, hz, _ in profile.streams()) * 1.2) + 1000
+    registry = DeviceRegistry()
+
+    def setup(index, device):
+        log = BoardLog(device, profile, capacity)
+        log.arm()
+        log.start()
+        if args.detach:
+            log.detach(registry)
+        return log
+
+    results, seconds = bring_up(args.addresses, setup, registry=registry)
+    print(report(results, seconds))
+    logs = [result.value for result in results if result.ok]
+    if not logs:
+        sys.exit("No sensor connected")
+
+    print(f"Logging {profile} on {len(logs)} boards for {args.seconds:.0f} s")
+    end = time.perf_counter() + args.seconds
+    while time.perf_counter() < end:
+        time.sleep(min(args.every or args.seconds, max(0.0, end - time.perf_counter())))
+        if args.every and time.perf_counter() < end:
+            print(download_report(*download_all(logs, registry)))
+
+    print(download_report(*download_all(logs, registry, final=True)))
+
+    written = write_session(args.output, logs, rate, 1000.0 / rate / 2)
+    print(f"Datos guardados en {', '.join(written)}")
+    for log in logs:
+        print(f"{log.device.address}: " + ', '.join(f"{stream} {len(buffer)} samples" for stream, buffer in log.buffers.items()))
+
+if __name__ == '__main__':
+    main()
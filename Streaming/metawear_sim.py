@@ -0,0 +1,964 @@
+# Hardware-free stand-in for the MbientLab MetaWear SDK (mbientlab.metawear / libmetawear)
+# It implements the subset of the API used by the scripts of this repository:
+#   MetaWear(mac).connect(), the mbl_mw_sensor_fusion_* functions, the acc/gyro/mag (packed) signals,
+#   mbl_mw_datasignal_subscribe with FnVoid_VoidP_DataP callbacks and parse_value, and the logger
+#   (mbl_mw_datasignal_log, mbl_mw_logging_*, mbl_mw_logger_* and create_voidp)
+# Every virtual board emits synthetic (or recorded) quaternion, euler angle and IMU samples at the
+# configured ODR from its own thread, the same way libmetawear calls the callbacks from the BLE thread.
+#
+# Usage (run any script of the repository without boards in range):
+#   python ../Streaming/metawear_sim.py [--fusion-odr 100] [--imu-odr 800] [--replay MAC=file.xlsx] script.py [args]
+# Faults are injected with --fault [MAC=]KIND@T+D, T and D in seconds after the board first connects (every
+# board without a MAC): 'stall' stops the samples of the board for D seconds with the link up (they are
+# lost, the epochs jump), 'disconnect' drops the link (on_disconnect is called, the streams stop and
+# connect() fails until D seconds passed), e.g. --fault disconnect@5+2 --fault F1:1E:E2:6F:1D:E1=stall@3+1
+# A board keeps logging while its link is down; mbl_mw_logging_download replays the logged samples (with
+# their own epochs) to the logger subscribers at --download-rate log entries per second, 4 entries per
+# quaternion or euler angle and 2 per acc/gyro/mag sample like the flash of the board, and removes them.
+# or from python, before importing mbientlab:
+#   import metawear_sim; metawear_sim.install(fusion_odr=200)
+from ctypes import *
+import argparse
+import json
+import math
+import os
+import random
+import runpy
+import sys
+import threading
+import time
+import types
+
+# ---------------------------------------------------------------------------------------------------------
+# cbindings: same names and values as mbientlab.metawear.cbindings
+# ---------------------------------------------------------------------------------------------------------
+class DataTypeId:
+    UINT32 = 0
+    FLOAT = 1
+    CARTESIAN_FLOAT = 2
+    INT32 = 3
+    BYTE_ARRAY = 4
+    BATTERY_STATE = 5
+    TCS34725_ADC = 6
+    EULER_ANGLE = 7
+    QUATERNION = 8
+    CORRECTED_CARTESIAN_FLOAT = 9
+
+class SensorFusionMode:
+    SLEEP = 0
+    NDOF = 1
+    IMU_PLUS = 2
+    COMPASS = 3
+    M4G = 4
+
+class SensorFusionData:
+    CORRECTED_ACC = 0
+    CORRECTED_GYRO = 1
+    CORRECTED_MAG = 2
+    QUATERNION = 3
+    EULER_ANGLE = 4
+    GRAVITY_VECTOR = 5
+    LINEAR_ACC = 6
+
+class SensorFusionAccRange:
+    _2G = 0
+    _4G = 1
+    _8G = 2
+    _16G = 3
+
+class SensorFusionGyroRange:
+    _2000DPS = 0
+    _1000DPS = 1
+    _500DPS = 2
+    _250DPS = 3
+
+class AccBoschRange:
+    _2G = 0
+    _4G = 1
+    _8G = 2
+    _16G = 3
+
+class AccBmi160Odr:
+    _0_78125Hz = 0
+    _1_5625Hz = 1
+    _3_125Hz = 2
+    _6_25Hz = 3
+    _12_5Hz = 4
+    _25Hz = 5
+    _50Hz = 6
+    _100Hz = 7
+    _200Hz = 8
+    _400Hz = 9
+    _800Hz = 10
+    _1600Hz = 11
+
+class AccBmi270Odr:
+    _0_78125Hz = 0
+    _1_5625Hz = 1
+    _3_125Hz = 2
+    _6_25Hz = 3
+    _12_5Hz = 4
+    _25Hz = 5
+    _50Hz = 6
+    _100Hz = 7
+    _200Hz = 8
+    _400Hz = 9
+    _800Hz = 10
+    _1600Hz = 11
+
+class GyroBoschOdr:
+    _25Hz = 6
+    _50Hz = 7
+    _100Hz = 8
+    _200Hz = 9
+    _400Hz = 10
+    _800Hz = 11
+    _1600Hz = 12
+    _3200Hz = 13
+
+class GyroBoschRange:
+    _2000dps = 0
+    _1000dps = 1
+    _500dps = 2
+    _250dps = 3
+    _125dps = 4
+
+class MagBmm150Odr:
+    _10Hz = 0
+    _2Hz = 1
+    _6Hz = 2
+    _8Hz = 3
+    _15Hz = 4
+    _20Hz = 5
+    _25Hz = 6
+    _30Hz = 7
+
+class MagBmm150Preset:
+    LOW_POWER = 0
+    REGULAR = 1
+    ENHANCED_REGULAR = 2
+    HIGH_ACCURACY = 3
+
+class LedColor:
+    GREEN = 0
+    RED = 1
+    BLUE = 2
+
+class LedPreset:
+    BLINK = 0
+    PULSE = 1
+    SOLID = 2
+
+class Const:
+    STATUS_OK = 0
+    STATUS_ERROR_TIMEOUT = 16
+    LED_REPEAT_INDEFINITELY = 255
+
+class Data(Structure):
+    _fields_ = [
+        ("epoch", c_longlong),
+        ("extra", c_void_p),
+        ("value", c_void_p),
+        ("type_id", c_int),
+        ("length", c_ubyte)
+    ]
+
+class CartesianFloat(Structure):
+    _fields_ = [
+        ("x", c_float),
+        ("y", c_float),
+        ("z", c_float)
+    ]
+
+class Quaternion(Structure):
+    _fields_ = [
+        ("w", c_float),
+        ("x", c_float),
+        ("y", c_float),
+        ("z", c_float)
+    ]
+
+class EulerAngles(Structure):
+    _fields_ = [
+        ("heading", c_float),
+        ("pitch", c_float),
+        ("roll", c_float),
+        ("yaw", c_float)
+    ]
+
+class LedPattern(Structure):
+    _fields_ = [
+        ("high_intensity", c_ubyte),
+        ("low_intensity", c_ubyte),
+        ("rise_time_ms", c_ushort),
+        ("high_time_ms", c_ushort),
+        ("fall_time_ms", c_ushort),
+        ("pulse_duration_ms", c_ushort),
+        ("delay_time_ms", c_ushort),
+        ("repeat_count", c_ubyte)
+    ]
+
+FnVoid_VoidP = CFUNCTYPE(None, c_void_p)
+FnVoid_VoidP_Int = CFUNCTYPE(None, c_void_p, c_int)
+FnVoid_VoidP_VoidP = CFUNCTYPE(None, c_void_p, c_void_p)
+FnVoid_VoidP_VoidP_Int = CFUNCTYPE(None, c_void_p, c_void_p, c_int)
+FnVoid_VoidP_DataP = CFUNCTYPE(None, c_void_p, POINTER(Data))
+FnVoid_VoidP_UInt_UInt = CFUNCTYPE(None, c_void_p, c_uint, c_uint)
+FnVoid_VoidP_UByte_Long_UByteP_UByte = CFUNCTYPE(None, c_void_p, c_ubyte, c_long, POINTER(c_ubyte), c_ubyte)
+
+class LogDownloadHandler(Structure):
+    _fields_ = [
+        ("context", c_void_p),
+        ("received_progress_update", FnVoid_VoidP_UInt_UInt),
+        ("received_unknown_entry", FnVoid_VoidP_UByte_Long_UByteP_UByte),
+        ("received_unhandled_entry", FnVoid_VoidP_DataP)
+    ]
+
+_CBINDINGS = ['DataTypeId', 'SensorFusionMode', 'SensorFusionData', 'SensorFusionAccRange', 'SensorFusionGyroRange',
+              'AccBoschRange', 'AccBmi160Odr', 'AccBmi270Odr', 'GyroBoschOdr', 'GyroBoschRange', 'MagBmm150Odr',
+              'MagBmm150Preset', 'LedColor', 'LedPreset', 'Const', 'Data', 'CartesianFloat', 'Quaternion',
+              'EulerAngles', 'LedPattern', 'FnVoid_VoidP', 'FnVoid_VoidP_Int', 'FnVoid_VoidP_VoidP',
+              'FnVoid_VoidP_VoidP_Int', 'FnVoid_VoidP_DataP', 'FnVoid_VoidP_UInt_UInt',
+              'FnVoid_VoidP_UByte_Long_UByteP_UByte', 'LogDownloadHandler']
+
+_VALUE_TYPES = {
+    DataTypeId.CARTESIAN_FLOAT: CartesianFloat,
+    DataTypeId.QUATERNION: Quaternion,
+    DataTypeId.EULER_ANGLE: EulerAngles,
+}
+
+def parse_value(pointer, **kwargs):
+    type_id = pointer.contents.type_id
+    if type_id not in _VALUE_TYPES:
+        raise RuntimeError('Unrecognized data type id: ' + str(type_id))
+    return cast(pointer.contents.value, POINTER(_VALUE_TYPES[type_id])).contents
+
+def create_voidp(fn, **kwargs):
+    # Same as mbientlab.metawear.create_voidp: waits for the pointer libmetawear passes to the callback
+    e = kwargs['event'] if 'event' in kwargs else threading.Event()
+    result = [None]
+    def handler(ctx, pointer):
+        result[0] = RuntimeError("Could not create " + kwargs.get('resource', "resource")) if pointer is None else pointer
+        e.set()
+    callback_wrapper = FnVoid_VoidP_VoidP(handler)
+    fn(callback_wrapper)
+    e.wait()
+    e.clear()
+    if isinstance(result[0], RuntimeError):
+        raise result[0]
+    return result[0]
+
+# ---------------------------------------------------------------------------------------------------------
+# Simulation settings
+# ---------------------------------------------------------------------------------------------------------
+# ODR in Hz of every enum value written by the scripts
+_ACC_ODR_HZ = {AccBmi270Odr._0_78125Hz: 0.78125, AccBmi270Odr._1_5625Hz: 1.5625, AccBmi270Odr._3_125Hz: 3.125,
+               AccBmi270Odr._6_25Hz: 6.25, AccBmi270Odr._12_5Hz: 12.5, AccBmi270Odr._25Hz: 25.0,
+               AccBmi270Odr._50Hz: 50.0, AccBmi270Odr._100Hz: 100.0, AccBmi270Odr._200Hz: 200.0,
+               AccBmi270Odr._400Hz: 400.0, AccBmi270Odr._800Hz: 800.0, AccBmi270Odr._1600Hz: 1600.0}
+_GYRO_ODR_HZ = {GyroBoschOdr._25Hz: 25.0, GyroBoschOdr._50Hz: 50.0, GyroBoschOdr._100Hz: 100.0,
+                GyroBoschOdr._200Hz: 200.0, GyroBoschOdr._400Hz: 400.0, GyroBoschOdr._800Hz: 800.0,
+                GyroBoschOdr._1600Hz: 1600.0, GyroBoschOdr._3200Hz: 3200.0}
+_MAG_ODR_HZ = {MagBmm150Odr._10Hz: 10.0, MagBmm150Odr._2Hz: 2.0, MagBmm150Odr._6Hz: 6.0, MagBmm150Odr._8Hz: 8.0,
+               MagBmm150Odr._15Hz: 15.0, MagBmm150Odr._20Hz: 20.0, MagBmm150Odr._25Hz: 25.0, MagBmm150Odr._30Hz: 30.0}
+_MAG_PRESET_HZ = {MagBmm150Preset.LOW_POWER: 10.0, MagBmm150Preset.REGULAR: 10.0,
+                  MagBmm150Preset.ENHANCED_REGULAR: 10.0, MagBmm150Preset.HIGH_ACCURACY: 20.0}
+
+config = {
+    'fusion_odr': 100.0,    # NDOF fusion runs at 100 Hz on the boards
+    'imu_odr': None,        # Overrides the acc/gyro ODR configured by the script
+    'mag_odr': None,        # Overrides the magnetometer ODR configured by the script
+    'tick': 0.005,          # Period of the emission loop of each board, samples are emitted in bursts
+    'connect_delay': 0.2,   # Simulated BLE connection time
+    'discovery_delay': 0.0, # Service discovery of a connection without a cached board state (cold)
+    'firmware': '1.7.3',    # Firmware reported by every board
+    'noise': 0.002,         # Gaussian noise added to the synthetic signals
+    'replay': {},           # MAC -> path of a recorded session (xlsx/csv)
+    'seed': 0,
+    'faults': [],           # (MAC or None for every board, kind, start s, duration s)
+    'download_rate': 1000.0,  # Log entries per second of a log download
+    'log_capacity': 1000000,  # Log entries the flash of a board holds
+}
+
+_LOG_ENTRIES = {DataTypeId.QUATERNION: 4, DataTypeId.EULER_ANGLE: 4, DataTypeId.CARTESIAN_FLOAT: 2}
+
+# ---------------------------------------------------------------------------------------------------------
+# Signal sources
+# ---------------------------------------------------------------------------------------------------------
+def _quat_to_euler(w, x, y, z):
+    # Same convention as the board: heading in [0, 360), pitch, roll and yaw in degrees
+    roll = math.degrees(math.atan2(2.0 * (w * x + y * z), 1.0 - 2.0 * (x * x + y * y)))
+    pitch = math.degrees(math.asin(max(-1.0, min(1.0, 2.0 * (w * y - z * x)))))
+    yaw = math.degrees(math.atan2(2.0 * (w * z + x * y), 1.0 - 2.0 * (y * y + z * z)))
+    return (yaw % 360.0, pitch, roll, yaw)
+
+def _euler_to_quat(heading, pitch, roll):
+    cy, sy = math.cos(math.radians(heading) / 2), math.sin(math.radians(heading) / 2)
+    cp, sp = math.cos(math.radians(pitch) / 2), math.sin(math.radians(pitch) / 2)
+    cr, sr = math.cos(math.radians(roll) / 2), math.sin(math.radians(roll) / 2)
+    return (cr * cp * cy + sr * sp * sy, sr * cp * cy - cr * sp * sy,
+            cr * sp * cy + sr * cp * sy, cr * cp * sy - sr * sp * cy)
+
+def _rotate_to_sensor(q, v):
+    # Rotate a world vector into the sensor frame (q* v q)
+    w, x, y, z = q
+    vx, vy, vz = v
+    tx = 2.0 * (y * vz - z * vy)
+    ty = 2.0 * (z * vx - x * vz)
+    tz = 2.0 * (x * vy - y * vx)
+    return (vx - w * tx + (y * tz - z * ty), vy - w * ty + (z * tx - x * tz), vz - w * tz + (x * ty - y * tx))
+
+class SyntheticMotion:
+    # Arm raising and lowering: rotation about a tilted axis with a sinusoidal angle,
+    # every board gets a different phase and period so the streams are distinguishable
+    def __init__(self, index):
+        rng = random.Random(config['seed'] + index)
+        self.period = 2.0 + rng.random() * 2.0
+        self.phase = rng.random() * 2.0 * math.pi
+        self.amplitude = math.radians(45.0 + rng.random() * 45.0)
+        ax, ay, az = rng.uniform(-0.3, 0.3), 1.0, rng.uniform(-0.3, 0.3)
+        norm = math.sqrt(ax * ax + ay * ay + az * az)
+        self.axis = (ax / norm, ay / norm, az / norm)
+        self.rng = rng
+
+    def _noise(self):
+        return self.rng.gauss(0.0, config['noise'])
+
+    def angle(self, t):
+        return self.amplitude * math.sin(2.0 * math.pi * t / self.period + self.phase)
+
+    def quaternion(self, t, n=0):
+        half = self.angle(t) / 2.0
+        s = math.sin(half)
+        w, x, y, z = (math.cos(half), self.axis[0] * s + self._noise(), self.axis[1] * s + self._noise(),
+                      self.axis[2] * s + self._noise())
+        norm = math.sqrt(w * w + x * x + y * y + z * z)
+        return (w / norm, x / norm, y / norm, z / norm)
+
+    def euler(self, t, n=0):
+        return _quat_to_euler(*self.quaternion(t, n))
+
+    def acc(self, t, n=0):
+        # Gravity in g measured in the sensor frame
+        gx, gy, gz = _rotate_to_sensor(self.quaternion(t, n), (0.0, 0.0, 1.0))
+        return (gx + self._noise(), gy + self._noise(), gz + self._noise())
+
+    def gyro(self, t, n=0):
+        # Angular rate in deg/s, derivative of the rotation angle about the axis
+        rate = math.degrees(self.amplitude * 2.0 * math.pi / self.period *
+                            math.cos(2.0 * math.pi * t / self.period + self.phase))
+        return (self.axis[0] * rate + self._noise(), self.axis[1] * rate + self._noise(),
+                self.axis[2] * rate + self._noise())
+
+    def mag(self, t, n=0):
+        # Earth magnetic field in uT
+        mx, my, mz = _rotate_to_sensor(self.quaternion(t, n), (22.0, 0.0, -42.0))
+        return (mx + self._noise(), my + self._noise(), mz + self._noise())
+
+class ReplayMotion(SyntheticMotion):
+    # Replays a recorded session (the workbooks of DataCollection or the csv of stream_data_and_save),
+    # one row per emitted sample at the ODR of the stream that reads it; channels missing in the file stay synthetic
+    def __init__(self, index, path):
+        super().__init__(index)
+        import pandas as pd
+        frame = pd.read_csv(path) if path.endswith('.csv') else pd.read_excel(path)
+        self.rows = {column: frame[column].astype(float).tolist() for column in frame.columns
+                     if column not in ('timestamp', 'epoch', 'sample_count', 'sensor_index')}
+        self.length = len(frame)
+
+    def _columns(self, names, n):
+        i = n % self.length
+        return tuple(self.rows[name][i] for name in names)
+
+    def quaternion(self, t, n=0):
+        if 'w' in self.rows:
+            return self._columns(('w', 'x', 'y', 'z'), n)
+        if 'heading' in self.rows:
+            return _euler_to_quat(*self._columns(('heading', 'pitch', 'roll'), n))
+        return super().quaternion(t, n)
+
+    def euler(self, t, n=0):
+        if 'heading' in self.rows:
+            return self._columns(('heading', 'pitch', 'roll', 'yaw'), n)
+        return _quat_to_euler(*self.quaternion(t, n))
+
+    def acc(self, t, n=0):
+        if 'accel_x' in self.rows:
+            return self._columns(('accel_x', 'accel_y', 'accel_z'), n)
+        return super().acc(t, n)
+
+    def gyro(self, t, n=0):
+        if 'gyro_x' in self.rows:
+            return self._columns(('gyro_x', 'gyro_y', 'gyro_z'), n)
+        return super().gyro(t, n)
+
+    def mag(self, t, n=0):
+        if 'mag_x' in self.rows:
+            return self._columns(('mag_x', 'mag_y', 'mag_z'), n)
+        return super().mag(t, n)
+
+# ---------------------------------------------------------------------------------------------------------
+# Virtual boards
+# ---------------------------------------------------------------------------------------------------------
+class SimSignal:
+    def __init__(self, board, kind, type_id, generate):
+        self.board = board
+        self.kind = kind
+        self.type_id = type_id
+        self.generate = generate
+        self.subscribers = []
+        self.loggers = []
+        # libmetawear reuses the memory of the value between callbacks, so does the simulator
+        self.value = _VALUE_TYPES[type_id]()
+        self.data = Data(epoch=0, extra=None, value=cast(pointer(self.value), c_void_p), type_id=type_id,
+                         length=sizeof(self.value))
+        self.data_pointer = pointer(self.data)
+
+    def emit(self, epoch, t, n):
+        values = self.generate(t, n)
+        if self.loggers and self.board.logging:
+            self.board.log(self.loggers, epoch, values)
+        if not self.board.connected:
+            return  # Sampled for the logger only, the link is down
+        self.data.epoch = epoch
+        for field, v in zip(self.value._fields_, values):
+            setattr(self.value, field[0], v)
+        for context, callback in list(self.subscribers):
+            callback(context, self.data_pointer)
+
+class SimLogger:
+    # Entries of one logged signal in the flash of the board
+    _next_id = 1
+
+    def __init__(self, signal):
+        self.id = SimLogger._next_id
+        SimLogger._next_id += 1
+        self.signal = signal
+        self.entries_per_sample = _LOG_ENTRIES[signal.type_id]
+        self.samples = []  # (epoch, values)
+        self.subscribers = []
+        self.value = _VALUE_TYPES[signal.type_id]()
+        self.data = Data(epoch=0, extra=None, value=cast(pointer(self.value), c_void_p), type_id=signal.type_id,
+                         length=sizeof(self.value))
+        self.data_pointer = pointer(self.data)
+
+    def deliver(self, epoch, values):
+        self.data.epoch = epoch
+        for field, v in zip(self.value._fields_, values):
+            setattr(self.value, field[0], v)
+        for context, callback in list(self.subscribers):
+            callback(context, self.data_pointer)
+
+class SimStream:
+    # A periodic source of samples (one sensor or one fusion output) of a board
+    def __init__(self, signals, odr):
+        self.signals = signals
+        self.odr = odr
+        self.count = 0
+        self.start_epoch = None
+        self.start_time = None
+
+class SimBoard:
+    _next_index = 0
+
+    def __init__(self, address):
+        self.address = address
+        self.index = SimBoard._next_index
+        SimBoard._next_index += 1
+        replay = config['replay'].get(address)
+        self.motion = ReplayMotion(self.index, replay) if replay else SyntheticMotion(self.index)
+        self.connected = False
+        self.lock = threading.RLock()
+        self.fusion_mode = SensorFusionMode.SLEEP
+        self.fusion_enabled = set()
+        self.acc_odr = 100.0
+        self.gyro_odr = 100.0
+        self.mag_odr = 10.0
+        self.acc_enabled = self.gyro_enabled = self.mag_enabled = False
+        self.streams = {}
+        self.stall_until = 0.0
+        self.down_until = 0.0
+        self.faults_armed = False
+        self.logging = False
+        self.log_overwrite = False
+        self.log_entries = 0  # Entries in the flash
+        self.log_lost = 0     # Samples not logged, the flash was full
+        self.thread = None
+        self.stop_event = threading.Event()
+        q, e = self.motion.quaternion, self.motion.euler
+        self.signals = {
+            'quaternion': SimSignal(self, 'quaternion', DataTypeId.QUATERNION, q),
+            'euler_angle': SimSignal(self, 'euler_angle', DataTypeId.EULER_ANGLE, e),
+            'corrected_acc': SimSignal(self, 'corrected_acc', DataTypeId.CARTESIAN_FLOAT, self.motion.acc),
+            'corrected_gyro': SimSignal(self, 'corrected_gyro', DataTypeId.CARTESIAN_FLOAT, self.motion.gyro),
+            'corrected_mag': SimSignal(self, 'corrected_mag', DataTypeId.CARTESIAN_FLOAT, self.motion.mag),
+            'acc': SimSignal(self, 'acc', DataTypeId.CARTESIAN_FLOAT, self.motion.acc),
+            'gyro': SimSignal(self, 'gyro', DataTypeId.CARTESIAN_FLOAT, self.motion.gyro),
+            'mag': SimSignal(self, 'mag', DataTypeId.CARTESIAN_FLOAT, self.motion.mag),
+        }
+        # The packed signals deliver the same samples as the unpacked ones
+        self.signals['packed_acc'] = self.signals['acc']
+        self.signals['packed_gyro'] = self.signals['gyro']
+        self.signals['packed_mag'] = self.signals['mag']
+
+    def fusion_signal(self, data):
+        return self.signals[{SensorFusionData.CORRECTED_ACC: 'corrected_acc',
+                             SensorFusionData.CORRECTED_GYRO: 'corrected_gyro',
+                             SensorFusionData.CORRECTED_MAG: 'corrected_mag',
+                             SensorFusionData.QUATERNION: 'quaternion',
+                             SensorFusionData.EULER_ANGLE: 'euler_angle'}[data]]
+
+    def start_stream(self, name, signals, odr):
+        with self.lock:
+            self.streams[name] = SimStream(signals, odr)
+            if self.thread is None or not self.thread.is_alive():
+                self.stop_event.clear()
+                self.thread = threading.Thread(target=self._run, name=f"sim-{self.address}", daemon=True)
+                self.thread.start()
+
+    def stop_stream(self, name):
+        with self.lock:
+            self.streams.pop(name, None)
+
+    def log(self, loggers, epoch, values):
+        with self.lock:
+            for logger in loggers:
+                if self.log_entries + logger.entries_per_sample > config['log_capacity']:
+                    if not self.log_overwrite or not logger.samples:
+                        self.log_lost += 1
+                        continue
+                    logger.samples.pop(0)  # Circular log: the oldest sample goes
+                    self.log_entries -= logger.entries_per_sample
+                logger.samples.append((epoch, values))
+                self.log_entries += logger.entries_per_sample
+
+    def download(self, n_notifies, handler):
+        # Replays the logged samples in epoch order at the download rate, they leave the flash as they go
+        with self.lock:
+            loggers = [logger for logger in _loggers.values() if logger.signal.board is self]
+            samples = sorted(((epoch, logger, values) for logger in loggers for epoch, values in logger.samples),
+                             key=lambda sample: sample[0])
+            for logger in loggers:
+                logger.samples = []
+            total = sum(logger.entries_per_sample for _, logger, _ in samples)
+            self.log_entries -= total
+        step = max(1, total // n_notifies) if n_notifies else None
+        done = reported = 0
+        start = time.perf_counter()
+        for epoch, logger, values in samples:
+            if not self.connected:
+                return  # Link lost mid-download, the rest of the samples is gone in the simulator
+            logger.deliver(epoch, values)
+            done += logger.entries_per_sample
+            if step and done - reported >= step and done < total:
+                reported = done
+                handler.received_progress_update(handler.context, total - done, total)
+            wait = start + done / config['download_rate'] - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+        handler.received_progress_update(handler.context, 0, total)
+
+    def arm_faults(self):
+        # Scheduled once, counted from the first connection of the board
+        if self.faults_armed:
+            return
+        self.faults_armed = True
+        for mac, kind, start, duration in config['faults']:
+            if mac is None or mac == self.address:
+                timer = threading.Timer(start, self.fault, args=(kind, duration))
+                timer.daemon = True
+                timer.start()
+
+    def fault(self, kind, duration):
+        if kind == 'stall':
+            self.stall_until = time.time() + duration
+        elif kind == 'disconnect':
+            self.down_until = time.time() + duration
+            _disconnect(self)
+
+    def shutdown(self):
+        with self.lock:
+            self.streams.clear()
+            self.stop_event.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+    def _run(self):
+        while not self.stop_event.wait(config['tick']):
+            now = time.time()
+            with self.lock:
+                streams = list(self.streams.values())
+            for stream in streams:
+                if stream.start_time is None:
+                    stream.start_time = now
+                    stream.start_epoch = int(now * 1000)
+                # Emit every sample scheduled up to now, each one with the epoch of its own sampling time
+                due = int((now - stream.start_time) * stream.odr) + 1
+                if now < self.stall_until:
+                    stream.count = due  # Sampled by the board but never delivered
+                while stream.count < due:
+                    t = stream.count / stream.odr
+                    epoch = stream.start_epoch + int(t * 1000)
+                    for signal in stream.signals:
+                        signal.emit(epoch, stream.start_time + t, stream.count)
+                    stream.count += 1
+
+class SimUsb:
+    is_connected = False
+    is_enumerated = False
+
+class MetaWear:
+    def __init__(self, address, **kwargs):
+        self.address = address.upper()
+        self.cache = kwargs.get('cache_path', ".metawear")
+        # One virtual board per MAC, a new MetaWear of the same board finds its log in the flash
+        self.board = _boards.get(self.address) or SimBoard(self.address)
+        _boards[self.address] = self.board
+        self.usb = SimUsb()
+        self.on_disconnect = None
+        self.info = {}
+        self.cpp_state = None  # Serialized board state, skips the service discovery at connect
+        if kwargs.get('deserialize', True):
+            self.deserialize()
+        # Keeps a reference of every device so mbl_mw_debug_disconnect can notify on_disconnect
+        _devices[self.address] = self
+
+    @property
+    def is_connected(self):
+        return self.board.connected
+
+    def connect(self, **kwargs):
+        # libmetawear discovers the modules again when there is no state or the firmware changed
+        warm = self.cpp_state is not None and self.info.get('firmware') == config['firmware']
+        time.sleep(config['connect_delay'] + (0 if warm else config['discovery_delay']))
+        if time.time() < self.board.down_until:
+            raise RuntimeError(f"Failed to connect to {self.address} (simulated fault)")
+        self.board.connected = True
+        self.board.arm_faults()
+        self.info.setdefault('model', '5')
+        self.info.setdefault('hardware', '0.5')
+        self.info.setdefault('manufacturer', 'MbientLab Inc')
+        self.info.setdefault('serial', '%06d' % (self.board.index + 1))
+        self.info['firmware'] = config['firmware']
+        if not warm:
+            self.cpp_state = list(self.cpp_state or [0] * 16)
+        if kwargs.get('serialize', True):
+            self.serialize()
+
+    def disconnect(self):
+        _disconnect(self.board)
+
+    def _path(self):
+        return os.path.join(self.cache, '%s.json' % self.address.replace(':', ''))
+
+    def serialize(self):
+        # Same file as the SDK, a state read from the cache is written back as it was
+        if self.cpp_state is None:
+            return
+        os.makedirs(self.cache, exist_ok=True)
+        with open(self._path(), "w") as f:
+            json.dump({"info": self.info, "cpp_state": self.cpp_state}, f, indent=2)
+
+    def deserialize(self):
+        if os.path.isfile(self._path()):
+            with open(self._path(), "r") as f:
+                content = json.load(f)
+            self.info = content["info"]
+            self.cpp_state = content["cpp_state"]
+            return True
+        return False
+
+def _disconnect(board):
+    if not board.logging:
+        board.shutdown()  # A board that logs keeps sampling without the link
+    if board.connected:
+        board.connected = False
+        device = _devices.get(board.address)
+        if device is not None and device.on_disconnect is not None:
+            device.on_disconnect(Const.STATUS_OK)
+
+_devices = {}
+_boards = {}
+_loggers = {}
+
+# ---------------------------------------------------------------------------------------------------------
+# libmetawear
+# ---------------------------------------------------------------------------------------------------------
+class SimLibMetaWear:
+    # settings / debug / led
+    def mbl_mw_settings_set_connection_parameters(self, board, min_conn_interval, max_conn_interval, latency, timeout):
+        pass
+
+    def mbl_mw_debug_disconnect(self, board):
+        _disconnect(board)
+
+    def mbl_mw_led_load_preset_pattern(self, pattern, preset):
+        pass
+
+    def mbl_mw_led_write_pattern(self, board, pattern, color):
+        pass
+
+    def mbl_mw_led_play(self, board):
+        pass
+
+    def mbl_mw_led_stop_and_clear(self, board):
+        pass
+
+    # data signals
+    def mbl_mw_datasignal_subscribe(self, signal, context, callback):
+        signal.subscribers.append((context, callback))
+
+    def mbl_mw_datasignal_unsubscribe(self, signal):
+        signal.subscribers = []
+
+    # logging
+    def mbl_mw_datasignal_log(self, signal, context, callback):
+        logger = SimLogger(signal)
+        _loggers[logger.id] = logger
+        signal.loggers.append(logger)
+        callback(context, logger.id)
+
+    def mbl_mw_logger_subscribe(self, logger, context, callback):
+        _loggers[logger].subscribers.append((context, callback))
+
+    def mbl_mw_logger_remove(self, logger):
+        logger = _loggers.pop(logger)
+        logger.signal.loggers.remove(logger)
+        with logger.signal.board.lock:
+            logger.signal.board.log_entries -= len(logger.samples) * logger.entries_per_sample
+
+    def mbl_mw_logging_start(self, board, overwrite):
+        board.logging = True
+        board.log_overwrite = bool(overwrite)
+
+    def mbl_mw_logging_stop(self, board):
+        board.logging = False
+
+    def mbl_mw_logging_flush_page(self, board):
+        pass
+
+    def mbl_mw_logging_clear_entries(self, board):
+        with board.lock:
+            for logger in _loggers.values():
+                if logger.signal.board is board:
+                    logger.samples = []
+            board.log_entries = 0
+
+    def mbl_mw_logging_download(self, board, n_notifies, handler):
+        # Asynchronous like libmetawear: the samples and the progress arrive from another thread
+        handler = handler._obj if hasattr(handler, '_obj') else handler.contents  # byref() or pointer()
+        threading.Thread(target=board.download, args=(n_notifies, handler), name=f"sim-download-{board.address}",
+                         daemon=True).start()
+
+    # sensor fusion
+    def mbl_mw_sensor_fusion_set_mode(self, board, mode):
+        board.fusion_mode = mode
+
+    def mbl_mw_sensor_fusion_set_acc_range(self, board, acc_range):
+        pass
+
+    def mbl_mw_sensor_fusion_set_gyro_range(self, board, gyro_range):
+        pass
+
+    def mbl_mw_sensor_fusion_write_config(self, board):
+        pass
+
+    def mbl_mw_sensor_fusion_get_data_signal(self, board, data):
+        return board.fusion_signal(data)
+
+    def mbl_mw_sensor_fusion_enable_data(self, board, data):
+        board.fusion_enabled.add(data)
+
+    def mbl_mw_sensor_fusion_clear_enabled_mask(self, board):
+        board.fusion_enabled.clear()
+
+    def mbl_mw_sensor_fusion_start(self, board):
+        signals = [board.fusion_signal(data) for data in sorted(board.fusion_enabled)]
+        board.start_stream('fusion', signals, config['fusion_odr'])
+
+    def mbl_mw_sensor_fusion_stop(self, board):
+        board.stop_stream('fusion')
+
+    # accelerometer
+    def mbl_mw_acc_bmi270_set_odr(self, board, odr):
+        board.acc_odr = _ACC_ODR_HZ[odr]
+
+    def mbl_mw_acc_bmi160_set_odr(self, board, odr):
+        board.acc_odr = _ACC_ODR_HZ[odr]
+
+    def mbl_mw_acc_set_odr(self, board, odr):
+        board.acc_odr = float(odr)
+
+    def mbl_mw_acc_bosch_set_range(self, board, acc_range):
+        pass
+
+    def mbl_mw_acc_set_range(self, board, acc_range):
+        pass
+
+    def mbl_mw_acc_write_acceleration_config(self, board):
+        pass
+
+    def mbl_mw_acc_get_acceleration_data_signal(self, board):
+        return board.signals['acc']
+
+    def mbl_mw_acc_get_packed_acceleration_data_signal(self, board):
+        return board.signals['packed_acc']
+
+    def mbl_mw_acc_enable_acceleration_sampling(self, board):
+        board.acc_enabled = True
+
+    def mbl_mw_acc_disable_acceleration_sampling(self, board):
+        board.acc_enabled = False
+
+    def mbl_mw_acc_start(self, board):
+        if board.acc_enabled:
+            board.start_stream('acc', [board.signals['acc']], config['imu_odr'] or board.acc_odr)
+
+    def mbl_mw_acc_stop(self, board):
+        board.stop_stream('acc')
+
+    # gyroscope (bmi160 and bmi270 behave the same for the simulator)
+    def mbl_mw_gyro_bmi270_set_range(self, board, gyro_range):
+        pass
+
+    def mbl_mw_gyro_bmi270_set_odr(self, board, odr):
+        board.gyro_odr = _GYRO_ODR_HZ[odr]
+
+    def mbl_mw_gyro_bmi270_write_config(self, board):
+        pass
+
+    def mbl_mw_gyro_bmi270_get_rotation_data_signal(self, board):
+        return board.signals['gyro']
+
+    def mbl_mw_gyro_bmi270_get_packed_rotation_data_signal(self, board):
+        return board.signals['packed_gyro']
+
+    def mbl_mw_gyro_bmi270_enable_rotation_sampling(self, board):
+        board.gyro_enabled = True
+
+    def mbl_mw_gyro_bmi270_disable_rotation_sampling(self, board):
+        board.gyro_enabled = False
+
+    def mbl_mw_gyro_bmi270_start(self, board):
+        if board.gyro_enabled:
+            board.start_stream('gyro', [board.signals['gyro']], config['imu_odr'] or board.gyro_odr)
+
+    def mbl_mw_gyro_bmi270_stop(self, board):
+        board.stop_stream('gyro')
+
+    mbl_mw_gyro_bmi160_set_range = mbl_mw_gyro_bmi270_set_range
+    mbl_mw_gyro_bmi160_set_odr = mbl_mw_gyro_bmi270_set_odr
+    mbl_mw_gyro_bmi160_write_config = mbl_mw_gyro_bmi270_write_config
+    mbl_mw_gyro_bmi160_get_rotation_data_signal = mbl_mw_gyro_bmi270_get_rotation_data_signal
+    mbl_mw_gyro_bmi160_get_packed_rotation_data_signal = mbl_mw_gyro_bmi270_get_packed_rotation_data_signal
+    mbl_mw_gyro_bmi160_enable_rotation_sampling = mbl_mw_gyro_bmi270_enable_rotation_sampling
+    mbl_mw_gyro_bmi160_disable_rotation_sampling = mbl_mw_gyro_bmi270_disable_rotation_sampling
+    mbl_mw_gyro_bmi160_start = mbl_mw_gyro_bmi270_start
+    mbl_mw_gyro_bmi160_stop = mbl_mw_gyro_bmi270_stop
+
+    # magnetometer
+    def mbl_mw_mag_bmm150_set_preset(self, board, preset):
+        board.mag_odr = _MAG_PRESET_HZ[preset]
+
+    def mbl_mw_mag_bmm150_configure(self, board, xy_reps, z_reps, odr):
+        board.mag_odr = _MAG_ODR_HZ[odr]
+
+    def mbl_mw_mag_bmm150_get_b_field_data_signal(self, board):
+        return board.signals['mag']
+
+    def mbl_mw_mag_bmm150_get_packed_b_field_data_signal(self, board):
+        return board.signals['packed_mag']
+
+    def mbl_mw_mag_bmm150_enable_b_field_sampling(self, board):
+        board.mag_enabled = True
+
+    def mbl_mw_mag_bmm150_disable_b_field_sampling(self, board):
+        board.mag_enabled = False
+
+    def mbl_mw_mag_bmm150_start(self, board):
+        if board.mag_enabled:
+            board.start_stream('mag', [board.signals['mag']], config['mag_odr'] or board.mag_odr)
+
+    def mbl_mw_mag_bmm150_stop(self, board):
+        board.stop_stream('mag')
+
+libmetawear = SimLibMetaWear()
+
+# ---------------------------------------------------------------------------------------------------------
+# Installation as mbientlab.metawear
+# ---------------------------------------------------------------------------------------------------------
+def install(**settings):
+    config.update(settings)
+    import ctypes
+    cbindings = types.ModuleType('mbientlab.metawear.cbindings')
+    for name in dir(ctypes):
+        if not name.startswith('_'):
+            setattr(cbindings, name, getattr(ctypes, name))
+    for name in _CBINDINGS:
+        setattr(cbindings, name, globals()[name])
+
+    metawear = types.ModuleType('mbientlab.metawear')
+    metawear.__dict__.update({k: v for k, v in cbindings.__dict__.items() if not k.startswith('__')})
+    metawear.cbindings = cbindings
+    metawear.MetaWear = MetaWear
+    metawear.libmetawear = libmetawear
+    metawear.parse_value = parse_value
+    metawear.create_voidp = create_voidp
+
+    mbientlab = types.ModuleType('mbientlab')
+    mbientlab.metawear = metawear
+    mbientlab.warble = types.ModuleType('mbientlab.warble')
+    mbientlab.__path__ = []
+
+    sys.modules['mbientlab'] = mbientlab
+    sys.modules['mbientlab.metawear'] = metawear
+    sys.modules['mbientlab.metawear.cbindings'] = cbindings
+    sys.modules['mbientlab.warble'] = mbientlab.warble
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a script of the repository against virtual MetaWear boards")
+    parser.add_argument('--fusion-odr', type=float, default=config['fusion_odr'], help="sensor fusion output rate (Hz)")
+    parser.add_argument('--imu-odr', type=float, default=None, help="overrides the acc/gyro ODR of the script (Hz)")
+    parser.add_argument('--mag-odr', type=float, default=None, help="overrides the magnetometer ODR of the script (Hz)")
+    parser.add_argument('--connect-delay', type=float, default=config['connect_delay'], help="connection time (s)")
+    parser.add_argument('--discovery-delay', type=float, default=config['discovery_delay'],
+                        help="service discovery time of a connection without a cached board state (s)")
+    parser.add_argument('--firmware', default=config['firmware'], help="firmware version reported by the boards")
+    parser.add_argument('--download-rate', type=float, default=config['download_rate'],
+                        help="log entries per second of a log download")
+    parser.add_argument('--noise', type=float, default=config['noise'])
+    parser.add_argument('--seed', type=int, default=config['seed'])
+    parser.add_argument('--replay', action='append', default=[], metavar='MAC=FILE',
+                        help="replay a recorded session (xlsx/csv) on the board with the given MAC")
+    parser.add_argument('--fault', action='append', default=[], metavar='[MAC=]KIND@T+D',
+                        help="inject a fault: stall or disconnect, T seconds after connecting, for D seconds")
+    parser.add_argument('script', help="script to run")
+    parser.add_argument('args', nargs=argparse.REMAINDER, help="arguments of the script")
+    args = parser.parse_args()
+
+    replay = {}
+    for item in args.replay:
+        mac, path = item.split('=', 1)
+        replay[mac.upper()] = os.path.abspath(path)
+    faults = []
+    for item in args.fault:
+        mac, _, spec = item.rpartition('=')
+        kind, _, when = spec.partition('@')
+        start, _, duration = when.partition('+')
+        if kind not in ('stall', 'disconnect'):
+            parser.error(f"unknown fault {kind} (stall, disconnect)")
+        faults.append((mac.upper() or None, kind, float(start), float(duration or 1.0)))
+
+    install(fusion_odr=args.fusion_odr, imu_odr=args.imu_odr, mag_odr=args.mag_odr,
+            connect_delay=args.connect_delay, discovery_delay=args.discovery_delay,
+            firmware=args.firmware, download_rate=args.download_rate, noise=args.noise, seed=args.seed, replay=replay, faults=faults)
+
+    # Run the script as if it was called directly
+    script = os.path.abspath(args.script)
+    sys.argv = [script] + args.args
+    sys.path.insert(0, os.path.dirname(script))
+    runpy.run_path(script, run_name='__main__')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# Quaternion math on whole arrays of samples, without per-sample loops
+# Quaternions are [w x y z] on the last axis: (4,), (T, 4) for the samples of one sensor, (N, T, 4) for N
+# sensors or N windows; every function broadcasts over the leading axes and runs as a few NumPy passes.
+# Time is the axis before the last one (continuous() and the sign of a series).
+#
+# Conventions: a unit quaternion q rotates the sensor frame onto the earth frame, v_earth = q v q* (what
+# the NDOF fusion of the boards and host_fusion.py give). relative(a, b) = a^-1 b is b seen from a, e.g.
+# the arm in the frame of the chest. q and -q are the same rotation: continuous() picks, sample after
+# sample, the one closest to the previous sample so a series has no sign jumps (the NDOF output flips sign
+# whenever w crosses 0), which is what a model or a filter over the raw components needs.
+# Euler angles are intrinsic z-y'-x'' (yaw, pitch, roll) in degrees, in the EULER_CHANNELS order of the
+# boards (heading, pitch, roll, yaw) with heading = yaw in [0, 360); the onboard Euler of the firmware
+# uses its own axis conventions, so only compare angles computed here with each other.
+import numpy as np
+
+IDENTITY = np.array([1.0, 0.0, 0.0, 0.0])
+
+def normalize(q):
+    # Unit quaternions, zero rows (no sample) become the identity
+    n = np.linalg.norm(q, axis=-1, keepdims=True)
+    return np.where(n > 0, q / np.where(n > 0, n, 1.0), IDENTITY)
+
+def conjugate(q):
+    return q * np.array([1.0, -1.0, -1.0, -1.0])
+
+def inverse(q):
+    return conjugate(q) / np.sum(q * q, axis=-1, keepdims=True)
+
+def multiply(p, q):
+    w1, x1, y1, z1 = np.moveaxis(p, -1, 0)
+    w2, x2, y2, z2 = np.moveaxis(q, -1, 0)
+    return np.stack([w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2,
+                     w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+                     w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+                     w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2], axis=-1)
+
+def relative(reference, q):
+    # q in the frame of `reference` (reference^-1 q), for unit quaternions
+    return multiply(conjugate(reference), q)
+
+def rotate(q, v):
+    # Vectors v (..., 3) of the sensor frame in the earth frame, q v q*
+    u = q[..., 1:]
+    t = 2 * np.cross(u, v)
+    return v + q[..., :1] * t + np.cross(u, t)
+
+def continuous(q, previous=None):
+    # Signs flipped along the time axis so that every sample is in the hemisphere of the one before it;
+    # the first sample follows `previous` (the last sample of the previous chunk of a stream, (..., 4)),
+    # or has w >= 0 without it
+    q = np.asarray(q, dtype=np.float64)
+    if q.shape[-2] == 0:
+        return q.copy()
+    first = q[..., :1, :]
+    anchor = first[..., 0:1] if previous is None else np.sum(first * np.expand_dims(previous, -2), axis=-1, keepdims=True)
+    steps = np.sum(q[..., 1:, :] * q[..., :-1, :], axis=-1, keepdims=True)
+    flips = np.concatenate([anchor < 0, steps < 0], axis=-2)
+    return np.where(np.cumsum(flips, axis=-2) % 2 == 1, -q, q)
+
+def from_matrix(r):
+    # Rotation matrices (..., 3, 3) to unit quaternions with w >= 0, from the largest of w, x, y, z
+    m00, m01, m02 = r[..., 0, 0], r[..., 0, 1], r[..., 0, 2]
+    m10, m11, m12 = r[..., 1, 0], r[..., 1, 1], r[..., 1, 2]
+    m20, m21, m22 = r[..., 2, 0], r[..., 2, 1], r[..., 2, 2]
+    trace = m00 + m11 + m22
+    candidates = np.stack([np.stack([1 + trace, m21 - m12, m02 - m20, m10 - m01], -1),
+                           np.stack([m21 - m12, 1 + m00 - m11 - m22, m01 + m10, m02 + m20], -1),
+                           np.stack([m02 - m20, m01 + m10, 1 - m00 + m11 - m22, m12 + m21], -1),
+                           np.stack([m10 - m01, m02 + m20, m12 + m21, 1 - m00 - m11 + m22], -1)], -2)
+    largest = np.argmax(np.stack([trace, m00, m11, m22], -1), axis=-1)
+    q = normalize(np.take_along_axis(candidates, largest[..., None, None], axis=-2)[..., 0, :])
+    return np.where(q[..., :1] < 0, -q, q)
+
+def to_euler(q):
+    # (..., 4) -> (..., 4) [heading pitch roll yaw] in degrees
+    w, x, y, z = np.moveaxis(normalize(q), -1, 0)
+    yaw = np.degrees(np.arctan2(2 * (w * z + x * y), 1 - 2 * (y * y + z * z)))
+    pitch = np.degrees(np.arcsin(np.clip(2 * (w * y - z * x), -1.0, 1.0)))
+    roll = np.degrees(np.arctan2(2 * (w * x + y * z), 1 - 2 * (x * x + y * y)))
+    return np.stack([np.mod(yaw, 360.0), pitch, roll, yaw], axis=-1)
+
+def to_axis_angle(q):
+    # (..., 4) -> unit axes (..., 3) and angles (...) in degrees, 0 to 180 (the shortest rotation);
+    # the axis of a null rotation is x
+    q = normalize(q)
+    q = np.where(q[..., :1] < 0, -q, q)
+    sine = np.linalg.norm(q[..., 1:], axis=-1)
+    angle = np.degrees(2 * np.arctan2(sine, q[..., 0]))
+    axis = np.where(sine[..., None] > 0, q[..., 1:] / np.where(sine > 0, sine, 1.0)[..., None], (1.0, 0.0, 0.0))
+    return axis, angle
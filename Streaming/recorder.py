@@ -0,0 +1,325 @@
+# Append-only binary recording of sensor samples, crash safe
+# File layout:
+#   preamble   8 bytes magic b'MMRLREC1' + uint32 length of the header (little endian) + 4 reserved bytes
+#   header     JSON: version, sensors (MACs, the record stores the index), channels, record_size and any
+#              metadata of the session, padded with spaces so the records start at a multiple of 64 bytes
+#   records    fixed size, packed little endian: sensor uint16, epoch int64 (board epoch, ms), one float32
+#              per channel
+# A dropout of a sensor is marked with two gap records, written together: sensor index + GAP_FLAG, with
+# the last epoch before the gap (first channel GAP_START) and then the first epoch after it (first channel
+# GAP_END), the other channels NaN. Both epochs are stored exactly in the int64 field, whatever the length
+# of the gap. Recording.sensor() leaves them out and Recording.gaps() pairs them. Version 1 files stored
+# the length of the gap in ms as first channel of a single record: Recording still reads them, a Recorder
+# does not append to them.
+# Records are staged in a preallocated chunk and every chunk goes to disk with one write() followed by
+# fsync(), so a crash loses at most the chunk being filled. The reader memory-maps the records and ignores
+# a torn last record; reopening an existing file for recording checks the schema, cuts the torn tail and
+# appends after it.
+#
+#   python recorder.py sensor_data.mmrec [--csv sensor_data.csv]     summary (and CSV export) of a recording
+#   python recorder.py --benchmark [--records 1000000]              write throughput
+#   python recorder.py --check                                      reads a version 1 and a version 2 file
+import argparse
+import json
+import os
+import struct
+import threading
+import time
+from datetime import datetime
+import numpy as np
+
+MAGIC = b'MMRLREC1'
+PREAMBLE = struct.Struct('<8sI4x')
+ALIGNMENT = 64
+VERSION = 2
+VERSIONS = (1, 2)     # Versions Recording reads, a Recorder only appends to VERSION
+CHUNK_RECORDS = 4096  # Records per fsync'd chunk, ~4 s of 9 channels at 1 kHz in total
+GAP_FLAG = 0x8000     # Set in the sensor field of the gap records
+GAP_START, GAP_END = 0.0, 1.0  # First channel of the two records of a gap
+
+def record_dtype(channels):
+    return np.dtype([('sensor', '<u2'), ('epoch', '<i8')] + [(channel, '<f4') for channel in channels])
+
+def _read_header(f):
+    magic, length = PREAMBLE.unpack(f.read(PREAMBLE.size))
+    if magic != MAGIC:
+        raise ValueError(f"{f.name} is not a recording (magic {magic!r})")
+    header = json.loads(f.read(length))
+    if header.get('version', 1) not in VERSIONS:
+        raise ValueError(f"Unsupported recording version {header.get('version', 1)}")
+    header['offset'] = PREAMBLE.size + length
+    return header
+
+class Recorder:
+    def __init__(self, path, sensors, channels, chunk=CHUNK_RECORDS, metadata=None):
+        # sensors: MACs (the records store their index), channels: names of the float32 values of a record
+        self.path = path
+        self.sensors = list(sensors)
+        self.channels = tuple(channels)
+        self.dtype = record_dtype(self.channels)
+        self._chunk = np.zeros(chunk, dtype=self.dtype)
+        self._pending = 0
+        self._lock = threading.Lock()  # Gaps are marked from the supervisor thread, samples from the handlers
+        self.records = 0  # Records on disk
+        self.chunks = 0   # fsync'd writes
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            self._f = open(path, 'r+b')
+            try:
+                self._resume()
+            except Exception:
+                self._f.close()
+                raise
+        else:
+            self._f = open(path, 'wb')
+            self._write_header(metadata or {})
+
+    def _write_header(self, metadata):
+        header = {'version': VERSION, 'sensors': self.sensors, 'channels': list(self.channels),
+                  'record_size': self.dtype.itemsize, 'created': datetime.now().isoformat(), **metadata}
+        text = json.dumps(header).encode()
+        length = -(-(PREAMBLE.size + len(text)) // ALIGNMENT) * ALIGNMENT - PREAMBLE.size
+        self._f.write(PREAMBLE.pack(MAGIC, length) + text.ljust(length))
+        self._sync()
+        # The new directory entry too, or the file itself could be lost in a crash
+        if hasattr(os, 'O_DIRECTORY'):
+            folder = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(folder)
+            finally:
+                os.close(folder)
+
+    def _resume(self):
+        header = _read_header(self._f)
+        if header.get('version', 1) != VERSION:
+            raise ValueError(f"{self.path} is a version {header.get('version', 1)} recording, "
+                             f"appending needs version {VERSION}")
+        if header['sensors'] != self.sensors or tuple(header['channels']) != self.channels:
+            raise ValueError(f"{self.path} was recorded with sensors {header['sensors']} and channels "
+                             f"{header['channels']}")
+        size = os.path.getsize(self.path) - header['offset']
+        self.records = size // self.dtype.itemsize
+        self._f.truncate(header['offset'] + self.records * self.dtype.itemsize)  # Torn last record
+        self._f.seek(0, os.SEEK_END)
+
+    def _sync(self):
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
+    def append(self, sensor, epoch, *values):
+        # One record, e.g. from a data handler
+        with self._lock:
+            record = self._chunk[self._pending]
+            record['sensor'] = sensor
+            record['epoch'] = epoch
+            for channel, value in zip(self.channels, values):
+                record[channel] = value
+            self._pending += 1
+            if self._pending == len(self._chunk):
+                self._flush()
+
+    def extend(self, sensor, samples):
+        # Samples of one sensor with 'epoch' and the channels as fields, e.g. a view of a SampleRingBuffer
+        with self._lock:
+            start = 0
+            while start < len(samples):
+                n = min(len(samples) - start, len(self._chunk) - self._pending)
+                rows = self._chunk[self._pending:self._pending + n]
+                rows['sensor'] = sensor
+                rows['epoch'] = samples['epoch'][start:start + n]
+                for channel in self.channels:
+                    rows[channel] = samples[channel][start:start + n]
+                self._pending += n
+                start += n
+                if self._pending == len(self._chunk):
+                    self._flush()
+
+    def mark_gap(self, sensor, start_epoch, end_epoch):
+        # Samples of `sensor` between the two epochs were lost
+        marks = np.zeros(2, dtype=self.dtype)
+        for channel in self.channels:
+            marks[channel] = np.nan
+        marks['sensor'] = sensor | GAP_FLAG
+        marks['epoch'] = (start_epoch, end_epoch)
+        marks[self.channels[0]] = (GAP_START, GAP_END)
+        with self._lock:
+            for mark in marks:
+                self._chunk[self._pending] = mark
+                self._pending += 1
+                if self._pending == len(self._chunk):
+                    self._flush()
+
+    def write(self, records):
+        # Records already in the record dtype, written as they are (one write and one fsync)
+        with self._lock:
+            self._flush()
+            if len(records):
+                self._f.write(np.ascontiguousarray(records, dtype=self.dtype).tobytes())
+                self._sync()
+                self.records += len(records)
+                self.chunks += 1
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if self._pending:
+            self._f.write(self._chunk[:self._pending].tobytes())
+            self._sync()
+            self.records += self._pending
+            self.chunks += 1
+            self._pending = 0
+
+    def close(self):
+        if not self._f.closed:
+            self.flush()
+            self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class Recording:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.header = _read_header(f)
+        self.path = path
+        self.sensors = self.header['sensors']
+        self.channels = tuple(self.header['channels'])
+        self.dtype = record_dtype(self.channels)
+        size = os.path.getsize(path) - self.header['offset']
+        count = size // self.dtype.itemsize
+        self.torn = size - count * self.dtype.itemsize  # Bytes of a record cut by a crash
+        self.records = (np.memmap(path, dtype=self.dtype, mode='r', offset=self.header['offset'], shape=(count,))
+                        if count else np.zeros(0, dtype=self.dtype))
+
+    def __len__(self):
+        return len(self.records)
+
+    def sensor(self, sensor):
+        # Records of one sensor (index or MAC), in the order they were recorded
+        index = self.sensors.index(sensor) if isinstance(sensor, str) else sensor
+        return self.records[self.records['sensor'] == index]
+
+    def gaps(self, sensor):
+        # [(last epoch before, first epoch after)] of the dropouts of one sensor
+        index = self.sensors.index(sensor) if isinstance(sensor, str) else sensor
+        marks = self.records[self.records['sensor'] == index | GAP_FLAG]
+        first = self.channels[0]
+        if self.header.get('version', 1) < 2:
+            return [(int(mark['epoch']), int(mark['epoch'] + round(float(mark[first])))) for mark in marks]
+        gaps, start = [], None
+        for mark in marks:
+            if mark[first] == GAP_START:
+                start = int(mark['epoch'])
+            elif start is not None:
+                gaps.append((start, int(mark['epoch'])))
+                start = None
+        return gaps  # A start without its end (crash between the two records) is left out
+
+def benchmark(records):
+    path = f'recorder_benchmark_{os.getpid()}.mmrec'
+    channels = ('acc_x', 'acc_y', 'acc_z', 'gyro_x', 'gyro_y', 'gyro_z', 'mag_x', 'mag_y', 'mag_z')
+    samples = np.zeros(records, dtype=[('epoch', np.int64)] + [(c, np.float32) for c in channels])
+    samples['epoch'] = np.arange(records)
+    try:
+        with Recorder(path, ['00:00:00:00:00:00'], channels) as recorder:
+            start = time.perf_counter()
+            for i in range(0, records, 100):  # Blocks of 100 samples, as read from a ring buffer
+                recorder.extend(0, samples[i:i + 100])
+            recorder.flush()
+            elapsed = time.perf_counter() - start
+        print(f"extend: {records / elapsed:,.0f} records/s, {recorder.chunks} fsync'd chunks, "
+              f"{os.path.getsize(path) / elapsed / 1e6:.1f} MB/s")
+        with Recorder(path, ['00:00:00:00:00:00'], channels) as recorder:
+            n = min(records, 100000)
+            start = time.perf_counter()
+            for i in range(n):
+                recorder.append(0, i, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+            recorder.flush()
+            print(f"append: {n / (time.perf_counter() - start):,.0f} records/s")
+        print(f"read back: {len(Recording(path))} records")
+    finally:
+        os.remove(path)
+
+def check():
+    # A version 1 file written as the old Recorder did, read back through Recording, and the same session
+    # recorded as version 2
+    path = f'recorder_check_{os.getpid()}.mmrec'
+    channels = ('acc_x', 'acc_y', 'acc_z')
+    dtype = record_dtype(channels)
+    samples = np.zeros(6, dtype=dtype)
+    samples['epoch'] = (1000, 1010, 1020, 7201020, 7201030, 7201040)  # 2 h dropout after the third sample
+    samples['acc_x'] = np.arange(6)
+    gap = np.zeros(1, dtype=dtype)  # Version 1 gap: one record, length of the gap in ms as first channel
+    for channel in channels:
+        gap[channel] = np.nan
+    gap['sensor'], gap['epoch'], gap['acc_x'] = GAP_FLAG, 1020, 7200000.0
+    expected = [(1020, 7201020)]
+    try:
+        text = json.dumps({'version': 1, 'sensors': ['00:00:00:00:00:00'], 'channels': list(channels),
+                           'record_size': dtype.itemsize}).encode()
+        length = -(-(PREAMBLE.size + len(text)) // ALIGNMENT) * ALIGNMENT - PREAMBLE.size
+        with open(path, 'wb') as f:
+            f.write(PREAMBLE.pack(MAGIC, length) + text.ljust(length))
+            f.write(np.concatenate([samples[:3], gap, samples[3:]]).tobytes())
+        recording = Recording(path)
+        assert recording.sensor(0)['acc_x'].tolist() == list(range(6)), "version 1: samples"
+        assert recording.gaps('00:00:00:00:00:00') == expected, f"version 1: gaps {recording.gaps(0)}"
+        try:
+            Recorder(path, ['00:00:00:00:00:00'], channels).close()
+            raise AssertionError("version 1: appended to")
+        except ValueError:
+            pass
+        print("version 1: read, not appended to")
+        os.remove(path)
+        with Recorder(path, ['00:00:00:00:00:00'], channels) as recorder:
+            recorder.write(samples[:3])
+            recorder.mark_gap(0, *expected[0])
+            recorder.write(samples[3:])
+        recording = Recording(path)
+        assert recording.sensor(0)['acc_x'].tolist() == list(range(6)), "version 2: samples"
+        assert recording.gaps(0) == expected, f"version 2: gaps {recording.gaps(0)}"
+        print("version 2: read")
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Binary sensor recordings")
+    parser.add_argument('path', nargs='?', help="Recording to summarize")
+    parser.add_argument('--csv', help="Export the records to this CSV file")
+    parser.add_argument('--benchmark', action='store_true')
+    parser.add_argument('--check', action='store_true', help="Read back a version 1 and a version 2 file")
+    parser.add_argument('--records', type=int, default=1000000)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.records)
+        return
+    if args.check:
+        check()
+        return
+    if not args.path:
+        parser.error("a recording or --benchmark is required")
+    recording = Recording(args.path)
+    print(f"{args.path}: {len(recording)} records of {recording.dtype.itemsize} bytes, channels "
+          f"{' '.join(recording.channels)}, created {recording.header.get('created')}"
+          + (f", {recording.torn} torn bytes at the end" if recording.torn else ""))
+    for index, mac in enumerate(recording.sensors):
+        epochs = recording.sensor(index)['epoch']
+        span = (epochs[-1] - epochs[0]) / 1000 if len(epochs) else 0.0
+        gaps = recording.gaps(index)
+        lost = sum(end - start for start, end in gaps) / 1000
+        print(f"  {mac}: {len(epochs)} records, {span:.1f} s" + (f", {len(gaps)} gaps ({lost:.1f} s)" if gaps else ""))
+    if args.csv:
+        import pandas as pd
+        frame = pd.DataFrame(recording.records[recording.records['sensor'] < GAP_FLAG])
+        frame.insert(1, 'mac', np.array(recording.sensors, dtype=object)[frame['sensor']] if len(frame) else [])
+        frame.to_csv(args.csv, index=False)
+        print(f"Exported to {args.csv}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+# Decimation stage that runs after the ring buffer, outside of the libmetawear callback
+# Each consumer creates its own Decimator with the output rate it needs (plots, export, LSTM...)
+# and calls read() whenever it wants; acquisition keeps running at the full ODR of the sensor.
+#
+# The output is aligned to a grid of the board epoch: every 1000 / rate ms one sample is emitted
+# with the last sample of the bin ('last') or the average of the bin ('mean', box anti-alias filter,
+# for IMU channels). A bin is emitted once a sample of a later bin arrives, flush() emits the last one.
+# A rate above the input rate does not interpolate, every input sample is passed through.
+import numpy as np
+
+class Decimator:
+    def __init__(self, buffer, rate, mode='last', cursor=0):
+        if mode not in ('last', 'mean'):
+            raise ValueError(f"Unknown decimation mode: {mode}")
+        self.buffer = buffer
+        self.rate = float(rate)
+        self.mode = mode
+        self.cursor = cursor  # Position in the ring buffer of the next sample to read
+        self.dropped = 0      # Samples overwritten in the ring buffer before they were read
+        self._pending = np.empty(0, dtype=buffer.dtype)
+
+    def _bins(self, epochs):
+        return np.floor(epochs * (self.rate / 1000.0)).astype(np.int64)
+
+    def _reduce(self, records, bins, starts):
+        out = np.empty(len(starts), dtype=records.dtype)
+        if self.mode == 'mean':
+            counts = np.diff(np.append(starts, len(records)))
+            for channel in self.buffer.channels:
+                out[channel] = np.add.reduceat(records[channel], starts) / counts
+        else:
+            ends = np.append(starts[1:], len(records)) - 1
+            out[:] = records[ends]
+        out['epoch'] = np.round(bins[starts] * (1000.0 / self.rate)).astype(np.int64)
+        return out
+
+    def read(self):
+        new, self.cursor, dropped = self.buffer.read_since(self.cursor)
+        self.dropped += dropped
+        records = np.concatenate([self._pending, new]) if len(self._pending) else new
+        if len(records) == 0:
+            return self._pending[:0]
+        bins = self._bins(records['epoch'])
+        starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+        # The last bin can still receive samples, it is kept until a later one starts
+        last = starts[-1]
+        self._pending = records[last:].copy()
+        if last == 0:
+            return self._pending[:0]
+        return self._reduce(records[:last], bins[:last], starts[:-1])
+
+    def flush(self):
+        out = self.read()
+        if len(self._pending):
+            tail = self._reduce(self._pending, self._bins(self._pending['epoch']), np.zeros(1, dtype=np.int64))
+            out = np.concatenate([out, tail])
+            self._pending = self._pending[:0]
+        return out
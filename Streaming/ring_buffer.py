@@ -0,0 +1,87 @@
+# Fixed-capacity ring buffer of sensor samples backed by a preallocated NumPy structured array
+# Record layout: 'epoch' (int64, board epoch in ms) followed by one float32 per channel
+#
+# Contract: a single writer (the libmetawear callback of the sensor) and any number of readers.
+# The writer fills the slot first and publishes it after by incrementing `count`, so readers only
+# ever see complete samples. Every sample is stored twice (slot i and slot i + capacity), that way
+# any window of up to `capacity` samples is a contiguous slice and readers get views, not copies.
+# A view stays valid until the writer wraps over it; readers that keep data for longer must copy it.
+import numpy as np
+from numpy.lib import recfunctions
+
+QUATERNION_CHANNELS = ('w', 'x', 'y', 'z')
+EULER_CHANNELS = ('heading', 'pitch', 'roll', 'yaw')
+CARTESIAN_CHANNELS = ('x', 'y', 'z')
+
+def sample_dtype(channels):
+    return np.dtype([('epoch', np.int64)] + [(channel, np.float32) for channel in channels])
+
+class SampleRingBuffer:
+    def __init__(self, channels, capacity):
+        self.channels = tuple(channels)
+        self.capacity = int(capacity)
+        self.dtype = sample_dtype(self.channels)
+        self._data = np.zeros(2 * self.capacity, dtype=self.dtype)
+        # Base address of the storage, for writers that copy the raw payload of libmetawear (fast_decoder)
+        self.address = self._data.ctypes.data
+        self.count = 0  # Samples written since the creation of the buffer, only the writer updates it
+        self.gaps = []  # (last epoch before, first epoch after) of every dropout, marked by supervisor.py
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    # ---- writer side ----------------------------------------------------------------------------------
+    def append(self, epoch, *values):
+        record = (epoch,) + values
+        i = self.count % self.capacity
+        self._data[i] = record
+        self._data[i + self.capacity] = record
+        self.count += 1
+
+    def extend(self, records):
+        # Batch write of a structured array with the dtype of the buffer (or a compatible one). Only the
+        # last `capacity` records fit, the ones before are overwritten at once but still counted, so readers
+        # see them as lost by overrun
+        total = len(records)
+        records = records[-self.capacity:]
+        n = len(records)
+        if n == 0:
+            return
+        skipped = total - n
+        start = (self.count + skipped) % self.capacity
+        first = min(n, self.capacity - start)
+        for offset in (0, self.capacity):
+            self._data[offset + start:offset + start + first] = records[:first]
+            self._data[offset:offset + n - first] = records[first:]
+        self.count += total
+
+    def clear(self):
+        self.count = 0
+        self.gaps = []
+
+    def mark_gap(self, start_epoch, end_epoch):
+        # Samples between the two epochs never arrived (a stalled or dropped connection)
+        self.gaps.append((int(start_epoch), int(end_epoch)))
+
+    # ---- reader side ----------------------------------------------------------------------------------
+    def window(self, n=None, end=None):
+        # View of the `n` samples written before `end` (a value of `count`), the latest ones by default
+        end = self.count if end is None else end
+        n = len(self) if n is None else n
+        n = max(0, min(n, self.capacity, end))
+        start = (end - n) % self.capacity
+        return self._data[start:start + n]
+
+    def read_since(self, cursor):
+        # Every sample written after `cursor`, returns (view, new cursor, samples lost by overrun)
+        end = self.count
+        start = max(cursor, end - self.capacity)
+        return self.window(end - start, end), end, start - cursor
+
+    def latest(self):
+        return self.window(1)[0] if self.count else None
+
+    def matrix(self, n=None, end=None, channels=None):
+        # (n, channels) float32 view of a window, e.g. the (100, 4) quaternion input of the LSTM
+        records = self.window(n, end)
+        return recfunctions.structured_to_unstructured(records[list(channels or self.channels)], copy=False)
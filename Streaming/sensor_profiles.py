@@ -0,0 +1,268 @@
+# Declarative sensor profiles of the boards and a planner of the BLE load they put on the adapter
+# A profile is the whole configuration of a board in one place: sensor fusion mode and outputs, ODR and
+# range of acc/gyro/mag, which signals go packed (3 samples per notification) and the connection
+# parameters. The scripts configure, subscribe, start and stop the boards through it instead of their own
+# copy of the libmetawear calls, so every script of a kind asks the board for the same thing.
+#
+# The planner estimates the notifications per second of every board and the radio time they take on the
+# adapter, and rejects the sessions that can not be sustained before any board is connected:
+#   - per board: one connection event every `max_ms` in the worst case (the central picks any interval
+#     between min and max), at most MAX_PACKETS_PER_EVENT notifications per event
+#   - per adapter: every link costs EVENT_US per connection event (one every `min_ms` in the worst case)
+#     and PACKET_US per notification (LE 1M, 27 byte PDU, empty packet of the central and the inter frame
+#     spaces included); the sum has to fit in ADAPTER_BUDGET of the radio time, and at most MAX_LINKS
+#     boards per adapter
+# These are estimates for a common USB dongle, not measurements of every adapter; loads above WARN_LOAD
+# of the budget are accepted with a warning.
+#
+#   python sensor_profiles.py                                  known profiles and their load per board
+#   python sensor_profiles.py fusion_quaternion --boards 6 [--adapters 2] [--interval 7.5,100]
+import argparse
+import sys
+from mbientlab.metawear import libmetawear
+from mbientlab.metawear.cbindings import *
+
+MAX_PACKETS_PER_EVENT = 4   # Notifications a board sends in one connection event
+EVENT_US = 500              # Radio time of a connection event without data (poll, response, guard)
+PACKET_US = 676             # Radio time of one notification and its acknowledgement
+ADAPTER_BUDGET = 0.7        # Share of the radio time the adapter can give to the links (scanning, WiFi coexistence)
+MAX_LINKS = 7               # Connections per adapter
+WARN_LOAD = 0.8             # Share of the budget above which a plan is accepted with a warning
+PACKED_SAMPLES = 3          # Samples per notification of the packed signals
+FUSION_HZ = {'NDOF': 100, 'IMU_PLUS': 100, 'COMPASS': 25, 'M4G': 50}  # Output rate of every fusion mode
+MAG_PRESET_HZ = {'LOW_POWER': 10, 'REGULAR': 10, 'ENHANCED_REGULAR': 10, 'HIGH_ACCURACY': 20}
+
+def _odr(enum, hz):
+    # 25 -> enum._25Hz, 12.5 -> enum._12_5Hz
+    return getattr(enum, f"_{hz:g}Hz".replace('.', '_'))
+
+class Connection:
+    def __init__(self, min_ms=7.5, max_ms=7.5, latency=0, timeout_ms=6000):
+        self.min_ms = min_ms
+        self.max_ms = max_ms
+        self.latency = latency
+        self.timeout_ms = timeout_ms
+
+    def apply(self, device):
+        # The board asks the central for these parameters, wait for the update before configuring the sensors
+        libmetawear.mbl_mw_settings_set_connection_parameters(device.board, self.min_ms, self.max_ms,
+                                                              self.latency, self.timeout_ms)
+
+    def __str__(self):
+        return f"interval {self.min_ms:g}-{self.max_ms:g} ms, latency {self.latency}, timeout {self.timeout_ms} ms"
+
+FAST = Connection(7.5, 7.5, 0, 6000)  # Fixed minimum interval, what streaming at 100 Hz needs
+
+class SensorProfile:
+    # fusion: {'mode': 'NDOF', 'acc_range': 8 (g), 'gyro_range': 2000 (dps), 'outputs': ('QUATERNION',)}
+    # acc: {'odr': Hz, 'range': g}, gyro: {'odr': Hz, 'range': dps}
+    # mag: {'preset': 'HIGH_ACCURACY'} and/or {'odr': Hz, 'xy_reps': 9, 'z_reps': 15}
+    # packed: sensors streamed with the packed signals, e.g. ('acc', 'gyro'); imu: 'bmi270' or 'bmi160'
+    def __init__(self, name, fusion=None, acc=None, gyro=None, mag=None, packed=(), connection=FAST, imu='bmi270'):
+        self.name = name
+        self.fusion = fusion
+        self.acc = acc
+        self.gyro = gyro
+        self.mag = mag
+        self.packed = tuple(packed)
+        self.connection = connection
+        self.imu = imu
+
+    # ---- what the board sends -------------------------------------------------------------------------
+    def streams(self):
+        # [(stream, Hz, samples per notification)], the stream names are the keys of subscribe()
+        streams = []
+        if self.fusion:
+            streams += [(output.lower(), FUSION_HZ[self.fusion['mode']], 1) for output in self.fusion['outputs']]
+        for sensor, config in (('acc', self.acc), ('gyro', self.gyro), ('mag', self.mag)):
+            if config:
+                hz = config['odr'] if 'odr' in config else MAG_PRESET_HZ[config['preset']]
+                streams.append((sensor, hz, PACKED_SAMPLES if sensor in self.packed else 1))
+        return streams
+
+    def rate(self, stream=None):
+        # Hz of one stream, of the first one by default
+        streams = self.streams()
+        return next(hz for name, hz, _ in streams if stream in (None, name))
+
+    def packets_per_s(self):
+        return sum(hz / per_packet for _, hz, per_packet in self.streams())
+
+    # ---- board setup ----------------------------------------------------------------------------------
+    def configure(self, device):
+        # Sensor configuration, without subscriptions (see apply() of the connection for the parameters)
+        board = device.board
+        if self.fusion:
+            libmetawear.mbl_mw_sensor_fusion_set_mode(board, getattr(SensorFusionMode, self.fusion['mode']))
+            libmetawear.mbl_mw_sensor_fusion_set_acc_range(board, getattr(SensorFusionAccRange, f"_{self.fusion['acc_range']}G"))
+            libmetawear.mbl_mw_sensor_fusion_set_gyro_range(board, getattr(SensorFusionGyroRange, f"_{self.fusion['gyro_range']}DPS"))
+            libmetawear.mbl_mw_sensor_fusion_write_config(board)
+        if self.gyro:
+            getattr(libmetawear, f"mbl_mw_gyro_{self.imu}_set_range")(board, getattr(GyroBoschRange, f"_{self.gyro['range']}dps"))
+            getattr(libmetawear, f"mbl_mw_gyro_{self.imu}_set_odr")(board, _odr(GyroBoschOdr, self.gyro['odr']))
+            getattr(libmetawear, f"mbl_mw_gyro_{self.imu}_write_config")(board)
+        if self.acc:
+            odr_enum = AccBmi270Odr if self.imu == 'bmi270' else AccBmi160Odr
+            getattr(libmetawear, f"mbl_mw_acc_{self.imu}_set_odr")(board, _odr(odr_enum, self.acc['odr']))
+            libmetawear.mbl_mw_acc_bosch_set_range(board, getattr(AccBoschRange, f"_{self.acc['range']}G"))
+            libmetawear.mbl_mw_acc_write_acceleration_config(board)
+        if self.mag:
+            if 'preset' in self.mag:
+                libmetawear.mbl_mw_mag_bmm150_set_preset(board, getattr(MagBmm150Preset, self.mag['preset']))
+            if 'odr' in self.mag:
+                libmetawear.mbl_mw_mag_bmm150_configure(board, self.mag.get('xy_reps', 9), self.mag.get('z_reps', 15),
+                                                        _odr(MagBmm150Odr, self.mag['odr']))
+
+    def signal(self, device, stream):
+        board = device.board
+        packed = 'packed_' if stream in self.packed else ''
+        if stream == 'acc':
+            return getattr(libmetawear, f"mbl_mw_acc_get_{packed}acceleration_data_signal")(board)
+        if stream == 'gyro':
+            return getattr(libmetawear, f"mbl_mw_gyro_{self.imu}_get_{packed}rotation_data_signal")(board)
+        if stream == 'mag':
+            return getattr(libmetawear, f"mbl_mw_mag_bmm150_get_{packed}b_field_data_signal")(board)
+        return libmetawear.mbl_mw_sensor_fusion_get_data_signal(board, getattr(SensorFusionData, stream.upper()))
+
+    def subscribe(self, device, callbacks):
+        # callbacks: {stream: FnVoid_VoidP_DataP}, or one callback for a profile with a single stream
+        if not isinstance(callbacks, dict):
+            callbacks = {self.streams()[0][0]: callbacks}
+        for stream, callback in callbacks.items():
+            libmetawear.mbl_mw_datasignal_subscribe(self.signal(device, stream), None, callback)
+
+    def start(self, device):
+        board = device.board
+        if self.fusion:
+            for output in self.fusion['outputs']:
+                libmetawear.mbl_mw_sensor_fusion_enable_data(board, getattr(SensorFusionData, output))
+            libmetawear.mbl_mw_sensor_fusion_start(board)
+        if self.gyro:
+            getattr(libmetawear, f"mbl_mw_gyro_{self.imu}_enable_rotation_sampling")(board)
+            getattr(libmetawear, f"mbl_mw_gyro_{self.imu}_start")(board)
+        if self.acc:
+            libmetawear.mbl_mw_acc_enable_acceleration_sampling(board)
+            libmetawear.mbl_mw_acc_start(board)
+        if self.mag:
+            libmetawear.mbl_mw_mag_bmm150_enable_b_field_sampling(board)
+            libmetawear.mbl_mw_mag_bmm150_start(board)
+
+    def stop(self, device):
+        # Stops the sensors and unsubscribes every stream
+        board = device.board
+        if self.fusion:
+            libmetawear.mbl_mw_sensor_fusion_stop(board)
+        if self.gyro:
+            getattr(libmetawear, f"mbl_mw_gyro_{self.imu}_stop")(board)
+            getattr(libmetawear, f"mbl_mw_gyro_{self.imu}_disable_rotation_sampling")(board)
+        if self.acc:
+            libmetawear.mbl_mw_acc_stop(board)
+            libmetawear.mbl_mw_acc_disable_acceleration_sampling(board)
+        if self.mag:
+            libmetawear.mbl_mw_mag_bmm150_stop(board)
+            libmetawear.mbl_mw_mag_bmm150_disable_b_field_sampling(board)
+        for stream, _, _ in self.streams():
+            libmetawear.mbl_mw_datasignal_unsubscribe(self.signal(device, stream))
+
+    def __str__(self):
+        streams = ', '.join(f"{name} {hz:g} Hz" + (" packed" if per_packet > 1 else '') for name, hz, per_packet in self.streams())
+        return f"{self.name}: {streams}; {self.connection}"
+
+PROFILES = {
+    # Sensor fusion for the LSTM and the GUIs (GUI_Final, NNModel, streaming_main)
+    'fusion_quaternion': SensorProfile('fusion_quaternion', fusion={'mode': 'NDOF', 'acc_range': 8, 'gyro_range': 2000,
+                                                                    'outputs': ('QUATERNION',)}),
+    'fusion_euler': SensorProfile('fusion_euler', fusion={'mode': 'NDOF', 'acc_range': 8, 'gyro_range': 2000,
+                                                          'outputs': ('EULER_ANGLE',)}),
+    # Raw acc/gyro/mag saved by stream_data_and_save
+    'imu_packed': SensorProfile('imu_packed', acc={'odr': 25, 'range': 4}, gyro={'odr': 25, 'range': 1000},
+                                mag={'preset': 'HIGH_ACCURACY', 'odr': 25, 'xy_reps': 9, 'z_reps': 15},
+                                packed=('acc', 'gyro')),
+}
+
+def link_us(profile):
+    # Radio time per second one board of this profile takes on its adapter, in us
+    return 1000.0 / profile.connection.min_ms * EVENT_US + profile.packets_per_s() * PACKET_US
+
+def per_adapter(profile):
+    # Boards of this profile one adapter can sustain
+    if profile.packets_per_s() > MAX_PACKETS_PER_EVENT * 1000.0 / profile.connection.max_ms:
+        return 0
+    return min(MAX_LINKS, int(ADAPTER_BUDGET * 1e6 // link_us(profile)))
+
+class Plan:
+    # Load of a session: profiles of the boards spread round-robin over the adapters
+    def __init__(self, profiles, adapters=1):
+        self.profiles = list(profiles)
+        self.adapters = [self.profiles[i::adapters] for i in range(adapters)]
+        self.problems = []
+        self.warnings = []
+        self.boards = []  # (profile, boards with it, packets/s, capacity in packets/s) per profile
+        for profile in dict.fromkeys(self.profiles):
+            capacity = MAX_PACKETS_PER_EVENT * 1000.0 / profile.connection.max_ms
+            self.boards.append((profile, self.profiles.count(profile), profile.packets_per_s(), capacity))
+        for profile, _, packets, capacity in self.boards:
+            if packets > capacity:
+                self.problems.append(f"{profile.name}: {packets:.0f} notifications/s, the link carries {capacity:.0f}/s "
+                                     f"with connection events every {profile.connection.max_ms:g} ms")
+        self.loads = []  # Share of ADAPTER_BUDGET used by every adapter
+        for k, boards in enumerate(self.adapters):
+            us = sum(link_us(profile) for profile in boards)
+            load = us / 1e6 / ADAPTER_BUDGET
+            self.loads.append(load)
+            if len(boards) > MAX_LINKS:
+                self.problems.append(f"adapter {k}: {len(boards)} boards, at most {MAX_LINKS} connections")
+            if load > 1:
+                self.problems.append(f"adapter {k}: {len(boards)} boards need {load * 100:.0f}% of the radio time "
+                                     f"available")
+            elif load > WARN_LOAD:
+                self.warnings.append(f"adapter {k}: {load * 100:.0f}% of the radio time available, little margin "
+                                     f"for retransmissions")
+
+    @property
+    def ok(self):
+        return not self.problems
+
+    def __str__(self):
+        lines = [f"{count} x {profile.name}: {packets:.0f} notifications/s per board, the link carries {capacity:.0f}/s"
+                 for profile, count, packets, capacity in self.boards]
+        lines += [f"adapter {k}: {len(boards)} boards, {load * 100:.0f}% of the radio time available"
+                  for k, (boards, load) in enumerate(zip(self.adapters, self.loads))]
+        lines += [f"WARNING {warning}" for warning in self.warnings]
+        lines += [f"REJECTED {problem}" for problem in self.problems]
+        return '\n'.join(lines)
+
+def check(profile, boards, adapters=1):
+    # Plan of `boards` boards with the same profile, ValueError if the session can not be sustained
+    plan = Plan([profile] * boards, adapters)
+    for warning in plan.warnings:
+        print(f"{profile.name}: {warning}")
+    if not plan.ok:
+        raise ValueError(f"{boards} x {profile.name} not sustainable ({per_adapter(profile)} per adapter): "
+                         + '; '.join(plan.problems))
+    return plan
+
+def main():
+    parser = argparse.ArgumentParser(description="BLE load of a session with the sensor profiles")
+    parser.add_argument('profile', nargs='?', choices=sorted(PROFILES))
+    parser.add_argument('--boards', type=int, default=1)
+    parser.add_argument('--adapters', type=int, default=1)
+    parser.add_argument('--interval', default=None, metavar='MIN,MAX', help="connection interval in ms instead of the profile's")
+    args = parser.parse_args()
+
+    if args.profile is None:
+        for profile in PROFILES.values():
+            print(f"{profile}\n  {profile.packets_per_s():.0f} notifications/s, {per_adapter(profile)} boards per adapter")
+        return
+    profile = PROFILES[args.profile]
+    if args.interval:
+        min_ms, max_ms = (float(value) for value in args.interval.split(','))
+        profile = SensorProfile(profile.name, profile.fusion, profile.acc, profile.gyro, profile.mag, profile.packed,
+                                Connection(min_ms, max_ms), profile.imu)
+    print(profile)
+    plan = Plan([profile] * args.boards, args.adapters)
+    print(plan)
+    sys.exit(0 if plan.ok else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+# Concurrent bring-up of the boards of a session: every MAC is connected and configured at the same time
+# One thread per board, at most `parallel` of them inside connect/configure at once (BLE adapters only
+# handle a few connection attempts in parallel). `setup(index, device)` is the configuration of one board
+# (connection parameters, sensors, subscriptions) and runs in the thread of that board right after it
+# connects, so the fixed waits of the configuration (sleep after the connection parameters...) overlap
+# instead of adding up: the bring-up takes about as long as the slowest board, not the sum of all of them.
+#
+# Every board has `timeout` seconds from the moment it gets its slot. A board that misses it is reported
+# as failed right away, but its slot only goes to the next board when its thread leaves connect/configure
+# (never more than `parallel` attempts on the adapter); if it still connects it is disconnected again.
+# The boards are connected through the DeviceRegistry (device_registry.py), warm with their saved state.
+# The report has, per board, the wait for a slot, the connection (cold or warm) and the configuration times.
+#
+#   python session_bringup.py MAC1 MAC2 ... [--parallel 4] [--timeout 20]   connection test
+import argparse
+import threading
+import time
+from mbientlab.metawear import libmetawear
+from device_registry import DeviceRegistry
+from sensor_profiles import FAST
+
+MAX_PARALLEL = 4
+DEVICE_TIMEOUT = 20.0  # s, connection and configuration of one board
+
+class BringUp:
+    # Outcome of one board; times in seconds
+    def __init__(self, index, address):
+        self.index = index
+        self.address = address
+        self.device = None
+        self.value = None  # What setup() returned, e.g. the State of the board
+        self.error = None
+        self.wait = self.connect = self.configure = 0.0
+        self.kind = None  # 'cold' or 'warm' connection
+        self.began = None
+        self.finished = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def ok(self):
+        return self.error is None and self.device is not None
+
+    def finish(self, error=None):
+        # Called by the board thread or by the timeout, only the first call counts
+        with self._lock:
+            if self.finished.is_set():
+                return False
+            self.error = error
+            self.finished.set()
+        return True
+
+    def __str__(self):
+        status = "ok" if self.ok else f"FAILED ({self.error})"
+        return (f"{self.address}: wait {self.wait * 1000:.0f} ms, connect {self.connect * 1000:.0f} ms "
+                f"({self.kind}), configure {self.configure * 1000:.0f} ms -> {status}")
+
+def _bring_up(result, setup, slots, started, registry):
+    slots.acquire()
+    try:
+        result.began = time.perf_counter()
+        result.wait = result.began - started
+        device = None
+        try:
+            device = registry.connect(result.address)
+            result.kind = registry.last_connect(device.address)['kind']
+            result.connect = time.perf_counter() - result.began
+            if setup is not None and not result.finished.is_set():
+                result.value = setup(result.index, device)
+            result.configure = time.perf_counter() - result.began - result.connect
+            result.device = device
+            if result.finish():
+                return
+        except Exception as e:
+            if result.finish(e):
+                return
+        # Given up on by the timeout: the board must not stay connected in the background
+        result.device = None
+        if device is not None and device.is_connected:
+            libmetawear.mbl_mw_debug_disconnect(device.board)
+    finally:
+        slots.release()  # Only now the adapter has one attempt less in flight
+
+def bring_up(addresses, setup=None, parallel=MAX_PARALLEL, timeout=DEVICE_TIMEOUT, registry=None):
+    # Returns ([BringUp] in the order of `addresses`, seconds of the whole bring-up)
+    registry = registry or DeviceRegistry()
+    started = time.perf_counter()
+    slots = threading.Semaphore(max(1, parallel))
+    results = [BringUp(i, address) for i, address in enumerate(addresses)]
+    for result in results:
+        threading.Thread(target=_bring_up, args=(result, setup, slots, started, registry),
+                         name=f"bringup-{result.address}", daemon=True).start()
+    pending = list(results)
+    while pending:
+        pending[0].finished.wait(0.05)
+        now = time.perf_counter()
+        for result in pending:
+            if result.began is not None and now - result.began > timeout:
+                result.finish(TimeoutError(f"no connection in {timeout:.0f} s"))
+        pending = [result for result in pending if not result.finished.is_set()]
+    return results, time.perf_counter() - started
+
+def report(results, seconds):
+    lines = [str(result) for result in results]
+    total = sum(result.connect + result.configure for result in results)
+    lines.append(f"{sum(result.ok for result in results)}/{len(results)} boards up in {seconds:.2f} s "
+                 f"(one after another: {total:.2f} s)")
+    return '\n'.join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Connect to the boards in parallel and report the timing")
+    parser.add_argument('addresses', nargs='+', metavar='MAC')
+    parser.add_argument('--parallel', type=int, default=MAX_PARALLEL)
+    parser.add_argument('--timeout', type=float, default=DEVICE_TIMEOUT)
+    args = parser.parse_args()
+
+    def setup(index, device):
+        FAST.apply(device)
+        time.sleep(1.5)
+
+    results, seconds = bring_up(args.addresses, setup, args.parallel, args.timeout)
+    print(report(results, seconds))
+    for result in results:
+        if result.ok:
+            libmetawear.mbl_mw_debug_disconnect(result.device.board)
+
+if __name__ == '__main__':
+    main()
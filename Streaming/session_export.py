@@ -0,0 +1,170 @@
+# Export of a capture session in the background, off the Qt thread
+# At Stop the GUI hands the ring buffers of the session to a SessionExport and puts new, empty buffers in
+# their place, so the next capture can start right away while the job decimates the session to the export
+# rate, aligns the sensors on the board epoch (synchronizer.align) and writes it. Rows are written in
+# chunks of `chunk` straight from the record arrays (no DataFrame of the whole session) and `progress`
+# is emitted after every chunk with (rows written, total rows).
+# The export only has what is still in the ring buffers: a session longer than their capacity loses its
+# start. The samples each sensor lost that way are reported with the result (`done` of SessionExport) so
+# the GUI can say that the file is truncated; the buffers are sized for the longest expected session.
+#
+# Target by extension, one sheet (file, folder) per sensor named after its MAC with ':' -> '_':
+#   sensor_data.xlsx   one worksheet per sensor, xlsxwriter in constant_memory mode (rows go to disk as
+#                      they are written)
+#   sensor_data.csv    sensor_data_<sheet>.csv, one file per sensor
+#   sensor_data        columnar, sensor_data/<sheet>/<column>.npy (np.load(..., mmap_mode='r'))
+# Everything is written next to the target under a .part name and renamed at the end, an export that
+# fails never leaves a half written file in place of the previous one.
+import csv
+import os
+import shutil
+import time
+import numpy as np
+from PyQt5.QtCore import QThread, pyqtSignal
+from resampler import Decimator
+from synchronizer import align
+
+CHUNK_ROWS = 5000
+
+def session_sheets(buffers, rate, tolerance_ms):
+    # {mac: SampleRingBuffer} -> ([(sheet name, records)] decimated to `rate` and aligned across sensors,
+    # {mac: samples overwritten in the ring buffer before the export} of the sensors that lost any)
+    macs = list(buffers)
+    decimators = [Decimator(buffers[mac], rate) for mac in macs]
+    exports = [decimator.flush() for decimator in decimators]
+    exports = align(exports, tolerance_ms) if exports else []  # Same board epochs in every sheet
+    dropped = {mac: decimator.dropped for mac, decimator in zip(macs, decimators) if decimator.dropped}
+    return [(mac.replace(':', '_'), records) for mac, records in zip(macs, exports) if len(records)], dropped
+
+def _chunks(records, chunk):
+    for start in range(0, len(records), chunk):
+        yield records[start:start + chunk]
+
+def write_xlsx(path, sheets, chunk, progress):
+    import xlsxwriter
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+    try:
+        for name, records in sheets:
+            worksheet = workbook.add_worksheet(name)
+            worksheet.write_row(0, 0, records.dtype.names)
+            row = 1
+            for part in _chunks(records, chunk):
+                for values in part.tolist():
+                    worksheet.write_row(row, 0, values)
+                    row += 1
+                progress(len(part))
+    finally:
+        workbook.close()
+
+def write_csv(path, sheets, chunk, progress):
+    # `path` is a folder here, export_session renames the files next to the target
+    os.makedirs(path, exist_ok=True)
+    for name, records in sheets:
+        with open(os.path.join(path, f"{name}.csv"), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(records.dtype.names)
+            for part in _chunks(records, chunk):
+                writer.writerows(part.tolist())
+                progress(len(part))
+
+def write_columns(path, sheets, chunk, progress):
+    for name, records in sheets:
+        os.makedirs(os.path.join(path, name), exist_ok=True)
+        columns = {field: np.lib.format.open_memmap(os.path.join(path, name, f"{field}.npy"), mode='w+',
+                                                    dtype=records.dtype[field], shape=(len(records),))
+                   for field in records.dtype.names}
+        start = 0
+        for part in _chunks(records, chunk):
+            for field, column in columns.items():
+                column[start:start + len(part)] = part[field]
+            start += len(part)
+            progress(len(part))
+        for column in columns.values():
+            column.flush()
+        del columns
+
+WRITERS = {'.xlsx': write_xlsx, '.csv': write_csv, '': write_columns}
+
+def export_session(path, sheets, chunk=CHUNK_ROWS, progress=None):
+    # Writes [(sheet name, records)] to `path`, returns the paths written
+    stem, ext = os.path.splitext(path)
+    if ext not in WRITERS:
+        raise ValueError(f"Unknown export format: {path} (xlsx, csv or a folder for .npy columns)")
+    total = sum(len(records) for _, records in sheets)
+    done = 0
+
+    def advance(rows):
+        nonlocal done
+        done += rows
+        if progress is not None:
+            progress(done, total)
+
+    part = f"{stem}.part{ext}"
+    if os.path.isdir(part):
+        shutil.rmtree(part)
+    WRITERS[ext](part, sheets, chunk, advance)
+    if ext == '.csv':
+        written = []
+        for name, _ in sheets:
+            target = f"{stem}_{name}.csv"
+            os.replace(os.path.join(part, f"{name}.csv"), target)
+            written.append(target)
+        os.rmdir(part)
+        return written
+    if not os.path.exists(part):
+        return []  # Nothing recorded
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.replace(part, path)
+    return [path]
+
+class SessionExport(QThread):
+    progress = pyqtSignal(int, int)       # Rows written, total rows
+    done = pyqtSignal(list, float, dict)  # Paths written, seconds, {mac: samples lost before the export}
+    failed = pyqtSignal(str)
+
+    def __init__(self, buffers, path, rate, tolerance_ms, chunk=CHUNK_ROWS, parent=None):
+        super().__init__(parent)
+        self.buffers = buffers
+        self.path = path
+        self.rate = rate
+        self.tolerance_ms = tolerance_ms
+        self.chunk = chunk
+
+    def run(self):
+        start = time.perf_counter()
+        try:
+            sheets, dropped = session_sheets(self.buffers, self.rate, self.tolerance_ms)
+            written = export_session(self.path, sheets, self.chunk, self.progress.emit)
+        except Exception as e:
+            self.failed.emit(str(e))
+        else:
+            self.done.emit(written, time.perf_counter() - start, dropped)
+        finally:
+            self.buffers = None  # The buffers of the session can be freed now
+
+class ExportQueue:
+    # Runs the exports one after the other (two Stops in a row write the same target in order)
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, job):
+        job.finished.connect(self._next)
+        self.jobs.append(job)
+        if len(self.jobs) == 1:
+            job.start()
+
+    def _next(self):
+        self.jobs = [job for job in self.jobs if not job.isFinished()]
+        if self.jobs and not self.jobs[0].isRunning():
+            self.jobs[0].start()
+
+    def busy(self):
+        return bool(self.jobs)
+
+    def wait(self):
+        # Before the application quits: a QThread must not be destroyed while it runs
+        for job in list(self.jobs):
+            if not job.isRunning() and not job.isFinished():
+                job.start()
+            job.wait()
@@ -1,158 +1,173 @@
 # Stream data of sensors for amount of samples be nearest and save it in a workbook
 # Stream of acceleration, gyroscope and magnetometer in the three axis x, y, and z
+# The samples of each sensor go to its own ring buffer and are joined on the board epoch by a StreamJoiner
+# (stream_joiner.py): one row per acc/gyro sample (25 Hz) with the last magnetometer sample held, instead of
+# one row each time the three sensors happened to have a value (the acc/gyro samples in between were lost)
 # Workbook structure:
 # sample_count' 'sensor_index' 'epoch' 'gyro_x' 'gyro_y' 'gyro_z' 'accel_x' 'accel_y' 'accel_z' 'mag_x' 'mag_y' 'mag_z'
+# The rows go through a queue to a BatchWriter thread (batch_writer.py) that writes them in batches, to a CSV
+# file or, with OUTPUT_FILE ending in .mmrec, to a binary recording (recorder.py)
+# With HOST_FUSION the orientation of every board is fused on the host from these rows (host_fusion.py), one
+# vectorized step over all the boards per sample, and written as 4 more columns 'quat_w' 'quat_x' 'quat_y' 'quat_z'
+# Every board runs under a Supervisor (supervisor.py) during the capture: a stalled stream or a dropped link
+# is recovered (reattached, sensors configured and started again) and the gap is marked in its buffers and,
+# with a .mmrec output, as gap records of the recording (Recorder.mark_gap)
 from __future__ import print_function
-from mbientlab.metawear import MetaWear, libmetawear, parse_value
+from mbientlab.metawear import MetaWear, libmetawear
 from mbientlab.metawear.cbindings import *
-from time import sleep
-from threading import Thread, Event, Lock
-import csv
+from time import sleep, perf_counter
+from threading import Thread
 import platform
 import sys
-from queue import Queue
+import numpy as np
+from batch_writer import BatchWriter, CsvSink, RecorderSink
+from device_registry import DeviceRegistry
+from fast_decoder import FastDecoder
+from host_fusion import FILTERS, fuse_batches
+from recorder import Recorder
+from ring_buffer import SampleRingBuffer, CARTESIAN_CHANNELS
+from sensor_profiles import PROFILES, check
+from session_bringup import bring_up, report
+from stream_joiner import StreamJoiner
+from supervisor import Supervisor
 
 if sys.version_info[0] == 2:
     range = xrange
 
+OUTPUT_FILE = 'sensor_data.csv'  # 'sensor_data.mmrec' para grabación binaria
+STREAM_SECONDS = 10.0
+JOIN_PERIOD = 0.1  # s between two batches of joined rows
+JOIN_MODE = 'hold'  # 'linear' interpolates the magnetometer between its samples
+PROFILE = PROFILES['imu_packed']  # acc/gyro packed at 25 Hz, mag at 25 Hz, see sensor_profiles.py
+BUFFER_CAPACITY = 800 * 60  # Samples per sensor, more than a whole capture at the highest ODR
+HOST_FUSION = None  # 'madgwick' or 'mahony': orientation fused on the host from the joined rows
+FIELDNAMES = ['sample_count', 'sensor_index', 'epoch', 'gyro_x', 'gyro_y', 'gyro_z',
+              'accel_x', 'accel_y', 'accel_z', 'mag_x', 'mag_y', 'mag_z']
+if HOST_FUSION:
+    FIELDNAMES += ['quat_w', 'quat_x', 'quat_y', 'quat_z']
+
 class State:
     def __init__(self, device, index):
         self.device = device
         self.samples = 0
         self.index = index
-        self.gyro_data = None
-        self.acc_data = None
-        self.mag_data = None
+        # Columns in the order of FIELDNAMES, the callbacks only store the samples
+        self.buffers = {sensor: SampleRingBuffer(CARTESIAN_CHANNELS, BUFFER_CAPACITY) for sensor in ('gyro', 'accel', 'mag')}
+        self.decoders = {sensor: FastDecoder(buffer, DataTypeId.CARTESIAN_FLOAT) for sensor, buffer in self.buffers.items()}
+        self.joiner = StreamJoiner(self.buffers, mode=JOIN_MODE)
         self.callbacks = {
-            'gyro': FnVoid_VoidP_DataP(self.gyro_data_handler),
-            'acc': FnVoid_VoidP_DataP(self.acc_data_handler),
-            'mag': FnVoid_VoidP_DataP(self.mag_data_handler)
+            'gyro': FnVoid_VoidP_DataP(lambda ctx, data: self.decoders['gyro'].decode(data)),
+            'acc': FnVoid_VoidP_DataP(lambda ctx, data: self.decoders['accel'].decode(data)),
+            'mag': FnVoid_VoidP_DataP(lambda ctx, data: self.decoders['mag'].decode(data))
         }
-                
-    def gyro_data_handler(self, ctx, data):
-        values = parse_value(data)
-        self.gyro_data = [data.contents.epoch, values.x, values.y, values.z]
-        self.check_and_write_data()
-
-    def acc_data_handler(self, ctx, data):
-        values = parse_value(data)
-        self.acc_data = [data.contents.epoch, values.x, values.y, values.z]
-        self.check_and_write_data()
-
-    def mag_data_handler(self, ctx, data):
-        values = parse_value(data)
-        self.mag_data = [data.contents.epoch, values.x, values.y, values.z]
-        self.check_and_write_data()
-
-    def check_and_write_data(self):
-        if self.gyro_data and self.acc_data and self.mag_data:
-            with lock:
-                row = [self.samples, self.index] + self.gyro_data + self.acc_data[1:] + self.mag_data[1:]
-                data_queue.put(row)
-                self.samples += 1
-            self.gyro_data = None
-            self.acc_data = None
-            self.mag_data = None
-
-def writer_thread_function():
-    with open('sensor_data.csv', 'w', newline='') as csvfile:
-        writer = csv.writer(csvfile)
-        fieldnames = ['sample_count', 'sensor_index', 'epoch', 'gyro_x', 'gyro_y', 'gyro_z',
-                      'accel_x', 'accel_y', 'accel_z', 'mag_x', 'mag_y', 'mag_z']
-        writer.writerow(fieldnames)
-
-        while not stop_event.is_set() or not data_queue.empty():
-            if not data_queue.empty():
-                row = data_queue.get()
-                with lock:
-                    writer.writerow(row)
-                data_queue.task_done()
-
-def configure_sensors(states):
-    for s in states:
-        print("Configuring device")
-        libmetawear.mbl_mw_settings_set_connection_parameters(s.device.board, 7.5, 7.5, 0, 6000)
-        sleep(2)
-
-        print("Configuring gyro and acc")  # Updated message
-        libmetawear.mbl_mw_gyro_bmi270_set_range(s.device.board, GyroBoschRange._1000dps)
-        libmetawear.mbl_mw_gyro_bmi270_set_odr(s.device.board, GyroBoschOdr._25Hz)
-        libmetawear.mbl_mw_gyro_bmi270_write_config(s.device.board)
-        libmetawear.mbl_mw_acc_bmi270_set_odr(s.device.board, AccBmi270Odr._25Hz)
-        libmetawear.mbl_mw_acc_bosch_set_range(s.device.board, AccBoschRange._4G)
-        libmetawear.mbl_mw_acc_write_acceleration_config(s.device.board)
-        libmetawear.mbl_mw_mag_bmm150_set_preset(s.device.board, MagBmm150Preset.HIGH_ACCURACY)
-        libmetawear.mbl_mw_mag_bmm150_configure(s.device.board, 9, 15, 6)
-        libmetawear.mbl_mw_mag_bmm150_enable_b_field_sampling(s.device.board)
-        sleep(1)
 
-        print("Packed signal")
-        gyro = libmetawear.mbl_mw_gyro_bmi270_get_packed_rotation_data_signal(s.device.board)
-        acc = libmetawear.mbl_mw_acc_get_packed_acceleration_data_signal(s.device.board)
-        mag = libmetawear.mbl_mw_mag_bmm150_get_b_field_data_signal(s.device.board)
-
-        libmetawear.mbl_mw_datasignal_subscribe(gyro, None, s.callbacks['gyro'])
-        libmetawear.mbl_mw_datasignal_subscribe(acc, None, s.callbacks['acc'])
-        libmetawear.mbl_mw_datasignal_subscribe(mag, None, s.callbacks['mag'])
-        sleep(1)
+    def write_rows(self, epochs, rows):
+        # Rows joined since the last call to the writer thread
+        for epoch, values in zip(epochs.tolist(), rows.tolist()):
+            writer.put([self.samples, self.index, epoch] + values)
+            self.samples += 1
+
+def write_rows(states, flush=False):
+    batches = [s.joiner.read(flush) for s in states]
+    if fusion is not None:
+        # One step over every board per sample, the boards with fewer rows in this batch are padded
+        fused = fuse_batches(fusion, batches, FIELDNAMES[3:12])
+        batches = [(epochs, np.hstack([rows, q])) for (epochs, rows), (_, q) in zip(batches, fused)]
+    for s, (epochs, rows) in zip(states, batches):
+        s.write_rows(epochs, rows)
+
+def open_sink(path, addresses):
+    if path.endswith('.mmrec'):
+        # sample_count is not stored, it is the order of the records of each sensor
+        recorder = Recorder(path, addresses, FIELDNAMES[3:], metadata={'script': 'stream_data_and_save'})
+        return RecorderSink(recorder, sensor_column=1, epoch_column=2, value_columns=range(3, len(FIELDNAMES)))
+    return CsvSink(path, FIELDNAMES)
+
+def configure_sensor(s):
+    # Runs in the bring-up thread of the board (session_bringup.py), the boards are configured in parallel
+    print("Configuring device " + s.device.address)
+    PROFILE.connection.apply(s.device)
+    sleep(2)
+
+    print("Configuring gyro, acc and mag: " + str(PROFILE))
+    PROFILE.configure(s.device)
+    sleep(1)
+
+    PROFILE.subscribe(s.device, s.callbacks)
+    sleep(1)
 
 def start_streaming(states):
     for s in states:
         print("Start")
-        libmetawear.mbl_mw_gyro_bmi270_enable_rotation_sampling(s.device.board)
-        libmetawear.mbl_mw_gyro_bmi270_start(s.device.board)
-        libmetawear.mbl_mw_acc_enable_acceleration_sampling(s.device.board)
-        libmetawear.mbl_mw_acc_start(s.device.board)
-        libmetawear.mbl_mw_mag_bmm150_enable_b_field_sampling(s.device.board)
-        libmetawear.mbl_mw_mag_bmm150_start(s.device.board)
+        PROFILE.start(s.device)
         sleep(1)
 
 def stop_and_disconnect(states):
     for s in states:
-        libmetawear.mbl_mw_gyro_bmi270_stop(s.device.board)
-        libmetawear.mbl_mw_gyro_bmi270_disable_rotation_sampling(s.device.board)
-        libmetawear.mbl_mw_acc_stop(s.device.board)
-        libmetawear.mbl_mw_acc_disable_acceleration_sampling(s.device.board)
-        libmetawear.mbl_mw_mag_bmm150_stop(s.device.board)
-        libmetawear.mbl_mw_mag_bmm150_disable_b_field_sampling(s.device.board)
+        PROFILE.stop(s.device)
         sleep(1)
 
-        gyro = libmetawear.mbl_mw_gyro_bmi270_get_packed_rotation_data_signal(s.device.board)
-        acc = libmetawear.mbl_mw_acc_get_packed_acceleration_data_signal(s.device.board)
-        mag = libmetawear.mbl_mw_mag_bmm150_get_b_field_data_signal(s.device.board)
-
-        libmetawear.mbl_mw_datasignal_unsubscribe(gyro)
-        libmetawear.mbl_mw_datasignal_unsubscribe(acc)
-        libmetawear.mbl_mw_datasignal_unsubscribe(mag)
-
         libmetawear.mbl_mw_debug_disconnect(s.device.board)
         sleep(1)
 
-stop_event = Event()
-lock = Lock()
-data_queue = Queue()
-
-states = []
-
-writer_thread = Thread(target=writer_thread_function)
-writer_thread.start()
-
-for i in range(len(sys.argv) - 1):
-    d = MetaWear(sys.argv[i + 1])
-    d.connect()
-    print("Connected to " + d.address + " over " + ("USB" if d.usb.is_connected else "BLE"))
-    states.append(State(d, i))
+def rearm(s):
+    # After a dropout (the supervisor reattached the board if the link was down)
+    PROFILE.stop(s.device)
+    configure_sensor(s)
+    PROFILE.start(s.device)
+
+def supervise(s, on_gap):
+    # Capture thread of one board: recovers its stream until the end of the capture, the gyro buffer is the
+    # one watched (all the streams of the board stop together)
+    s.supervisor = Supervisor(s.device, s.buffers['gyro'], lambda: rearm(s), PROFILE.rate('gyro'), registry,
+                              on_gap=on_gap, sensor=s.index)
+    s.supervisor.watch(lambda: perf_counter() < end)
+
+def setup(index, device):
+    print("Connected to " + device.address + " over " + ("USB" if device.usb.is_connected else "BLE"))
+    state = State(device, index)
+    configure_sensor(state)
+    return state
+
+addresses = sys.argv[1:]
+try:
+    print(check(PROFILE, len(addresses)))
+except ValueError as e:
+    sys.exit(str(e))
+registry = DeviceRegistry()
+results, seconds = bring_up(addresses, setup, registry=registry)
+print(report(results, seconds))
+states = [result.value for result in results if result.ok]
+if not states:
+    sys.exit("No sensor connected")
+
+# The index of a sensor is its position in the command line, also for the ones that did not connect
+sink = open_sink(OUTPUT_FILE, [address.upper() for address in addresses])
+writer = BatchWriter(sink)
+writer.start()
+fusion = FILTERS[HOST_FUSION](len(states)) if HOST_FUSION else None
 
-configure_sensors(states)
 start_streaming(states)
 
-sleep(10.0)
+end = perf_counter() + STREAM_SECONDS
+on_gap = sink.recorder.mark_gap if isinstance(sink, RecorderSink) else None
+supervisors = [Thread(target=supervise, args=(s, on_gap), name=f"supervisor-{s.device.address}") for s in states]
+for thread in supervisors:
+    thread.start()
+while perf_counter() < end:
+    sleep(JOIN_PERIOD)
+    write_rows(states)
+for thread in supervisors:
+    thread.join()
 
 stop_and_disconnect(states)
+write_rows(states, flush=True)
 
-stop_event.set()
-writer_thread.join()
+writer.stop()
+sink.close()
 
 print("Total Samples Received")
 for s in states:
     print("%s -> %d" % (s.device.address, s.samples))
+    print("  " + s.joiner.report())
+    print("  " + s.supervisor.report())
@@ -0,0 +1,179 @@
+# Multi-rate join of the streams of one board (acc, gyro, mag...) on the board epoch
+# One row per sample of the fastest stream (the reference): the other streams are joined with the last
+# sample they delivered at or before that epoch (sample-and-hold, mode='hold') or with the value
+# interpolated between the samples around it (mode='linear'). A sample up to `tolerance_ms` after the
+# reference epoch counts as taken at the same time (acc and gyro at the same ODR arrive a few ms apart).
+# A slow magnetometer no longer throws away the acc/gyro samples that arrive between two of its samples,
+# they are all emitted with the mag held.
+# Rows come out as one contiguous float32 row per sample with the channels of every stream concatenated
+# in the order of `buffers`, e.g. [gyro x y z, accel x y z, mag x y z].
+#
+# Works in batches over the ring buffers like EpochSynchronizer (synchronizer.py): a reference sample is
+# decided when every other stream has delivered a sample after epoch + tolerance (nothing that could
+# still be joined with it can arrive anymore), or when it is more than `max_wait_ms` behind the newest
+# sample of any stream (a stalled stream is held, it does not block the others). Without `reference` the
+# fastest stream is picked from the epochs of the first RATE_WINDOW samples.
+#
+# Counters per stream: rows that got a new sample of it (joined), rows that repeated the previous one
+# (held), rows interpolated, and samples that never made it into a row (skipped, the stream delivered
+# two samples between two reference samples). Reference samples before the first sample of some stream
+# are dropped (unmatched), there is nothing to hold yet.
+import numpy as np
+from numpy.lib import recfunctions
+from ring_buffer import SampleRingBuffer
+
+RATE_WINDOW = 8  # Samples of the first stream that reaches it before the reference is picked
+MODES = ('hold', 'linear')
+
+class StreamJoiner:
+    def __init__(self, buffers, reference=None, mode='hold', tolerance_ms=5, max_wait_ms=100, capacity=None):
+        # buffers: {name: SampleRingBuffer}, the name prefixes the columns of the rows ('gyro_x', ...)
+        if mode not in MODES:
+            raise ValueError(f"Unknown join mode: {mode} ({', '.join(MODES)})")
+        self.names = list(buffers)
+        self.buffers = list(buffers.values())
+        self.columns = [f"{name}_{channel}" for name, buffer in buffers.items() for channel in buffer.channels]
+        self.reference = self.names.index(reference) if isinstance(reference, str) else reference
+        self.mode = mode
+        self.tolerance_ms = tolerance_ms
+        self.max_wait_ms = max_wait_ms
+        self.cursors = [0] * len(self.buffers)
+        self.pending = [np.empty(0, dtype=buffer.dtype) for buffer in self.buffers]
+        self.base = [0] * len(self.buffers)  # Number of pending[k][0] among the samples read from stream k
+        self.last_epoch = [None] * len(self.buffers)
+        self.first_epoch = [None] * len(self.buffers)
+        self.received = [0] * len(self.buffers)
+        self.last_used = [-1] * len(self.buffers)  # Number of the last sample of each stream put in a row
+        # Optional ring buffer of the joined rows
+        self.output = SampleRingBuffer(self.columns, capacity) if capacity else None
+        self.rows = 0
+        self.joined = [0] * len(self.buffers)
+        self.held = [0] * len(self.buffers)
+        self.interpolated = [0] * len(self.buffers)
+        self.unmatched = 0  # Reference samples dropped, some stream had no sample yet
+        self.dropped = 0    # Samples overwritten in the ring buffers before they were read
+
+    def _pull(self):
+        for k, buffer in enumerate(self.buffers):
+            new, self.cursors[k], lost = buffer.read_since(self.cursors[k])
+            self.dropped += lost
+            if len(new):
+                self.pending[k] = np.concatenate([self.pending[k], new])
+                if self.first_epoch[k] is None:
+                    self.first_epoch[k] = int(new['epoch'][0])
+                self.last_epoch[k] = int(new['epoch'][-1])
+                self.received[k] += len(new)
+
+    def _pick_reference(self):
+        # Fastest stream: shortest mean period over the samples read so far
+        if self.reference is None and max(len(pending) for pending in self.pending) >= RATE_WINDOW:
+            periods = [(pending['epoch'][-1] - pending['epoch'][0]) / (len(pending) - 1) if len(pending) > 1
+                       else np.inf for pending in self.pending]
+            self.reference = int(np.argmin(periods))
+        return self.reference is not None
+
+    def _decided(self, flush):
+        # Reference epochs up to this value have every stream decided
+        if flush:
+            return np.iinfo(np.int64).max
+        seen = [epoch for epoch in self.last_epoch if epoch is not None]
+        if not seen:
+            return None
+        horizon = max(seen) - self.max_wait_ms
+        if len(seen) < len(self.last_epoch):
+            return horizon
+        others = [epoch for k, epoch in enumerate(self.last_epoch) if k != self.reference]
+        return max(horizon, min(others) - self.tolerance_ms) if others else max(seen)
+
+    def rates(self):
+        # Hz of every stream estimated from the epochs of the samples read so far
+        return {name: 1000.0 * (received - 1) / max(1, last - first) if received > 1 else 0.0
+                for name, received, first, last in zip(self.names, self.received, self.first_epoch, self.last_epoch)}
+
+    def read(self, flush=False):
+        # Returns (epochs, rows) of the rows joined since the last call
+        self._pull()
+        if not self._pick_reference():
+            return np.empty(0, dtype=np.int64), np.empty((0, len(self.columns)), dtype=np.float32)
+        threshold = self._decided(flush)
+        ref = self.pending[self.reference]
+        n = 0 if threshold is None else int(np.searchsorted(ref['epoch'], threshold, side='right'))
+        epochs = ref['epoch'][:n].astype(np.int64)
+
+        # Last sample of every stream at or before each reference epoch
+        indices = []
+        valid = np.ones(n, dtype=bool)
+        for k, pending in enumerate(self.pending):
+            if k == self.reference:
+                idx = np.arange(n)
+            else:
+                idx = np.searchsorted(pending['epoch'], epochs + self.tolerance_ms, side='right') - 1
+                valid &= idx >= 0
+            indices.append(idx)
+        self.unmatched += n - int(valid.sum())
+        epochs = epochs[valid]
+
+        rows = np.empty((len(epochs), len(self.columns)), dtype=np.float32)
+        column = 0
+        for k, (pending, buffer) in enumerate(zip(self.pending, self.buffers)):
+            width = len(buffer.channels)
+            idx = indices[k][valid]
+            values = recfunctions.structured_to_unstructured(pending[list(buffer.channels)])
+            if len(idx):
+                rows[:, column:column + width] = values[idx]
+                used = self.base[k] + idx
+                new = np.diff(np.r_[self.last_used[k], used]) > 0
+                self.joined[k] += int(new.sum())
+                self.held[k] += int(len(new) - new.sum())
+                self.last_used[k] = int(used[-1])
+                if self.mode == 'linear' and k != self.reference:
+                    # Between the held sample and the next one, if it already arrived
+                    inside = (idx + 1 < len(pending)) & (pending['epoch'][idx] < epochs)
+                    left, right = idx[inside], idx[inside] + 1
+                    span = (pending['epoch'][right] - pending['epoch'][left]).astype(np.float32)
+                    weight = ((epochs[inside] - pending['epoch'][left]) / span)[:, None]
+                    rows[inside, column:column + width] = values[left] + weight * (values[right] - values[left])
+                    self.interpolated[k] += int(inside.sum())
+            column += width
+
+        # The reference samples joined are released, the other streams keep the sample they hold
+        if n:
+            for k, pending in enumerate(self.pending):
+                keep = n if k == self.reference else max(0, int(indices[k][-1]))
+                self.pending[k] = pending[keep:]
+                self.base[k] += keep
+        elif threshold is not None and len(ref) == 0:
+            for k, pending in enumerate(self.pending):
+                keep = max(0, int(np.searchsorted(pending['epoch'], threshold + self.tolerance_ms, side='right')) - 1)
+                self.pending[k] = pending[keep:]
+                self.base[k] += keep
+
+        self.rows += len(epochs)
+        if self.output is not None and len(epochs):
+            out = np.empty(len(epochs), dtype=self.output.dtype)
+            out['epoch'] = epochs
+            for i, name in enumerate(self.columns):
+                out[name] = rows[:, i]
+            self.output.extend(out)
+        return epochs, rows
+
+    def flush(self):
+        return self.read(flush=True)
+
+    def skipped(self, k):
+        # Samples of stream k up to the last one joined that never made it into a row
+        return self.last_used[k] + 1 - self.joined[k]
+
+    def report(self):
+        if self.reference is None:
+            return "no rows joined"
+        rates = self.rates()
+        parts = [f"{self.rows} rows at the rate of {self.names[self.reference]} ({rates[self.names[self.reference]]:.1f} Hz)"]
+        for k, name in enumerate(self.names):
+            if k != self.reference:
+                text = f"{name} {rates[name]:.1f} Hz: {self.joined[k]} joined, {self.held[k]} held"
+                if self.mode == 'linear':
+                    text += f", {self.interpolated[k]} interpolated"
+                parts.append(text + f", {self.skipped(k)} skipped")
+        parts.append(f"{self.unmatched} unmatched, {self.dropped} dropped")
+        return '; '.join(parts)
@@ -6,6 +6,10 @@ from threading import Event, Thread, Lock, RLock
 from collections import deque
 import sys
 import time
+from sensor_profiles import PROFILES, check
+from session_bringup import bring_up, report
+
+PROFILE = PROFILES['fusion_quaternion']
 
 class State:
     def __init__(self, device, states):
@@ -40,39 +44,41 @@ class State:
         print("Combined Buffer:")
         print(bufferA)
 
+def configure_sensor(state):
+    print("Configuring device " + state.device.address)
+    PROFILE.connection.apply(state.device)
+    sleep(1.5)
+    PROFILE.configure(state.device)
+    PROFILE.subscribe(state.device, state.callback)
+    PROFILE.start(state.device)
+
 def connect_and_configure_sensors(device_addresses):
+    # All the boards at the same time (session_bringup.py), the states keep the order of the addresses
+    slots = [None] * len(device_addresses)
     states = []
-    for address in device_addresses:
-        d = MetaWear(address)
-        d.connect()
-        print("Connected to " + d.address + " over " + ("USB" if d.usb.is_connected else "BLE"))
-        states.append(State(d, states))  # Pasar referencia de todos los estados
 
-    for s in states:
-        print("Configuring device")
-        libmetawear.mbl_mw_settings_set_connection_parameters(s.device.board, 7.5, 7.5, 0, 6000)
-        sleep(1.5)
-        libmetawear.mbl_mw_sensor_fusion_set_mode(s.device.board, SensorFusionMode.NDOF)
-        libmetawear.mbl_mw_sensor_fusion_set_acc_range(s.device.board, SensorFusionAccRange._8G)
-        libmetawear.mbl_mw_sensor_fusion_set_gyro_range(s.device.board, SensorFusionGyroRange._2000DPS)
-        libmetawear.mbl_mw_sensor_fusion_write_config(s.device.board)
-        signal = libmetawear.mbl_mw_sensor_fusion_get_data_signal(s.device.board, SensorFusionData.QUATERNION)
-        libmetawear.mbl_mw_datasignal_subscribe(signal, None, s.callback)
-        libmetawear.mbl_mw_sensor_fusion_enable_data(s.device.board, SensorFusionData.QUATERNION)
-        libmetawear.mbl_mw_sensor_fusion_start(s.device.board)
+    def setup(index, device):
+        print("Connected to " + device.address + " over " + ("USB" if device.usb.is_connected else "BLE"))
+        slots[index] = State(device, states)  # Pasar referencia de todos los estados
+        configure_sensor(slots[index])
 
+    results, seconds = bring_up(device_addresses, setup)
+    print(report(results, seconds))
+    states.extend(state for state, result in zip(slots, results) if result.ok)
     return states
 
 def disconnect_sensors(states):
     for s in states:
-        libmetawear.mbl_mw_sensor_fusion_stop(s.device.board)
-        signal = libmetawear.mbl_mw_sensor_fusion_get_data_signal(s.device.board, SensorFusionData.QUATERNION)
-        libmetawear.mbl_mw_datasignal_unsubscribe(signal)
+        PROFILE.stop(s.device)
         libmetawear.mbl_mw_debug_disconnect(s.device.board)
         print("Disconnected from " + s.device.address)
 
 def main():
     device_addresses = sys.argv[1:]
+    try:
+        print(check(PROFILE, len(device_addresses)))
+    except ValueError as e:
+        sys.exit(str(e))
     states = connect_and_configure_sensors(device_addresses)
     try:
         print("Streaming data. Press CTRL+C to stop.")
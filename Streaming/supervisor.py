@@ -0,0 +1,129 @@
+# Supervision of the stream of one board: stall detection, reconnection with backoff and gap accounting
+# watch() runs in the capture thread of the board in place of the `while device.streaming: sleep()` loop
+# and every CHECK_PERIOD reads the samples that arrived in the ring buffer of the board:
+#   - epochs that jump by more than GAP_PERIODS sample periods are a gap (samples lost on the way, the
+#     link recovered by itself)
+#   - no sample for `stall_s`, or the link reported down (on_disconnect), is a dropout: the board is
+#     re-attached if the link is down (DeviceRegistry.reattach, warm) and re-armed with rearm() (sensor
+#     fusion configured and started again, the callbacks subscribed again). Attempts are repeated with
+#     exponential backoff (BACKOFF) until samples arrive again or the capture stops.
+# Every gap is marked in the buffer (SampleRingBuffer.mark_gap) and passed to on_gap(sensor, start, end),
+# with `sensor` the index of the board in the session: on_gap=recorder.mark_gap marks it in the recording
+# (Recorder.mark_gap) as well. Every dropout is also a row of `events_file`: board, kind (gap, stall,
+# disconnect), epochs around the gap, samples lost, time to recover (from the last sample before the gap
+# to the first one after it) and attempts; report() sums them up for the session.
+import csv
+import os
+import threading
+import time
+from datetime import datetime
+import numpy as np
+from device_registry import DeviceRegistry
+
+CHECK_PERIOD = 0.1  # s
+STALL_S = 1.0       # s without samples before the stream is taken as stalled
+GAP_PERIODS = 3     # Epoch jumps longer than this many sample periods are gaps
+BACKOFF = (0.25, 8.0)  # s, first and longest wait between two recovery attempts
+EVENTS_FILE = 'connection_events.csv'
+EVENT_FIELDS = ['time', 'address', 'kind', 'gap_start', 'gap_end', 'samples_lost', 'recover_s', 'attempts']
+
+class Supervisor:
+    def __init__(self, device, buffer, rearm, rate, registry=None, stall_s=STALL_S, on_gap=None,
+                 events_file=EVENTS_FILE, sensor=0):
+        self.device = device
+        self.sensor = sensor
+        self.buffer = buffer
+        self.rearm = rearm
+        self.rate = float(rate)
+        self.period_ms = 1000.0 / self.rate
+        self.registry = registry or DeviceRegistry()
+        self.stall_s = stall_s
+        self.on_gap = on_gap
+        self.events_file = events_file
+        self.events = []
+        self.link_lost = threading.Event()
+        device.on_disconnect = lambda status: self.link_lost.set()
+
+    def watch(self, running):
+        # Supervises the stream until running() returns False
+        cursor = self.buffer.count
+        latest = self.buffer.latest()
+        last_epoch = int(latest['epoch']) if latest is not None else None
+        last_arrival = time.perf_counter()
+        dropout = None  # Recovery in progress: kind, since (last arrival), attempts, next try, delay
+        while running():
+            self.link_lost.wait(CHECK_PERIOD)
+            new, cursor, _ = self.buffer.read_since(cursor)
+            now = time.perf_counter()
+            if len(new):
+                epochs = new['epoch'].astype(np.int64)
+                # Before the first sample of the board there is no gap to measure, only the ones inside `new`
+                previous = last_epoch if last_epoch is not None else int(epochs[0])
+                steps = np.diff(np.r_[previous, epochs])
+                jumps = np.flatnonzero(steps > GAP_PERIODS * self.period_ms)
+                if dropout is not None and last_epoch is not None and (len(jumps) == 0 or jumps[0] != 0):
+                    jumps = np.r_[0, jumps]  # The first sample after a dropout always closes it
+                for i in jumps:
+                    start = previous if i == 0 else int(epochs[i - 1])
+                    if i == 0 and dropout is not None:
+                        self._event(dropout['kind'], start, int(epochs[0]), now - dropout['since'],
+                                    dropout['attempts'])
+                    else:
+                        self._event('gap', start, int(epochs[i]), (epochs[i] - start) / 1000.0, 0)
+                dropout = None
+                last_epoch = int(epochs[-1])
+                last_arrival = now
+            elif dropout is None and (self.link_lost.is_set() or now - last_arrival > self.stall_s):
+                kind = 'disconnect' if self.link_lost.is_set() or not self.device.is_connected else 'stall'
+                print(f"{self.device.address}: {kind}, no samples for {now - last_arrival:.1f} s, recovering")
+                dropout = {'kind': kind, 'since': last_arrival, 'attempts': 0, 'next': now, 'delay': BACKOFF[0]}
+            if dropout is not None and now >= dropout['next']:
+                self._recover(dropout)
+                dropout['next'] = time.perf_counter() + dropout['delay']
+                dropout['delay'] = min(dropout['delay'] * 2, BACKOFF[1])
+        if dropout is not None:
+            # Capture stopped before the board came back
+            lost_s = time.perf_counter() - dropout['since']
+            start = last_epoch if last_epoch is not None else 0
+            self._event(dropout['kind'], start, start + int(lost_s * 1000), None, dropout['attempts'])
+
+    def _recover(self, dropout):
+        dropout['attempts'] += 1
+        try:
+            if self.link_lost.is_set() or not self.device.is_connected:
+                self.link_lost.clear()
+                ms = self.registry.reattach(self.device)
+                print(f"{self.device.address}: reattached in {ms:.0f} ms")
+            self.rearm()
+        except Exception as e:
+            print(f"{self.device.address}: recovery attempt {dropout['attempts']} failed: {e}")
+
+    def _event(self, kind, start, end, recover_s, attempts):
+        lost = max(0, int(round((end - start) / self.period_ms)) - 1)
+        self.buffer.mark_gap(start, end)
+        if self.on_gap is not None:
+            self.on_gap(self.sensor, start, end)
+        event = {'time': datetime.now().isoformat(timespec='milliseconds'), 'address': self.device.address,
+                 'kind': kind, 'gap_start': start, 'gap_end': end, 'samples_lost': lost,
+                 'recover_s': '' if recover_s is None else round(recover_s, 3), 'attempts': attempts}
+        self.events.append(event)
+        if kind != 'gap':
+            print(f"{self.device.address}: {kind} " + (f"recovered in {recover_s:.2f} s" if recover_s is not None
+                                                        else "not recovered") + f", {lost} samples lost")
+        if self.events_file:
+            new_file = not os.path.exists(self.events_file)
+            with open(self.events_file, 'a', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=EVENT_FIELDS)
+                if new_file:
+                    writer.writeheader()
+                writer.writerow(event)
+
+    def report(self):
+        dropouts = [e for e in self.events if e['kind'] != 'gap']
+        lost = sum(e['samples_lost'] for e in self.events)
+        recover = [e['recover_s'] for e in dropouts if e['recover_s'] != '']
+        text = (f"{self.device.address}: {len(dropouts)} dropouts, {len(self.events) - len(dropouts)} gaps, "
+                f"{lost} samples lost ({lost / self.rate:.1f} s)")
+        if recover:
+            text += f", time to recover median {np.median(recover):.2f} s max {max(recover):.2f} s"
+        return text
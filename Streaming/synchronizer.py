@@ -0,0 +1,116 @@
+# N-way alignment of sensor streams on the board epoch
+# Every sample of the reference sensor is joined with the nearest sample (in epoch) of each other
+# sensor; the frame is emitted only if all of them are within `tolerance_ms`, otherwise it is counted
+# as unmatched. Frames come out as one contiguous float32 row per frame with the channels of every
+# sensor concatenated, e.g. [chest w x y z, arm w x y z], the input layout of the LSTM.
+#
+# EpochSynchronizer is the streaming version over the ring buffers: a reference sample is decided when
+# every sensor has delivered a sample later than epoch + tolerance, or when it is older than
+# `max_wait_ms` behind the newest sample of any sensor (a stalled sensor does not block the others).
+# align() is the offline version for arrays already in memory (exports at the end of a session).
+import numpy as np
+from numpy.lib import recfunctions
+from ring_buffer import SampleRingBuffer
+
+def _nearest(reference, epochs):
+    # Index of the nearest sample of `epochs` (sorted) for every reference epoch and its distance in ms
+    idx = np.searchsorted(epochs, reference)
+    left = np.clip(idx - 1, 0, len(epochs) - 1)
+    right = np.clip(idx, 0, len(epochs) - 1)
+    nearest = np.where(np.abs(reference - epochs[left]) <= np.abs(epochs[right] - reference), left, right)
+    return nearest, np.abs(epochs[nearest] - reference)
+
+def align(streams, tolerance_ms, reference=0):
+    # Returns the records of every stream joined on the reference, all of them with the same length
+    ref_epochs = streams[reference]['epoch']
+    matched = np.ones(len(ref_epochs), dtype=bool)
+    indices = []
+    for k, records in enumerate(streams):
+        if k == reference:
+            indices.append(np.arange(len(ref_epochs)))
+        elif len(records) == 0:
+            matched[:] = False
+            indices.append(np.zeros(len(ref_epochs), dtype=np.int64))
+        else:
+            idx, distance = _nearest(ref_epochs, records['epoch'])
+            matched &= distance <= tolerance_ms
+            indices.append(idx)
+    return [records[idx[matched]] for records, idx in zip(streams, indices)]
+
+class EpochSynchronizer:
+    def __init__(self, buffers, tolerance_ms=5, max_wait_ms=100, reference=0, capacity=None):
+        # buffers: {name: SampleRingBuffer}, the name prefixes the columns of the frames ('chest_w', ...)
+        self.names = list(buffers)
+        self.buffers = list(buffers.values())
+        self.columns = [f"{name}_{channel}" for name, buffer in buffers.items() for channel in buffer.channels]
+        self.tolerance_ms = tolerance_ms
+        self.max_wait_ms = max_wait_ms
+        self.reference = reference
+        self.cursors = [0] * len(self.buffers)
+        self.pending = [np.empty(0, dtype=buffer.dtype) for buffer in self.buffers]
+        self.last_epoch = [None] * len(self.buffers)
+        # Optional ring buffer of the aligned frames, e.g. the last 100 frames for the LSTM window
+        self.output = SampleRingBuffer(self.columns, capacity) if capacity else None
+        self.frames = 0     # Frames emitted
+        self.unmatched = 0  # Reference samples without a match in every sensor
+        self.dropped = 0    # Samples overwritten in the ring buffers before they were read
+
+    def _pull(self):
+        for k, buffer in enumerate(self.buffers):
+            new, self.cursors[k], lost = buffer.read_since(self.cursors[k])
+            self.dropped += lost
+            if len(new):
+                self.pending[k] = np.concatenate([self.pending[k], new])
+                self.last_epoch[k] = int(new['epoch'][-1])
+
+    def _decided(self):
+        # Reference epochs up to this value can not get a better match anymore
+        seen = [epoch for epoch in self.last_epoch if epoch is not None]
+        if not seen:
+            return None
+        horizon = max(seen) - self.max_wait_ms
+        if len(seen) < len(self.last_epoch):
+            return horizon
+        others = [epoch for k, epoch in enumerate(self.last_epoch) if k != self.reference]
+        return max(horizon, min(others) - self.tolerance_ms) if others else max(seen)
+
+    def read(self, flush=False):
+        # Returns (epochs, frames) of the frames aligned since the last call
+        self._pull()
+        threshold = np.iinfo(np.int64).max if flush else self._decided()
+        ref = self.pending[self.reference]
+        n = 0 if threshold is None else int(np.searchsorted(ref['epoch'], threshold, side='right'))
+        streams = [ref[:n] if k == self.reference else pending for k, pending in enumerate(self.pending)]
+        aligned = align(streams, self.tolerance_ms, self.reference)
+        self.unmatched += n - len(aligned[self.reference])
+
+        # Samples that can not match the next reference samples are released
+        if n:
+            cut = (int(ref['epoch'][n]) if n < len(ref) else max(threshold, int(ref['epoch'][n - 1]))) - self.tolerance_ms
+            for k, pending in enumerate(self.pending):
+                if k == self.reference:
+                    self.pending[k] = ref[n:]
+                else:
+                    self.pending[k] = pending[np.searchsorted(pending['epoch'], cut):]
+        elif threshold is not None and len(ref) == 0:
+            for k, pending in enumerate(self.pending):
+                self.pending[k] = pending[np.searchsorted(pending['epoch'], threshold - self.tolerance_ms):]
+
+        epochs = aligned[self.reference]['epoch'].copy()
+        frames = np.empty((len(epochs), len(self.columns)), dtype=np.float32)
+        column = 0
+        for records, buffer in zip(aligned, self.buffers):
+            width = len(buffer.channels)
+            frames[:, column:column + width] = recfunctions.structured_to_unstructured(records[list(buffer.channels)])
+            column += width
+        self.frames += len(epochs)
+        if self.output is not None and len(epochs):
+            out = np.empty(len(epochs), dtype=self.output.dtype)
+            out['epoch'] = epochs
+            for i, name in enumerate(self.columns):
+                out[name] = frames[:, i]
+            self.output.extend(out)
+        return epochs, frames
+
+    def flush(self):
+        return self.read(flush=True)